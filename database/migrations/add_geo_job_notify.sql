@@ -0,0 +1,45 @@
+-- =========================================================
+-- إشعار الـ workers فور إضافة geo job (LISTEN/NOTIFY)
+-- Wake idle geoprocessing workers when a geo job becomes queued
+-- =========================================================
+--
+-- الـ workers تنفذ LISTEN geo_jobs_queued وتطلب jobs فور وصول الإشعار،
+-- والـ polling يبقى كاحتياط بطيء فقط (إشعار مفقود أو اتصال منقطع).
+--
+-- الـ payload (JSON): {"id", "taskType", "priority", "scheduledAt"}
+-- الإشعار يُرسل عند الـ COMMIT، لذا يجد الـ worker الـ job عند طلبه.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION notify_geo_job_queued() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify(
+    'geo_jobs_queued',
+    json_build_object(
+      'id', NEW.id,
+      'taskType', NEW.task_type,
+      'priority', NEW.priority,
+      'scheduledAt', NEW.scheduled_at
+    )::text
+  );
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Jobs inserted as queued
+DROP TRIGGER IF EXISTS geo_jobs_notify_insert ON geo_jobs;
+CREATE TRIGGER geo_jobs_notify_insert
+  AFTER INSERT ON geo_jobs
+  FOR EACH ROW
+  WHEN (NEW.status = 'queued')
+  EXECUTE FUNCTION notify_geo_job_queued();
+
+-- Jobs returned to the queue (retries, jobs released by a stopping worker)
+DROP TRIGGER IF EXISTS geo_jobs_notify_requeue ON geo_jobs;
+CREATE TRIGGER geo_jobs_notify_requeue
+  AFTER UPDATE OF status ON geo_jobs
+  FOR EACH ROW
+  WHEN (NEW.status = 'queued' AND OLD.status IS DISTINCT FROM 'queued')
+  EXECUTE FUNCTION notify_geo_job_queued();
+
+COMMIT;
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Block-Parallel Execution Engine
+===============================
+
+تشغيل kernels على نوافذ/blocks ملف raster واحد عبر thread pool:
+
+- كل thread يفتح dataset handle خاص به (GDAL handles ليست thread-safe)،
+  وGDAL يحرر الـ GIL أثناء قراءة وفك ضغط الـ blocks فيتحقق تسريع حقيقي
+- map: نتيجة لكل عنصر (مثل شرائح الـ preview أو مجموعات الـ tiles)
+- reduce: accumulator لكل thread يُدمج في النهاية (مثل الإحصائيات والـ histograms)
+
+مع workers = 1 تُنفذ الـ kernels مباشرة على الـ dataset المفتوح دون threads.
+"""
+
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, TypeVar
+
+import rasterio
+
+import logging
+logger = logging.getLogger('block-engine')
+
+T = TypeVar('T')
+
+# Below this many items per thread, opening extra handles costs more than it saves
+MIN_ITEMS_PER_WORKER = 4
+
+
+class BlockEngine:
+    """
+    thread pool مع dataset handle لكل thread
+
+    مثال:
+        with BlockEngine('input.tif', workers=4) as engine:
+            sums = engine.map(lambda dataset, window: dataset.read(1, window=window).sum(), windows)
+    """
+
+    def __init__(self, file_path: str, workers: int = 1, dataset=None, **open_kwargs):
+        """
+        Args:
+            file_path: مسار الملف (يُفتح لكل thread)
+            workers: عدد الـ threads
+            dataset: dataset مفتوح يُستخدم مباشرة عند workers = 1
+            open_kwargs: خيارات rasterio.open (مثل overview_level)
+        """
+        self.file_path = file_path
+        self.workers = max(1, int(workers))
+        self.open_kwargs = open_kwargs
+        self._dataset = dataset
+        self._local = threading.local()
+        self._handles: List[Any] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def handle(self):
+        """dataset handle الخاص بالـ thread الحالي (يُفتح مرة واحدة)"""
+        dataset = getattr(self._local, 'dataset', None)
+        if dataset is None:
+            dataset = rasterio.open(self.file_path, **self.open_kwargs)
+            self._local.dataset = dataset
+            with self._lock:
+                self._handles.append(dataset)
+        return dataset
+
+    @property
+    def dataset(self):
+        """الـ dataset المستخدم في الـ thread الحالي دون pool (المفتوح مسبقًا إن وُجد)"""
+        if self._dataset is None or self._dataset.closed:
+            return self.handle()
+        return self._dataset
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='block-engine')
+        return self._executor
+
+    def map(self, kernel: Callable[[Any, Any], T], items: Sequence[Any]) -> List[T]:
+        """
+        تشغيل kernel(dataset, item) لكل عنصر وإرجاع النتائج بنفس ترتيب العناصر
+        """
+        if self.workers == 1 or len(items) <= 1:
+            dataset = self.dataset
+            return [kernel(dataset, item) for item in items]
+
+        return list(self._pool().map(lambda item: kernel(self.handle(), item), items))
+
+    def reduce(self, kernel: Callable[[Any, Any, T], None], items: Sequence[Any],
+               initial: Callable[[], T], merge: Callable[[T, T], None],
+               min_items_per_worker: int = MIN_ITEMS_PER_WORKER) -> T:
+        """
+        تجميع النتائج: لكل thread accumulator واحد يُحدّث بـ kernel(dataset, item, accumulator)
+        ثم تُدمج الـ accumulators عبر merge(target, other)
+
+        العناصر تُوزع بشكل متداخل (interleaved) لتوزيع الـ blocks المتجاورة على جميع الـ threads.
+        """
+        workers = max(1, min(self.workers, len(items) // max(1, min_items_per_worker)))
+
+        if workers == 1:
+            dataset = self.dataset
+            accumulator = initial()
+            for item in items:
+                kernel(dataset, item, accumulator)
+            return accumulator
+
+        def run_slice(slice_items: Sequence[Any]) -> T:
+            dataset = self.handle()
+            accumulator = initial()
+            for item in slice_items:
+                kernel(dataset, item, accumulator)
+            return accumulator
+
+        partials = list(self._pool().map(run_slice, [items[index::workers] for index in range(workers)]))
+        result = partials[0]
+        for partial in partials[1:]:
+            merge(result, partial)
+        return result
+
+    def close(self):
+        """إيقاف الـ threads وإغلاق جميع الـ handles المفتوحة"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            for dataset in self._handles:
+                dataset.close()
+            self._handles.clear()
+        self._local = threading.local()
+
+    def __enter__(self) -> 'BlockEngine':
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def row_strips(height: int, strip_rows: int) -> List[tuple]:
+    """تقسيم الصفوف إلى شرائح (row_start, row_stop)"""
+    return [(row_start, min(height, row_start + strip_rows)) for row_start in range(0, height, strip_rows)]
+
+
+def strip_rows_for(height: int, workers: int, max_rows: int = 256, min_rows: int = 16) -> int:
+    """ارتفاع شريحة يعطي عدة شرائح لكل thread دون تجاوز max_rows"""
+    if workers <= 1:
+        return max_rows
+    return max(min_rows, min(max_rows, math.ceil(height / (workers * 4))))
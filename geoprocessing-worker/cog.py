@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Cloud-Optimized GeoTIFF Writer
+==============================
+
+تحويل GeoTIFF إلى COG (tiled + compressed + internal overviews) بطريقة
+windowed بحيث لا يُحمّل الملف كاملًا في الذاكرة، ليتمكن المستخدمون من
+قراءة مستوى الـ zoom المطلوب فقط عبر HTTP range requests.
+"""
+
+import os
+import time
+from typing import Dict, Any, List
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+import logging
+logger = logging.getLogger('cog-writer')
+
+
+def overview_factors(width: int, height: int, block_size: int = 512) -> List[int]:
+    """معاملات الـ overviews (2, 4, 8, ...) حتى يصبح المستوى أصغر من block واحد"""
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= block_size:
+        factors.append(factor)
+        factor *= 2
+    if not factors and max(width, height) > block_size // 2:
+        factors.append(2)
+    return factors
+
+
+def _level_shapes(path: str) -> List[Dict[str, int]]:
+    """
+    أبعاد كل مستوى كما أنتجها GDAL، وحجمه المضغوط من BLOCK_OFFSET / BLOCK_SIZE في metadata الـ TIFF
+    """
+    levels = []
+    with rasterio.open(path) as cog:
+        block_height, block_width = cog.block_shapes[0]
+        for level, factor in enumerate([1] + cog.overviews(1)):
+            ovr = level - 1 if level else None
+            if ovr is None:
+                width, height = cog.width, cog.height
+            else:
+                with rasterio.open(path, overview_level=ovr) as overview:
+                    width, height = overview.width, overview.height
+
+            # Pixel-interleaved bands share blocks: count each offset once
+            blocks = {}
+            for band in range(1, cog.count + 1):
+                for row in range(-(-height // block_height)):
+                    for col in range(-(-width // block_width)):
+                        offset = cog.get_tag_item(f'BLOCK_OFFSET_{col}_{row}', 'TIFF', bidx=band, ovr=ovr)
+                        size = cog.get_tag_item(f'BLOCK_SIZE_{col}_{row}', 'TIFF', bidx=band, ovr=ovr)
+                        if offset is not None and size is not None:
+                            blocks[offset] = int(size)
+
+            levels.append({
+                'level': level,
+                'factor': factor,
+                'width': width,
+                'height': height,
+                'size_bytes': sum(blocks.values())
+            })
+    return levels
+
+
+def write_cog(dataset, output_path: str, block_size: int = 512, compress: str = 'deflate',
+              resampling: str = 'average') -> Dict[str, Any]:
+    """
+    كتابة COG من dataset مفتوح
+
+    1. نسخ البيانات block بـ block إلى GeoTIFF مؤقت (tiled + compressed)
+    2. بناء جميع مستويات الـ overview باستدعاء واحد (كل مستوى يُشتق من السابق)
+    3. نسخ الملف بترتيب COG (الـ overviews قبل البيانات) عبر COPY_SRC_OVERVIEWS
+
+    الـ profile يُبنى من الحقول اللازمة فقط: خيارات الإنشاء في الملف الأصلي (photometric،
+    interleave، جودة JPEG ...) قد لا تتوافق مع ضغط deflate و predictor.
+
+    Returns:
+        تقرير بالحجم والأبعاد لكل مستوى (كما أنتجها GDAL)، وأزمنة الترميز لكل مرحلة:
+        overview_seconds زمن جميع مستويات الـ overview معًا (GDAL يبنيها في تمريرة واحدة
+        فلا يوجد زمن منفصل لكل مستوى)
+    """
+    temp_path = f"{output_path}.tmp.tif"
+    is_float = np.issubdtype(np.dtype(dataset.dtypes[0]), np.floating)
+
+    profile = dict(
+        driver='GTiff',
+        width=dataset.width,
+        height=dataset.height,
+        count=dataset.count,
+        dtype=dataset.dtypes[0],
+        crs=dataset.crs,
+        transform=dataset.transform,
+        nodata=dataset.nodata,
+        tiled=True,
+        blockxsize=block_size,
+        blockysize=block_size,
+        compress=compress,
+        predictor=3 if is_float else 2,
+        BIGTIFF='IF_SAFER'
+    )
+
+    try:
+        # Full-resolution level, written window by window
+        level_start = time.perf_counter()
+        with rasterio.open(temp_path, 'w', **profile) as temp:
+            for _, window in temp.block_windows(1):
+                temp.write(dataset.read(window=window), window=window)
+        full_seconds = time.perf_counter() - level_start
+
+        # All overview levels in one pass: GDAL derives each level from the previous one
+        factors = overview_factors(dataset.width, dataset.height, block_size)
+        overview_start = time.perf_counter()
+        if factors:
+            with rasterio.open(temp_path, 'r+') as temp:
+                temp.build_overviews(factors, Resampling[resampling])
+        overview_seconds = time.perf_counter() - overview_start
+
+        # Rewrite with overviews placed before full-resolution data (COG layout)
+        layout_start = time.perf_counter()
+        rasterio.shutil.copy(
+            temp_path,
+            output_path,
+            driver='GTiff',
+            copy_src_overviews=True,
+            tiled=True,
+            blockxsize=block_size,
+            blockysize=block_size,
+            compress=compress,
+            predictor=profile['predictor'],
+            BIGTIFF='IF_SAFER'
+        )
+        layout_seconds = time.perf_counter() - layout_start
+
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    levels = _level_shapes(output_path)
+    report = {
+        'path': output_path,
+        'size_bytes': os.path.getsize(output_path),
+        'block_size': block_size,
+        'compression': compress,
+        'overview_resampling': resampling,
+        'levels': levels,
+        'full_resolution_seconds': round(full_seconds, 4),
+        'overview_seconds': round(overview_seconds, 4),
+        'layout_seconds': round(layout_seconds, 4),
+        'encode_seconds': round(full_seconds + overview_seconds + layout_seconds, 4)
+    }
+
+    logger.info(
+        f"COG written: {output_path} ({report['size_bytes']} bytes, "
+        f"{len(levels) - 1} overview levels, {report['encode_seconds']:.2f}s)"
+    )
+    return report
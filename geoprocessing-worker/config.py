@@ -35,7 +35,14 @@ class WorkerConfig:
     API_TIMEOUT = int(os.getenv('API_TIMEOUT', 30))
     
     # Polling Configuration
-    POLL_INTERVAL = int(os.getenv('POLL_INTERVAL', 5))  # seconds
+    # Deprecated fixed interval: when set it stays the idle wait, as the default backoff cap
+    POLL_INTERVAL = float(os.getenv('POLL_INTERVAL')) if os.getenv('POLL_INTERVAL') else None
+    POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', POLL_INTERVAL or 30))  # idle backoff cap (seconds)
+    POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', min(0.5, POLL_MAX_INTERVAL)))  # first wait after an empty claim (seconds)
+    POLL_JITTER = float(os.getenv('POLL_JITTER', 0.5))  # randomized fraction of each wait
+    CLAIM_WAIT_SECONDS = float(os.getenv('CLAIM_WAIT_SECONDS', 0))  # long-poll claim hold, 0 = off (max 30)
+    JOB_NOTIFY = os.getenv('JOB_NOTIFY', 'true').lower() == 'true'  # LISTEN geo_jobs_queued for push wake-ups
+    NOTIFY_POLL_INTERVAL = int(os.getenv('NOTIFY_POLL_INTERVAL', 60))  # fallback poll while listening (seconds)
     HEARTBEAT_INTERVAL = int(os.getenv('HEARTBEAT_INTERVAL', 30))  # seconds
     MAX_PROCESSING_TIME = int(os.getenv('MAX_PROCESSING_TIME', 3600))  # 1 hour
     MAX_RETRY_ATTEMPTS = int(os.getenv('MAX_RETRY_ATTEMPTS', 3))
@@ -49,6 +56,11 @@ class WorkerConfig:
     TEMP_DIR = os.getenv('TEMP_DIR', '/tmp')
     CLEANUP_TEMP_FILES = os.getenv('CLEANUP_TEMP_FILES', 'true').lower() == 'true'
     
+    # Result Cache (outputs keyed by input hash + job config + WORKER_VERSION)
+    RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+    RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join(TEMP_DIR, 'geoprocessing-result-cache'))
+    RESULT_CACHE_MAX_SIZE = int(os.getenv('RESULT_CACHE_MAX_SIZE', 2 * 1024 * 1024 * 1024))  # 2GB
+    
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -58,8 +70,21 @@ class WorkerConfig:
     
     # Performance Configuration
     CONCURRENT_JOBS = int(os.getenv('CONCURRENT_JOBS', 1))  # Number of jobs to process simultaneously
+    CLAIM_BATCH_SIZE = int(os.getenv('CLAIM_BATCH_SIZE', 4))  # Jobs claimed per round trip
+    PREFETCH_SIZE = int(os.getenv('PREFETCH_SIZE', 2))  # Claimed jobs waiting locally for a free slot
     MEMORY_LIMIT_MB = int(os.getenv('MEMORY_LIMIT_MB', 2048))  # 2GB
     CPU_CORES = int(os.getenv('CPU_CORES', 1))
+    DOWNLOAD_CONCURRENCY = int(os.getenv('DOWNLOAD_CONCURRENCY', 4))  # Parallel input downloads per job
+    DOWNLOAD_SEGMENTS = int(os.getenv('DOWNLOAD_SEGMENTS', 4))  # Parallel byte ranges per large file
+    DOWNLOAD_SEGMENT_THRESHOLD = int(os.getenv('DOWNLOAD_SEGMENT_THRESHOLD', 32 * 1024 * 1024))  # 32MB
+    DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', 4))  # Resume attempts after a dropped connection
+    UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 4))  # Parallel output uploads (files and parts)
+    UPLOAD_MULTIPART_THRESHOLD = int(os.getenv('UPLOAD_MULTIPART_THRESHOLD', 32 * 1024 * 1024))  # 32MB
+    UPLOAD_PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', 16 * 1024 * 1024))  # 16MB
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 2))  # Files buffered between job stages
+    PROCESSING_EXECUTOR = os.getenv('PROCESSING_EXECUTOR', 'process')  # 'process' or 'thread'
+    LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.1))  # seconds between lag samples
+    LOOP_LAG_WARN_MS = float(os.getenv('LOOP_LAG_WARN_MS', 500))  # log a warning above this lag
     
     # Monitoring Configuration
     METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
@@ -107,14 +132,22 @@ class WorkerConfig:
         if cls.CONCURRENT_JOBS < 1:
             issues.append("CONCURRENT_JOBS must be at least 1")
         
+        warnings = []
+        if cls.POLL_INTERVAL is not None:
+            warnings.append(
+                f"POLL_INTERVAL is deprecated: idle polling backs off between {cls.POLL_MIN_INTERVAL}s and "
+                f"{cls.POLL_MAX_INTERVAL}s (POLL_INTERVAL is the cap unless POLL_MAX_INTERVAL is set)"
+            )
+        
         return {
             'valid': len(issues) == 0,
             'issues': issues,
+            'warnings': warnings,
             'config_summary': {
                 'worker_name': cls.WORKER_NAME,
                 'api_url': cls.API_BASE_URL,
                 'db_host': cls.DB_CONFIG['host'],
-                'poll_interval': cls.POLL_INTERVAL,
+                'poll_interval': f"{cls.POLL_MIN_INTERVAL}-{cls.POLL_MAX_INTERVAL}",
                 'max_file_size_mb': cls.MAX_FILE_SIZE // (1024 * 1024),
                 'concurrent_jobs': cls.CONCURRENT_JOBS
             }
@@ -126,11 +159,25 @@ class WorkerConfig:
         return {
             'max_image_size': int(os.getenv('MAX_IMAGE_SIZE', 4096)),  # Max PNG dimensions
             'compression_quality': int(os.getenv('COMPRESSION_QUALITY', 85)),
+            'encoding_profile': os.getenv('ENCODING_PROFILE', 'balanced'),
+            'output_format': os.getenv('OUTPUT_FORMAT', 'png'),
             'preserve_transparency': os.getenv('PRESERVE_TRANSPARENCY', 'true').lower() == 'true',
+            'stretch_percentiles': os.getenv('STRETCH_PERCENTILES', '2,98'),
+            'distinct_count_error': float(os.getenv('DISTINCT_COUNT_ERROR', 0.01)),
             'generate_thumbnails': os.getenv('GENERATE_THUMBNAILS', 'true').lower() == 'true',
             'thumbnail_size': int(os.getenv('THUMBNAIL_SIZE', 256)),
-            'coordinate_system': os.getenv('OUTPUT_CRS', 'EPSG:4326'),
-            'include_statistics': os.getenv('INCLUDE_STATISTICS', 'true').lower() == 'true'
+            'coordinate_system': os.getenv('OUTPUT_CRS', 'EPSG:4326'),  # 'native' keeps the source CRS
+            'warp_chunk_size': int(os.getenv('WARP_CHUNK_SIZE', 1024)),
+            'include_statistics': os.getenv('INCLUDE_STATISTICS', 'true').lower() == 'true',
+            'decimated_rendering': os.getenv('DECIMATED_RENDERING', 'true').lower() == 'true',
+            'cpu_cores': cls.CPU_CORES,
+            'tile_format': os.getenv('TILE_FORMAT', 'png'),
+            'tile_size': int(os.getenv('TILE_SIZE', 256)),
+            'tile_max_count': int(os.getenv('TILE_MAX_COUNT', 50000)),
+            'cog_mode': os.getenv('COG_MODE', 'off'),
+            'cog_block_size': int(os.getenv('COG_BLOCK_SIZE', 512)),
+            'build_overviews': os.getenv('BUILD_OVERVIEWS', 'false').lower() == 'true',
+            'trace_memory': os.getenv('TRACE_MEMORY', 'false').lower() == 'true'  # tracemalloc peak per file (benchmarks)
         }
 
 
@@ -194,6 +241,11 @@ if __name__ == '__main__':
         for issue in validation['issues']:
             print(f"  - {issue}")
     
+    if validation['warnings']:
+        print("\nWarnings:")
+        for warning in validation['warnings']:
+            print(f"  - {warning}")
+    
     print("\nConfiguration Summary:")
     for key, value in validation['config_summary'].items():
         print(f"  {key}: {value}")
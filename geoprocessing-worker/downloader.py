@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Download Engine
+===============
+
+تحميل ملفات الإدخال الكبيرة بشكل متين:
+
+- كتابة buffered بأحجام كبيرة (بدلًا من chunks بحجم 8 KiB)
+- SHA-256 يُحسب أثناء التحميل
+- استئناف التحميل المنقطع عبر HTTP Range بدلًا من البدء من الصفر
+- تحميل الملفات الكبيرة كأجزاء (byte ranges) متوازية عندما يدعم الخادم Range
+
+الاختبارات في tests/test_downloader.py تستخدم خادم HTTP محلي يدعم Range ويقطع الاتصال عمدًا.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+
+import logging
+logger = logging.getLogger('download-engine')
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+DEFAULT_WRITE_BUFFER = 4 * 1024 * 1024
+DEFAULT_SEGMENT_THRESHOLD = 32 * 1024 * 1024
+HASH_READ_SIZE = 4 * 1024 * 1024
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class DownloadError(Exception):
+    """فشل التحميل (retryable = يمكن الاستئناف والمحاولة مرة أخرى)"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class DownloadEngine:
+    """
+    محرك التحميل فوق httpx.AsyncClient مشترك
+
+    الـ URLs هي signed URLs لخادم التخزين: يجب أن يكون الـ client بدون Authorization
+    (لا يُرسل توكن الـ worker إلى خادم التخزين).
+
+    مثال:
+        engine = DownloadEngine(storage_client, segments=4)
+        result = await engine.download(url, '/tmp/input.tif')
+        result['sha256'], result['resumed_bytes']
+    """
+
+    def __init__(self, http_client: httpx.AsyncClient, max_file_size: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, write_buffer: int = DEFAULT_WRITE_BUFFER,
+                 max_retries: int = 4, backoff_seconds: float = 0.5,
+                 segments: int = 1, segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD):
+        """
+        Args:
+            max_file_size: أقصى حجم مسموح (بايت)
+            max_retries: عدد محاولات الاستئناف بعد انقطاع الاتصال
+            backoff_seconds: الانتظار قبل المحاولة الأولى (يتضاعف مع كل محاولة)
+            segments: عدد الأجزاء المتوازية للملفات الكبيرة (1 = تحميل متسلسل فقط)
+            segment_threshold: أصغر حجم ملف يُحمّل كأجزاء
+        """
+        self.http_client = http_client
+        self.max_file_size = max_file_size
+        self.chunk_size = chunk_size
+        self.write_buffer = write_buffer
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.segments = max(1, segments)
+        self.segment_threshold = segment_threshold
+
+    async def download(self, url: str, local_path: str) -> Dict[str, Any]:
+        """
+        تحميل url إلى local_path (عبر ملف .part يُعاد تسميته عند الاكتمال)
+
+        Returns:
+            {'bytes', 'sha256', 'seconds', 'mode', 'segments', 'attempts', 'resumed_bytes'}
+        """
+        os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+        part_path = f"{local_path}.part"
+        start = time.perf_counter()
+
+        try:
+            total_size = None
+            if self.segments > 1:
+                total_size = await self._probe_size(url)
+
+            if total_size is not None and total_size >= self.segment_threshold:
+                result = await self._download_segments(url, part_path, total_size)
+            else:
+                result = await self._download_stream(url, part_path)
+
+            os.replace(part_path, local_path)
+        except BaseException:
+            # Cancellation and timeouts too: a job stopped mid-transfer leaves no .part behind
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+            raise
+
+        result['seconds'] = round(time.perf_counter() - start, 4)
+        logger.debug(
+            f"Downloaded {result['bytes']} bytes to {local_path} ({result['mode']}, "
+            f"{result['attempts']} attempts, {result['resumed_bytes']} bytes resumed)"
+        )
+        return result
+
+    async def _probe_size(self, url: str) -> Optional[int]:
+        """
+        حجم الملف إذا كان الخادم يدعم Range (طلب GET للبايت الأول فقط؛
+        الـ signed URLs موقعة لـ GET فلا يمكن استخدام HEAD)
+        """
+        try:
+            async with self.http_client.stream('GET', url, headers={'Range': 'bytes=0-0'}) as response:
+                if response.status_code != 206:
+                    return None
+                match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+                if not match or match.group(3) == '*':
+                    return None
+                return int(match.group(3))
+        except httpx.HTTPError as e:
+            logger.debug(f"Range probe failed, falling back to a single stream: {e}")
+            return None
+
+    def _check_size(self, size: int):
+        if self.max_file_size is not None and size > self.max_file_size:
+            raise DownloadError(f"File size exceeds limit: {size} > {self.max_file_size}")
+
+    async def _backoff(self, attempt: int, error: Exception):
+        delay = self.backoff_seconds * (2 ** attempt)
+        logger.warning(f"Download interrupted ({error}), resuming in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def _download_stream(self, url: str, part_path: str) -> Dict[str, Any]:
+        """
+        تحميل متسلسل مع hash أثناء الكتابة واستئناف عبر Range بعد أي انقطاع
+
+        resumed_bytes: البايتات المحفوظة من المحاولات السابقة عند آخر استئناف (تُحسب مرة واحدة للملف)
+        """
+        digest = hashlib.sha256()
+        written = 0
+        resumed_bytes = 0
+        expected_size = None
+
+        with open(part_path, 'wb', buffering=self.write_buffer) as f:
+
+            def restart():
+                nonlocal digest, written, resumed_bytes
+                f.seek(0)
+                f.truncate()
+                digest = hashlib.sha256()
+                written = 0
+                resumed_bytes = 0
+
+            for attempt in range(self.max_retries + 1):
+                headers = {'Range': f'bytes={written}-'} if written else {}
+                try:
+                    async with self.http_client.stream('GET', url, headers=headers) as response:
+                        if written and response.status_code == 200:
+                            # Server ignored the Range header: start over
+                            logger.warning("Server does not support Range requests, restarting download")
+                            restart()
+                        elif written and response.status_code == 206:
+                            match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+                            start = int(match.group(1)) if match else None
+                            if start == 0:
+                                # Full content as a range: take it from the beginning
+                                restart()
+                            elif start != written:
+                                logger.warning(
+                                    f"Resume returned Content-Range {response.headers.get('Content-Range')!r} "
+                                    f"for offset {written}, restarting download"
+                                )
+                                restart()
+                                raise DownloadError("Content-Range does not match the resume offset", retryable=True)
+                            else:
+                                resumed_bytes = written
+                        elif response.status_code != 200:
+                            raise DownloadError(
+                                f"Download failed with status {response.status_code}",
+                                retryable=response.status_code in RETRYABLE_STATUS
+                            )
+
+                        if expected_size is None and response.status_code == 200:
+                            content_length = response.headers.get('Content-Length')
+                            expected_size = int(content_length) if content_length else None
+                            if expected_size is not None:
+                                self._check_size(expected_size)
+
+                        async for chunk in response.aiter_bytes(chunk_size=self.chunk_size):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            written += len(chunk)
+                            self._check_size(written)
+
+                    if expected_size is not None and written < expected_size:
+                        raise httpx.RemoteProtocolError(f"Connection closed at {written}/{expected_size} bytes")
+                    break
+
+                except (httpx.TransportError, DownloadError) as e:
+                    retryable = isinstance(e, httpx.TransportError) or e.retryable
+                    if not retryable or attempt == self.max_retries:
+                        raise DownloadError(f"Download failed after {attempt + 1} attempts: {e}") from e
+                    f.flush()
+                    await self._backoff(attempt, e)
+
+        return {
+            'bytes': written,
+            'sha256': digest.hexdigest(),
+            'mode': 'stream',
+            'segments': 1,
+            'attempts': attempt + 1,
+            'resumed_bytes': resumed_bytes
+        }
+
+    async def _download_segments(self, url: str, part_path: str, total_size: int) -> Dict[str, Any]:
+        """
+        تحميل أجزاء متوازية (byte ranges) في مواضعها من ملف مُخصص مسبقًا
+
+        كل جزء يستأنف من آخر بايت مكتوب عند الانقطاع. الـ hash يُحسب بعد اكتمال جميع الأجزاء
+        بقراءة متسلسلة (البيانات ما زالت في page cache)، لأن SHA-256 لا يمكن حسابه خارج الترتيب.
+        """
+        self._check_size(total_size)
+        segment_size = -(-total_size // self.segments)
+        ranges = [
+            (offset, min(total_size, offset + segment_size) - 1)
+            for offset in range(0, total_size, segment_size)
+        ]
+
+        with open(part_path, 'wb') as f:
+            f.truncate(total_size)
+
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            results = await asyncio.gather(*(self._fetch_range(url, fd, first, last) for first, last in ranges))
+        finally:
+            os.close(fd)
+
+        sha256 = await asyncio.to_thread(self._hash_file, part_path)
+        return {
+            'bytes': total_size,
+            'sha256': sha256,
+            'mode': 'segmented',
+            'segments': len(ranges),
+            'attempts': sum(attempts for attempts, _ in results),
+            'resumed_bytes': sum(resumed for _, resumed in results)
+        }
+
+    async def _fetch_range(self, url: str, fd: int, first: int, last: int) -> Tuple[int, int]:
+        """تحميل البايتات [first, last] وكتابتها في موضعها (pwrite)؛ يعيد (المحاولات, البايتات المستأنفة)"""
+        position = first
+        resumed_bytes = 0
+        buffer: List[bytes] = []
+        buffered = 0
+
+        def flush():
+            nonlocal position, buffered
+            if buffered:
+                os.pwrite(fd, b''.join(buffer), position)
+                position += buffered
+                buffer.clear()
+                buffered = 0
+
+        for attempt in range(self.max_retries + 1):
+            resumed_bytes = position - first
+            try:
+                headers = {'Range': f'bytes={position}-{last}'}
+                async with self.http_client.stream('GET', url, headers=headers) as response:
+                    if response.status_code != 206:
+                        raise DownloadError(
+                            f"Range request failed with status {response.status_code}",
+                            retryable=response.status_code in RETRYABLE_STATUS
+                        )
+                    match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+                    if not match or int(match.group(1)) != position:
+                        # Writing these bytes at position would corrupt the file
+                        raise DownloadError(
+                            f"Content-Range {response.headers.get('Content-Range')!r} does not match offset {position}",
+                            retryable=True
+                        )
+                    async for chunk in response.aiter_bytes(chunk_size=self.chunk_size):
+                        chunk = chunk[:last + 1 - position - buffered]
+                        buffer.append(chunk)
+                        buffered += len(chunk)
+                        if buffered >= self.write_buffer:
+                            flush()
+                flush()
+
+                if position <= last:
+                    raise httpx.RemoteProtocolError(f"Segment closed at {position}/{last + 1} bytes")
+                return attempt + 1, resumed_bytes
+
+            except (httpx.TransportError, DownloadError) as e:
+                flush()  # Keep what already arrived
+                retryable = isinstance(e, httpx.TransportError) or e.retryable
+                if not retryable or attempt == self.max_retries:
+                    raise DownloadError(f"Segment {first}-{last} failed after {attempt + 1} attempts: {e}") from e
+                await self._backoff(attempt, e)
+
+        return self.max_retries + 1, resumed_bytes
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_READ_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
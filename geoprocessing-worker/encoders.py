@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Output Encoders
+===============
+
+طبقة ترميز الصور الناتجة (PNG / WebP lossless / JPEG) مع profiles مسماة:
+
+- fast: أسرع ترميز (ضغط منخفض) للمعالجة الدفعية
+- balanced: الافتراضي
+- smallest: أصغر حجم للملف على حساب زمن الترميز
+
+يُختار الـ profile والصيغة لكل job عبر inputPayload:
+    {"encodingProfile": "fast", "outputFormat": "webp"}
+"""
+
+import os
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from PIL import Image
+
+import logging
+logger = logging.getLogger('output-encoders')
+
+DEFAULT_PROFILE = 'balanced'
+DEFAULT_FORMAT = 'png'
+
+# PIL save options per format and profile
+ENCODING_PROFILES: Dict[str, Dict[str, Dict[str, Any]]] = {
+    'fast': {
+        'png': {'compress_level': 1},
+        'webp': {'lossless': True, 'quality': 0, 'method': 0},
+        'jpeg': {'optimize': False},
+    },
+    'balanced': {
+        'png': {'compress_level': 6},
+        'webp': {'lossless': True, 'quality': 50, 'method': 4},
+        'jpeg': {'optimize': True},
+    },
+    'smallest': {
+        'png': {'compress_level': 9, 'optimize': True},
+        'webp': {'lossless': True, 'quality': 100, 'method': 6},
+        'jpeg': {'optimize': True, 'progressive': True},
+    },
+}
+
+# format -> (PIL format, file extension, world file extension)
+IMAGE_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    'png': ('PNG', 'png', 'pgw'),
+    'webp': ('WEBP', 'webp', 'wld'),
+    'jpeg': ('JPEG', 'jpg', 'jgw'),
+}
+
+FORMAT_ALIASES = {'jpg': 'jpeg'}
+
+
+def normalize_format(image_format: Optional[str]) -> str:
+    """اسم الصيغة الموحد (png / webp / jpeg)"""
+    image_format = (image_format or DEFAULT_FORMAT).lower()
+    image_format = FORMAT_ALIASES.get(image_format, image_format)
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported output format: {image_format} (expected one of {sorted(IMAGE_FORMATS)})")
+    return image_format
+
+
+def resolve_profile(profile: Optional[str]) -> str:
+    """التحقق من اسم الـ profile"""
+    profile = (profile or DEFAULT_PROFILE).lower()
+    if profile not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown encoding profile: {profile} (expected one of {sorted(ENCODING_PROFILES)})")
+    return profile
+
+
+def save_options(image_format: str, profile: str, quality: int = 85) -> Dict[str, Any]:
+    """خيارات PIL.Image.save للصيغة والـ profile (quality تُستخدم لـ JPEG فقط)"""
+    options = dict(ENCODING_PROFILES[resolve_profile(profile)][normalize_format(image_format)])
+    if normalize_format(image_format) == 'jpeg':
+        options['quality'] = quality
+    return options
+
+
+def file_extension(image_format: str) -> str:
+    return IMAGE_FORMATS[normalize_format(image_format)][1]
+
+
+def world_file_extension(image_format: str) -> str:
+    """امتداد الـ World File المرافق للصورة (.pgw / .jgw / .wld)"""
+    return IMAGE_FORMATS[normalize_format(image_format)][2]
+
+
+def encode_image(image: Image.Image, output_path: str, image_format: str = DEFAULT_FORMAT,
+                 profile: str = DEFAULT_PROFILE, quality: int = 85) -> Dict[str, Any]:
+    """
+    ترميز صورة وحفظها مع قياس زمن الترميز وحجم الملف
+
+    JPEG لا يدعم الشفافية: تُحذف قناة alpha (المناطق بدون بيانات تظهر سوداء)
+
+    Returns:
+        تقرير الترميز: المسار والصيغة والـ profile والحجم والزمن
+    """
+    image_format = normalize_format(image_format)
+    profile = resolve_profile(profile)
+    pil_format = IMAGE_FORMATS[image_format][0]
+
+    if image_format == 'jpeg' and image.mode in ('LA', 'RGBA'):
+        image = image.convert('L' if image.mode == 'LA' else 'RGB')
+        logger.debug("Dropped alpha channel for JPEG output")
+
+    start = time.perf_counter()
+    image.save(output_path, pil_format, **save_options(image_format, profile, quality))
+    encode_seconds = time.perf_counter() - start
+
+    return {
+        'path': output_path,
+        'format': image_format,
+        'profile': profile,
+        'mode': image.mode,
+        'width': image.width,
+        'height': image.height,
+        'size_bytes': os.path.getsize(output_path),
+        'encode_seconds': round(encode_seconds, 4)
+    }
@@ -10,14 +10,20 @@ File Manager للـ Geoprocessing Worker
 import os
 import json
 import uuid
+import asyncio
 import mimetypes
+import shutil
 import tempfile
+import time
 from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 
 import httpx
 import logging
 
+from downloader import DownloadEngine, DEFAULT_SEGMENT_THRESHOLD
+from uploader import UploadEngine, DEFAULT_MULTIPART_THRESHOLD, DEFAULT_PART_SIZE
+
 logger = logging.getLogger('file-manager')
 
 
@@ -32,16 +38,55 @@ class FileManager:
     - Cleanup للملفات المؤقتة
     """
     
-    def __init__(self, api_base_url: str, auth_token: str):
+    def __init__(self, api_base_url: str, auth_token: str, download_concurrency: int = 4,
+                 download_segments: int = 4, segment_threshold: int = DEFAULT_SEGMENT_THRESHOLD,
+                 download_retries: int = 4, upload_concurrency: int = 4,
+                 multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD, part_size: int = DEFAULT_PART_SIZE,
+                 concurrent_jobs: int = 1):
         self.api_base_url = api_base_url
         self.auth_token = auth_token
+        self.download_concurrency = max(1, download_concurrency)
+        self.upload_concurrency = max(1, upload_concurrency)
+        # Limits are per job; the connection pool and upload slots are shared by all jobs in flight
+        self.concurrent_jobs = max(1, concurrent_jobs)
+        # Authenticated client: /api/... calls only (file lists, upload URLs, compose/abort)
         self.http_client = httpx.AsyncClient(
             timeout=httpx.Timeout(120.0),  # Longer timeout for file operations
             headers={'Authorization': f'Worker {auth_token}'}
         )
+        # Signed object-storage URLs carry their own credentials: no worker token is sent
+        # to the storage host (and no extra Authorization header to break the signature)
+        self.storage_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0),
+            # Concurrent transfers share this pool; keep-alive connections are reused between files
+            limits=httpx.Limits(
+                max_connections=(self.download_concurrency * max(2, download_segments) + self.upload_concurrency)
+                                * self.concurrent_jobs,
+                max_keepalive_connections=self.download_concurrency * self.concurrent_jobs
+            )
+        )
         
         # File validation settings
         self.max_file_size = 100 * 1024 * 1024  # 100MB
+        
+        # Large buffered writes, Range resume and parallel segments for large objects
+        self.download_engine = DownloadEngine(
+            self.storage_client,
+            max_file_size=self.max_file_size,
+            max_retries=download_retries,
+            segments=download_segments,
+            segment_threshold=segment_threshold
+        )
+        
+        # Streaming uploads from disk; large artifacts as parallel parts composed by the server
+        self.upload_engine = UploadEngine(
+            self.http_client,
+            api_base_url,
+            concurrency=self.upload_concurrency * self.concurrent_jobs,
+            part_size=part_size,
+            multipart_threshold=multipart_threshold,
+            storage_client=self.storage_client
+        )
         self.allowed_extensions = ['.tif', '.tiff', '.geotiff', '.zip', '.geojson', '.json']
         self.allowed_mime_types = [
             'image/tiff',
@@ -53,68 +98,113 @@ class FileManager:
         
         logger.info(f"FileManager initialized with API: {api_base_url}")
     
-    async def download_job_input_files(self, job_id: str) -> List[Dict[str, Any]]:
+    async def list_job_input_files(self, job_id: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
         """
-        تحميل جميع input files للـ job
+        قائمة input files للـ job (signed download URLs) مع مجلد مؤقت للتحميل
         
         Returns:
-            List of file info dictionaries with local paths
+            (files info من API, المجلد المؤقت أو None إذا لم توجد ملفات)
         """
+        # Get download URLs from API
+        response = await self.http_client.get(
+            f"{self.api_base_url}/api/geo-jobs/{job_id}/download/input"
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to get download URLs: {response.status_code} - {response.text}")
+        
+        data = response.json()
+        files_info = data.get('data', {}).get('files', [])
+        
+        if not files_info:
+            logger.warning(f"No input files found for job {job_id}")
+            return [], None
+        
+        # Create temp directory for this job
+        temp_dir = tempfile.mkdtemp(prefix=f"geojob_{job_id}_input_")
+        logger.info(f"Created temp directory: {temp_dir}")
+        return files_info, temp_dir
+    
+    async def download_input_file(self, file_info: Dict[str, Any], temp_dir: str,
+                                  index: int) -> Optional[Dict[str, Any]]:
+        """
+        تحميل input file واحد والتحقق منه
+        
+        الملف يُحمّل إلى مجلد فرعي خاص برقمه index، فملفان بنفس fileName يُحمّلان
+        بالتوازي دون الكتابة على نفس المسار (ونفس ملف .part)
+        
+        Returns:
+            file info مع المسار المحلي، أو None إذا فشل التحميل أو التحقق
+        """
+        if 'error' in file_info:
+            logger.error(f"Error with file {file_info.get('fileName', 'unknown')}: {file_info['error']}")
+            return None
+        
         try:
-            # Get download URLs from API
-            response = await self.http_client.get(
-                f"{self.api_base_url}/api/geo-jobs/{job_id}/download/input"
-            )
+            file_name = file_info['fileName']
+            download_url = file_info['downloadUrl']
+            local_path = os.path.join(temp_dir, f"{index+1}", file_name)
+            
+            # Download file
+            logger.info(f"Downloading {file_name}...")
+            download_start = time.perf_counter()
+            download = await self._download_file_from_url(download_url, local_path)
+            download_seconds = time.perf_counter() - download_start
             
-            if response.status_code != 200:
-                raise Exception(f"Failed to get download URLs: {response.status_code} - {response.text}")
+            # Validate downloaded file
+            validation = self._validate_downloaded_file(local_path)
+            if not validation['valid']:
+                logger.error(f"Downloaded file validation failed: {validation}")
+                return None
             
-            data = response.json()
-            files_info = data.get('data', {}).get('files', [])
+            logger.info(f"Successfully downloaded: {file_name} -> {local_path}")
+            return {
+                'file_name': file_name,
+                'local_path': local_path,
+                'file_key': file_info['fileKey'],
+                'file_size': os.path.getsize(local_path),
+                'sha256': download['sha256'],
+                'download_seconds': round(download_seconds, 4),
+                'download_mode': download['mode'],
+                'download_attempts': download['attempts'],
+                'resumed_bytes': download['resumed_bytes'],
+                'validation': validation
+            }
             
+        except Exception as e:
+            logger.error(f"Failed to download {file_info.get('fileName', 'unknown')}: {e}")
+            return None
+    
+    async def download_job_input_files(self, job_id: str) -> List[Dict[str, Any]]:
+        """
+        تحميل جميع input files للـ job
+        
+        Returns:
+            List of file info dictionaries with local paths
+        """
+        try:
+            files_info, temp_dir = await self.list_job_input_files(job_id)
             if not files_info:
-                logger.warning(f"No input files found for job {job_id}")
                 return []
             
-            downloaded_files = []
+            # Bounded concurrency: total time ~ slowest files instead of the sum of all latencies
+            semaphore = asyncio.Semaphore(self.download_concurrency)
             
-            # Create temp directory for this job
-            temp_dir = tempfile.mkdtemp(prefix=f"geojob_{job_id}_input_")
-            logger.info(f"Created temp directory: {temp_dir}")
+            async def download_one(index: int, file_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+                async with semaphore:
+                    return await self.download_input_file(file_info, temp_dir, index)
             
-            for file_info in files_info:
-                if 'error' in file_info:
-                    logger.error(f"Error with file {file_info.get('fileName', 'unknown')}: {file_info['error']}")
-                    continue
-                
-                try:
-                    file_name = file_info['fileName']
-                    download_url = file_info['downloadUrl']
-                    local_path = os.path.join(temp_dir, file_name)
-                    
-                    # Download file
-                    logger.info(f"Downloading {file_name}...")
-                    await self._download_file_from_url(download_url, local_path)
-                    
-                    # Validate downloaded file
-                    validation = self._validate_downloaded_file(local_path)
-                    if not validation['valid']:
-                        logger.error(f"Downloaded file validation failed: {validation}")
-                        continue
-                    
-                    downloaded_files.append({
-                        'file_name': file_name,
-                        'local_path': local_path,
-                        'file_key': file_info['fileKey'],
-                        'file_size': os.path.getsize(local_path),
-                        'validation': validation
-                    })
-                    
-                    logger.info(f"Successfully downloaded: {file_name} -> {local_path}")
-                    
-                except Exception as e:
-                    logger.error(f"Failed to download {file_info.get('fileName', 'unknown')}: {e}")
-                    continue
+            try:
+                results = await asyncio.gather(*(
+                    download_one(index, file_info) for index, file_info in enumerate(files_info)
+                ))
+            except BaseException:
+                # Failed or cancelled: callers only clean up files they got back
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise
+            downloaded_files = [file_result for file_result in results if file_result is not None]
+            if not downloaded_files:
+                shutil.rmtree(temp_dir, ignore_errors=True)
             
             logger.info(f"Downloaded {len(downloaded_files)} files for job {job_id}")
             return downloaded_files
@@ -123,36 +213,30 @@ class FileManager:
             logger.error(f"Error downloading input files for job {job_id}: {e}")
             raise
     
-    async def _download_file_from_url(self, url: str, local_path: str):
-        """تحميل ملف من URL إلى مسار محلي"""
+    def download_summary(self, file_infos: List[Dict[str, Any]], elapsed_seconds: float) -> Dict[str, Any]:
+        """إجمالي البايتات والإنتاجية (MB/s) لتحميل ملفات job واحد"""
+        total_bytes = sum(file_info.get('file_size', 0) for file_info in file_infos)
+        return {
+            'files': len(file_infos),
+            'bytes': total_bytes,
+            'seconds': round(elapsed_seconds, 4),
+            'mb_per_second': round(total_bytes / (1024 * 1024) / elapsed_seconds, 2) if elapsed_seconds > 0 else None,
+            'concurrency': self.download_concurrency
+        }
+    
+    async def _download_file_from_url(self, url: str, local_path: str) -> Dict[str, Any]:
+        """
+        تحميل ملف من URL إلى مسار محلي عبر DownloadEngine
+        
+        يُحسب SHA-256 للمحتوى أثناء التحميل (مفتاح result cache)، والانقطاع يُستأنف
+        عبر HTTP Range بدلًا من حذف الملف الجزئي والبدء من جديد
+        
+        Returns:
+            {'bytes', 'sha256', 'mode', 'segments', 'attempts', 'resumed_bytes', 'seconds'}
+        """
         try:
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            
-            # Download with streaming
-            async with self.http_client.stream('GET', url) as response:
-                if response.status_code != 200:
-                    raise Exception(f"Download failed with status {response.status_code}")
-                
-                total_size = 0
-                with open(local_path, 'wb') as f:
-                    async for chunk in response.aiter_bytes(chunk_size=8192):
-                        f.write(chunk)
-                        total_size += len(chunk)
-                        
-                        # Check size limit
-                        if total_size > self.max_file_size:
-                            raise Exception(f"File size exceeds limit: {total_size} > {self.max_file_size}")
-                
-                logger.debug(f"Downloaded {total_size} bytes to {local_path}")
-                
+            return await self.download_engine.download(url, local_path)
         except Exception as e:
-            # Cleanup partial download
-            if os.path.exists(local_path):
-                try:
-                    os.unlink(local_path)
-                except:
-                    pass
             raise Exception(f"Download failed: {e}")
     
     def _validate_downloaded_file(self, file_path: str) -> Dict[str, Any]:
@@ -178,16 +262,11 @@ class FileManager:
             if mime_type and mime_type not in self.allowed_mime_types:
                 logger.warning(f"Unknown MIME type: {mime_type} for {file_path}")
             
-            # Additional validation for GeoTIFF files
+            # Additional validation for GeoTIFF files: only the TIFF signature is
+            # checked here, the processor opens the dataset once for all stages
             if file_extension in ['.tif', '.tiff', '.geotiff']:
-                try:
-                    import rasterio
-                    with rasterio.open(file_path) as dataset:
-                        # Basic rasterio validation
-                        if dataset.width <= 0 or dataset.height <= 0:
-                            return {'valid': False, 'error': 'Invalid raster dimensions'}
-                except Exception as e:
-                    return {'valid': False, 'error': f'Invalid GeoTIFF file: {str(e)}'}
+                if not self._has_tiff_signature(file_path):
+                    return {'valid': False, 'error': 'Invalid GeoTIFF file: missing TIFF header signature'}
             
             return {
                 'valid': True,
@@ -199,105 +278,63 @@ class FileManager:
         except Exception as e:
             return {'valid': False, 'error': f'Validation failed: {str(e)}'}
     
-    async def upload_job_output_files(self, job_id: str, output_files: List[str]) -> List[str]:
+    def _has_tiff_signature(self, file_path: str) -> bool:
+        """فحص توقيع TIFF/BigTIFF في أول 4 bytes دون فتح الملف بـ rasterio"""
+        with open(file_path, 'rb') as f:
+            signature = f.read(4)
+        return signature in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+    
+    async def upload_job_output_files(self, job_id: str, output_files: List[str], base_dir: Optional[str] = None) -> List[str]:
         """
         رفع output files للـ job إلى Object Storage
         
+        إذا تم تمرير base_dir يُستخدم المسار النسبي كمفتاح ثابت
+        (مثل tiles/{z}/{x}/{y}.png) بدلًا من اسم عشوائي.
+        
+        الملفات تُرفع بالتوازي (upload_concurrency) مع البث من القرص، والملفات
+        الكبيرة كأجزاء متوازية يدمجها الخادم.
+        
         Returns:
-            List of uploaded file keys
+            List of uploaded file keys (بنفس ترتيب output_files)
         """
-        uploaded_keys = []
+        semaphore = asyncio.Semaphore(self.upload_concurrency)
         
-        for file_path in output_files:
-            try:
-                if not os.path.exists(file_path):
-                    logger.error(f"Output file not found: {file_path}")
-                    continue
-                
-                file_name = os.path.basename(file_path)
-                file_size = os.path.getsize(file_path)
-                
-                # Determine content type
-                content_type = self._get_content_type(file_path)
-                
-                # Generate unique file key
-                file_key = f"geo-jobs/{job_id}/output/{uuid.uuid4().hex}-{file_name}"
-                
-                # Get upload URL from API
-                upload_info = await self._get_upload_url(file_key, file_name, file_size, content_type)
-                
-                if upload_info:
-                    # Upload file
-                    success = await self._upload_file_to_url(
-                        file_path, 
-                        upload_info['uploadUrl'], 
-                        content_type
-                    )
+        async def upload_one(file_path: str) -> Optional[str]:
+            async with semaphore:
+                try:
+                    if not os.path.exists(file_path):
+                        logger.error(f"Output file not found: {file_path}")
+                        return None
+                    
+                    file_name = os.path.basename(file_path)
                     
-                    if success:
-                        uploaded_keys.append(file_key)
-                        logger.info(f"Successfully uploaded: {file_name} -> {file_key}")
+                    # Determine content type
+                    content_type = self._get_content_type(file_path)
+                    
+                    # Generate unique file key (or keep relative layout for tiles)
+                    if base_dir:
+                        relative_path = Path(os.path.relpath(file_path, base_dir)).as_posix()
+                        file_key = f"geo-jobs/{job_id}/output/{relative_path}"
                     else:
-                        logger.error(f"Failed to upload file: {file_name}")
-                else:
-                    logger.error(f"Failed to get upload URL for: {file_name}")
-                
-            except Exception as e:
-                logger.error(f"Error uploading {file_path}: {e}")
+                        file_key = f"geo-jobs/{job_id}/output/{uuid.uuid4().hex}-{file_name}"
+                    
+                    result = await self.upload_engine.upload(job_id, file_path, file_key, content_type)
+                    logger.info(
+                        f"Successfully uploaded: {file_name} -> {file_key} "
+                        f"({result['bytes']} bytes, {result['parts']} parts, {result['seconds']}s)"
+                    )
+                    return file_key
+                    
+                except Exception as e:
+                    logger.error(f"Error uploading {file_path}: {e}")
+                    return None
+        
+        results = await asyncio.gather(*(upload_one(file_path) for file_path in output_files))
+        uploaded_keys = [file_key for file_key in results if file_key is not None]
         
         logger.info(f"Uploaded {len(uploaded_keys)} output files for job {job_id}")
         return uploaded_keys
     
-    async def _get_upload_url(self, file_key: str, file_name: str, file_size: int, content_type: str) -> Optional[Dict[str, Any]]:
-        """الحصول على upload URL من API"""
-        try:
-            # Note: This would need a new endpoint for worker file uploads
-            # For now, we'll simulate the expected response structure
-            
-            # In a real implementation, this would call:
-            # POST /api/internal/geo-jobs/upload-url
-            # with file metadata to get signed upload URL
-            
-            # Simulated response for now:
-            logger.warning(f"Upload URL simulation for {file_name} - implement actual endpoint")
-            
-            return {
-                'uploadUrl': f"https://simulated-upload-url.com/upload/{file_key}",
-                'fileKey': file_key,
-                'expiresIn': 300
-            }
-            
-        except Exception as e:
-            logger.error(f"Failed to get upload URL: {e}")
-            return None
-    
-    async def _upload_file_to_url(self, file_path: str, upload_url: str, content_type: str) -> bool:
-        """رفع ملف إلى signed URL"""
-        try:
-            # For now, we'll simulate successful upload
-            # In real implementation, this would:
-            # 1. Read file content
-            # 2. PUT to signed URL with proper headers
-            # 3. Handle response and retries
-            
-            file_size = os.path.getsize(file_path)
-            logger.info(f"Simulated upload: {os.path.basename(file_path)} ({file_size} bytes) to {upload_url}")
-            
-            # Real implementation would be:
-            # with open(file_path, 'rb') as f:
-            #     response = await self.http_client.put(
-            #         upload_url, 
-            #         content=f.read(),
-            #         headers={'Content-Type': content_type}
-            #     )
-            #     return response.status_code == 200
-            
-            return True  # Simulated success
-            
-        except Exception as e:
-            logger.error(f"Upload failed: {e}")
-            return False
-    
     def _get_content_type(self, file_path: str) -> str:
         """تحديد content type للملف"""
         mime_type, _ = mimetypes.guess_type(file_path)
@@ -309,11 +346,14 @@ class FileManager:
         extension = Path(file_path).suffix.lower()
         content_types = {
             '.png': 'image/png',
+            '.webp': 'image/webp',
             '.jpg': 'image/jpeg',
             '.jpeg': 'image/jpeg',
             '.json': 'application/json',
             '.txt': 'text/plain',
             '.pgw': 'text/plain',
+            '.jgw': 'text/plain',
+            '.wld': 'text/plain',
             '.tif': 'image/tiff',
             '.tiff': 'image/tiff'
         }
@@ -328,14 +368,21 @@ class FileManager:
             file_path = file_info.get('local_path')
             if file_path and os.path.exists(file_path):
                 try:
-                    temp_dirs.add(os.path.dirname(file_path))
+                    # The per-file subdirectory and the job's temp directory above it
+                    file_dir = os.path.dirname(file_path)
+                    temp_dirs.update((file_dir, os.path.dirname(file_dir)))
                     os.unlink(file_path)
                     logger.debug(f"Cleaned up file: {file_path}")
+                    
+                    # Sidecar files created by GDAL (external overviews, aux metadata)
+                    for sidecar in (f"{file_path}.ovr", f"{file_path}.aux.xml"):
+                        if os.path.exists(sidecar):
+                            os.unlink(sidecar)
                 except Exception as e:
                     logger.warning(f"Failed to cleanup file {file_path}: {e}")
         
-        # Remove empty temp directories
-        for temp_dir in temp_dirs:
+        # Remove empty temp directories, deepest first so parents are empty by their turn
+        for temp_dir in sorted(temp_dirs, key=len, reverse=True):
             try:
                 if os.path.exists(temp_dir) and not os.listdir(temp_dir):
                     os.rmdir(temp_dir)
@@ -346,12 +393,11 @@ class FileManager:
     async def close(self):
         """إغلاق File Manager وtقنيف الموارد"""
         await self.http_client.aclose()
+        await self.storage_client.aclose()
 
 
 # Example usage
 if __name__ == '__main__':
-    import asyncio
-    
     async def test_file_manager():
         file_manager = FileManager('http://localhost:5000', 'test-token')
         
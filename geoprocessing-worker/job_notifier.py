@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Job Notifications
+=================
+
+إيقاظ الـ worker فور إضافة job بدل انتظار الـ polling التالي:
+trigger على geo_jobs يرسل NOTIFY geo_jobs_queued
+(database/migrations/add_geo_job_notify.sql) والـ worker يستمع عبر psycopg2.
+
+- الاتصال يُقرأ عبر loop.add_reader فلا يُحجز الـ event loop
+- عند انقطاع الاتصال يُعاد الاتصال مع backoff، ويُوقظ الـ worker بعد كل اتصال
+  (قد تكون إشعارات فُقدت أثناء الانقطاع)
+- قبل الاستماع يُتحقق من وجود الـ trigger في pg_trigger؛ بدونه لن تصل إشعارات،
+  فيبقى الـ worker على الـ polling العادي (تحذير في الـ log) ويُعاد الفحص لاحقًا
+- time-to-claim: الزمن من إنشاء الـ job حتى طلبه (كلاهما بساعة قاعدة البيانات)
+
+التشغيل المباشر يستمع ويطبع الإشعارات (يحتاج قاعدة بيانات و PG* env):
+    python job_notifier.py
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from loop_monitor import lag_summary
+
+import logging
+logger = logging.getLogger('job-notifier')
+
+NOTIFY_CHANNEL = 'geo_jobs_queued'
+NOTIFY_TRIGGER = 'geo_jobs_notify_insert'
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """ISO timestamp كما يرسله الخادم، بتوقيت UTC بدون tzinfo"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def time_to_claim_ms(job: Dict[str, Any]) -> Optional[float]:
+    """الزمن بين إنشاء الـ job (أو موعده المجدول) وطلبه (مللي ثانية)، أو None إذا لم تتوفر الحقول"""
+    created = _parse_timestamp(job.get('createdAt') or job.get('created_at'))
+    scheduled = _parse_timestamp(job.get('scheduledAt') or job.get('scheduled_at'))
+    claimed = _parse_timestamp(job.get('lockedAt') or job.get('locked_at'))
+    if created is None or claimed is None:
+        return None
+    # A job scheduled for later only becomes claimable at scheduled_at
+    start = max(created, scheduled) if scheduled is not None else created
+    return max(0.0, (claimed - start).total_seconds() * 1000)
+
+
+class ClaimLatencyTracker:
+    """عينات time-to-claim الأخيرة للـ worker"""
+
+    def __init__(self, history: int = 1000):
+        self.samples: Deque[float] = deque(maxlen=history)
+
+    def record(self, job: Dict[str, Any]) -> Optional[float]:
+        latency = time_to_claim_ms(job)
+        if latency is not None:
+            self.samples.append(latency)
+        return latency
+
+    def stats(self) -> Dict[str, Any]:
+        return lag_summary(list(self.samples))
+
+
+class JobNotificationListener:
+    """
+    LISTEN على قناة الإشعارات مع event يُضبط عند وصول إشعار
+
+    مثال:
+        listener = JobNotificationListener(worker.get_database_connection)
+        listener.start()
+        if await listener.wait(timeout=60):
+            jobs = await worker.claim_jobs(4)
+    """
+
+    def __init__(self, connect: Callable[[], Awaitable[Any]], channel: str = NOTIFY_CHANNEL,
+                 reconnect_delay: float = 1.0, max_reconnect_delay: float = 60.0,
+                 trigger: Optional[str] = NOTIFY_TRIGGER):
+        """
+        Args:
+            connect: coroutine تعيد اتصال psycopg2 بـ autocommit
+            channel: قناة الـ NOTIFY
+            reconnect_delay: الانتظار قبل أول إعادة اتصال (يتضاعف حتى max_reconnect_delay)
+            trigger: الـ trigger الذي يرسل الإشعارات (None = بدون فحص)
+        """
+        self.connect = connect
+        self.channel = channel
+        self.trigger = trigger
+        self.trigger_missing = False
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = False
+        self.notifications = 0
+        self.reconnects = 0
+        self.last_payload: Optional[Dict[str, Any]] = None
+        self._event: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def event(self) -> asyncio.Event:
+        # Created lazily so it binds to the running event loop
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def pending(self) -> bool:
+        """هل وصل إشعار منذ آخر استدعاء؟ (يمسح الإشعار)"""
+        if self.event.is_set():
+            self.event.clear()
+            return True
+        return False
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """انتظار إشعار حتى timeout ثانية (True = وصل إشعار)"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.pending()
+
+    async def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            connection = None
+            try:
+                connection = await self.connect()
+                if await asyncio.to_thread(self._trigger_exists, connection):
+                    self.trigger_missing = False
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"LISTEN {self.channel}")
+                    self.connected = True
+                    logger.info(f"Listening for job notifications on '{self.channel}'")
+                    delay = self.reconnect_delay
+                    # Anything queued while disconnected produced no notification we could see
+                    self.event.set()
+                    await self._listen(connection)
+                else:
+                    if not self.trigger_missing:
+                        logger.warning(
+                            f"Trigger '{self.trigger}' not found (apply database/migrations/add_geo_job_notify.sql); "
+                            f"job notifications disabled, polling at the normal interval"
+                        )
+                    self.trigger_missing = True
+                    # Check again later in case the migration gets applied
+                    delay = self.max_reconnect_delay
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.connected or self.reconnects == 0:
+                    logger.warning(f"Job notifications unavailable ({e}); falling back to polling")
+                self.reconnects += 1
+            finally:
+                self.connected = False
+                if connection is not None:
+                    try:
+                        asyncio.get_running_loop().remove_reader(connection.fileno())
+                    except Exception:
+                        pass
+                    connection.close()
+            await asyncio.sleep(delay)
+            delay = min(self.max_reconnect_delay, delay * 2)
+
+    def _trigger_exists(self, connection) -> bool:
+        if not self.trigger:
+            return True
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_trigger WHERE tgname = %s AND NOT tgisinternal AND tgenabled <> 'D'",
+                (self.trigger,)
+            )
+            return cursor.fetchone() is not None
+
+    async def _listen(self, connection):
+        """قراءة الإشعارات حتى ينقطع الاتصال"""
+        loop = asyncio.get_running_loop()
+        closed = loop.create_future()
+
+        def on_readable():
+            try:
+                connection.poll()
+            except Exception as e:
+                if not closed.done():
+                    closed.set_exception(e)
+                return
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                self.notifications += 1
+                try:
+                    self.last_payload = json.loads(notify.payload)
+                except ValueError:
+                    self.last_payload = None
+                self.event.set()
+
+        loop.add_reader(connection.fileno(), on_readable)
+        # Raises the connection error once the server goes away
+        await closed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'connected': self.connected,
+            'trigger_missing': self.trigger_missing,
+            'channel': self.channel,
+            'notifications': self.notifications,
+            'reconnects': self.reconnects
+        }
+
+
+async def _demo():
+    import os
+    import psycopg2
+
+    async def connect():
+        connection = await asyncio.to_thread(
+            psycopg2.connect,
+            host=os.getenv('PGHOST', 'localhost'),
+            port=int(os.getenv('PGPORT', 5432)),
+            dbname=os.getenv('PGDATABASE', 'main'),
+            user=os.getenv('PGUSER', 'main'),
+            password=os.getenv('PGPASSWORD', '')
+        )
+        connection.autocommit = True
+        return connection
+
+    listener = JobNotificationListener(connect)
+    listener.start()
+    print(f"Waiting for NOTIFY {NOTIFY_CHANNEL} (Ctrl+C to stop)...")
+    try:
+        while True:
+            start = time.perf_counter()
+            if await listener.wait(timeout=30):
+                print(f"{time.perf_counter() - start:7.2f}s  {listener.last_payload}")
+            else:
+                print(f"no notification in 30s ({listener.stats()})")
+    finally:
+        await listener.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_demo())
+    except KeyboardInterrupt:
+        pass
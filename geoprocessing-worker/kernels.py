@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Normalization Kernels
+=====================
+
+kernels التطبيع إلى uint8 دون مصفوفات مؤقتة بحجم الصورة:
+
+- uint8 / uint16 / int8 / int16: lookup table (قيمة -> uint8) عبر np.take مباشرة
+- float وباقي الأنواع: عمليات float32 in-place على شرائح (strips)
+- الـ buffers المؤقتة تأتي من BufferPool وتُعاد استخدامها بين الـ blocks والملفات
+
+التشغيل المباشر يعرض micro-benchmark للذاكرة المخصصة لكل megapixel:
+    python kernels.py
+"""
+
+import threading
+from typing import Dict, Any, Optional, Sequence
+
+import numpy as np
+
+import logging
+logger = logging.getLogger('normalization-kernels')
+
+DEFAULT_STRIP_ROWS = 256
+
+
+def is_lut_dtype(dtype) -> bool:
+    """أنواع البيانات الصحيحة التي يمكن تمثيل جميع قيمها في LUT (8 و16 bit)"""
+    dtype = np.dtype(dtype)
+    return np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2
+
+
+class BufferPool:
+    """
+    buffers مؤقتة قابلة لإعادة الاستخدام (buffer واحد لكل استخدام ونوع بيانات ولكل thread)
+
+    يكبر الـ buffer عند الحاجة فقط، ويُعاد كـ view بالشكل المطلوب.
+    الـ buffers التي تُستخدم في نفس الوقت يجب أن تحمل أسماء (key) مختلفة.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, shape, dtype, key: str = 'strip') -> np.ndarray:
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        buffers = self._local.__dict__.setdefault('buffers', {})
+        buffer = buffers.get((key, dtype))
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            buffers[(key, dtype)] = buffer
+        return buffer[:size].reshape(shape)
+
+    def clear(self):
+        """تحرير buffers الـ thread الحالي"""
+        self._local.__dict__.pop('buffers', None)
+
+
+# Shared by every block and file processed in this process
+buffer_pool = BufferPool()
+
+
+def build_lut(dtype, low: float, high: float) -> np.ndarray:
+    """
+    LUT تحوّل كل قيمة ممكنة لنوع البيانات إلى uint8 بتمديد خطي بين low و high
+
+    تُفهرس بالـ unsigned view للبيانات (مثل int16 -> uint16) فلا حاجة لنسخة مُزاحة للأنواع الموقعة.
+    """
+    dtype = np.dtype(dtype)
+    index_dtype = np.dtype(f'u{dtype.itemsize}')
+    values = np.arange(1 << (8 * dtype.itemsize), dtype=index_dtype).view(dtype).astype(np.float32)
+    lut = np.zeros(values.size, dtype=np.uint8)
+    if high > low:
+        values -= np.float32(low)
+        values *= np.float32(255.0 / (high - low))
+        np.clip(values, 0, 255, out=values)
+        np.copyto(lut, values, casting='unsafe')
+    return lut
+
+
+def apply_lut(data: np.ndarray, lut: np.ndarray, out: np.ndarray,
+              strip_rows: int = DEFAULT_STRIP_ROWS):
+    """
+    تطبيق LUT على نطاق واحد (height, width) وكتابة النتيجة في out (قد يكون view غير متصل
+    مثل قناة من صورة RGB)
+    """
+    index_dtype = np.dtype(f'u{data.dtype.itemsize}')
+    height, width = data.shape
+    strip_shape = (min(strip_rows, height), width)
+    strip = buffer_pool.get(strip_shape, np.uint8)
+    # np.take converts indices to intp; a pooled intp strip avoids that allocation per call
+    indexes = buffer_pool.get(strip_shape, np.intp, key='lut_indexes')
+
+    for row_start in range(0, height, strip_rows):
+        row_stop = min(height, row_start + strip_rows)
+        rows = strip[:row_stop - row_start]
+        row_indexes = indexes[:row_stop - row_start]
+        np.copyto(row_indexes, data[row_start:row_stop].view(index_dtype))
+        # mode='clip' avoids numpy's temporary copy of out (indices are always in range)
+        np.take(lut, row_indexes, out=rows, mode='clip')
+        out[row_start:row_stop] = rows
+
+
+def normalize_linear(data: np.ndarray, low: float, high: float, out: np.ndarray,
+                     strip_rows: int = DEFAULT_STRIP_ROWS):
+    """
+    تمديد خطي لنطاق واحد (height, width) إلى uint8 في out باستخدام float32 in-place
+
+    NaN تُكتب 0 (fmax/fmin تتجاهل NaN فلا حاجة لـ nan_to_num)
+    """
+    height, width = data.shape
+    scale = np.float32(255.0 / (high - low)) if high > low else np.float32(0.0)
+    low32 = np.float32(low)
+    strip = buffer_pool.get((min(strip_rows, height), width), np.float32)
+
+    for row_start in range(0, height, strip_rows):
+        row_stop = min(height, row_start + strip_rows)
+        rows = strip[:row_stop - row_start]
+        np.subtract(data[row_start:row_stop], low32, out=rows, casting='unsafe')
+        np.multiply(rows, scale, out=rows)
+        np.fmax(rows, 0, out=rows)
+        np.fmin(rows, 255, out=rows)
+        np.copyto(out[row_start:row_stop], rows, casting='unsafe')
+
+
+def normalize_bands(data: np.ndarray, lows: Sequence[float], highs: Sequence[float],
+                    luts: Optional[np.ndarray] = None, alpha: Optional[np.ndarray] = None,
+                    out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    تطبيع جميع النطاقات (bands, height, width) إلى صورة uint8 بشكل (height, width, bands[+1])
+
+    luts: LUT لكل نطاق (لبيانات 8/16-bit)؛ وإلا يُستخدم التمديد الخطي بـ float32
+    alpha: قناة alpha تُكتب كقناة أخيرة
+    out: مصفوفة المخرجات (تُنشأ إذا لم تُحدد؛ لا تأتي من الـ pool لأنها تصبح الصورة نفسها)
+    """
+    band_count, height, width = data.shape
+    channels = band_count + (1 if alpha is not None else 0)
+    if out is None:
+        out = np.empty((height, width, channels), dtype=np.uint8)
+
+    use_luts = luts is not None and is_lut_dtype(data.dtype)
+    for index in range(band_count):
+        if use_luts:
+            apply_lut(data[index], luts[index], out[:, :, index])
+        else:
+            normalize_linear(data[index], float(lows[index]), float(highs[index]), out[:, :, index])
+
+    if alpha is not None:
+        out[:, :, band_count] = alpha
+    return out
+
+
+def legacy_normalize(data: np.ndarray) -> np.ndarray:
+    """التعبير القديم في convert_to_png / create_thumbnail (للمقارنة في الـ benchmark فقط)"""
+    data_min, data_max = data.min(), data.max()
+    if data_max > data_min:
+        return ((data - data_min) / (data_max - data_min) * 255).astype(np.uint8)
+    return np.zeros(data.shape, dtype=np.uint8)
+
+
+def benchmark(megapixels: int = 16, repeats: int = 3) -> Dict[str, Any]:
+    """
+    قياس الذاكرة المخصصة (tracemalloc peak) لكل megapixel والزمن للطريقتين
+    """
+    import time
+    import tracemalloc
+
+    side = int(np.sqrt(megapixels * 1_000_000))
+    rng = np.random.default_rng(0)
+    inputs = {
+        'uint8': rng.integers(0, 256, (side, side), dtype=np.uint8),
+        'uint16': rng.integers(0, 4096, (side, side), dtype=np.uint16),
+        'float32': rng.normal(100, 25, (side, side)).astype(np.float32),
+    }
+    pixels = side * side / 1_000_000
+    results = {}
+
+    for name, data in inputs.items():
+        low, high = float(np.percentile(data[::16, ::16], 2)), float(np.percentile(data[::16, ::16], 98))
+        luts = np.stack([build_lut(data.dtype, low, high)]) if is_lut_dtype(data.dtype) else None
+        stack = data[np.newaxis]
+        output = np.empty((side, side, 1), dtype=np.uint8)
+        normalize_bands(stack, [low], [high], luts=luts, out=output)  # Warm up the buffer pool
+
+        cases = {
+            'legacy': lambda: legacy_normalize(data),
+            'kernel': lambda: normalize_bands(stack, [low], [high], luts=luts),
+            'kernel_preallocated': lambda: normalize_bands(stack, [low], [high], luts=luts, out=output),
+        }
+        for case, run in cases.items():
+            tracemalloc.start()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                run()
+            elapsed = (time.perf_counter() - start) / repeats
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[f"{name}/{case}"] = {
+                'bytes_per_megapixel': int(peak / pixels),
+                'ms_per_megapixel': round(elapsed * 1000 / pixels, 3)
+            }
+
+    return results
+
+
+if __name__ == '__main__':
+    print("Normalization kernels micro-benchmark (peak bytes allocated per megapixel)")
+    print(f"{'input/case':32} {'bytes/MP':>12} {'ms/MP':>8}")
+    for key, value in benchmark().items():
+        print(f"{key:32} {value['bytes_per_megapixel']:>12,} {value['ms_per_megapixel']:>8}")
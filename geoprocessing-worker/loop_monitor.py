@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Event Loop Lag Monitor
+======================
+
+قياس تأخر الـ event loop: task ينام interval ثانية ويقيس كم تأخر استيقاظه.
+التأخر الكبير يعني أن شيئًا يحجز الـ loop (معالجة متزامنة، قراءة ملف كبير...)
+فتتأخر الـ heartbeats وقد يعتبر الخادم الـ job متوقفًا.
+
+- تحذير في الـ log عند تجاوز warn_ms
+- ملخص دوري (p50 / p95 / p99 / max)
+- نافذة قياس لكل job تُضاف إلى الـ output payload
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Any, Iterator, List, Optional, Sequence
+
+import logging
+logger = logging.getLogger('loop-monitor')
+
+
+def lag_summary(samples: Sequence[float]) -> Dict[str, Any]:
+    """ملخص عينات التأخر (بالمللي ثانية)"""
+    if not samples:
+        return {'samples': 0, 'mean_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+
+    ordered = sorted(samples)
+
+    def percentile(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)], 2)
+
+    return {
+        'samples': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered), 2),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(ordered[-1], 2)
+    }
+
+
+class LagWindow:
+    """عينات التأخر خلال فترة محددة (مثل مدة job)"""
+
+    def __init__(self):
+        self.samples: List[float] = []
+
+    def stats(self) -> Dict[str, Any]:
+        return lag_summary(self.samples)
+
+
+class LoopLagMonitor:
+    """
+    مثال:
+        monitor = LoopLagMonitor(interval=0.1, warn_ms=500)
+        monitor.start()
+        with monitor.window() as window:
+            await process_job()
+        window.stats()['p99_ms']
+    """
+
+    def __init__(self, interval: float = 0.1, warn_ms: float = 500.0, report_every: float = 300.0,
+                 history: int = 10000):
+        """
+        Args:
+            interval: فترة القياس (ثانية)
+            warn_ms: تأخر يُسجل كتحذير
+            report_every: فترة الملخص الدوري في الـ log (ثانية، 0 = بدون ملخص)
+            history: عدد العينات المحفوظة للملخص العام
+        """
+        self.interval = interval
+        self.warn_ms = warn_ms
+        self.report_every = report_every
+        self.samples: Deque[float] = deque(maxlen=history)
+        self.warnings = 0
+        self._windows: List[LagWindow] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        last_report = time.monotonic()
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.monotonic() - expected) * 1000)
+
+            self.samples.append(lag_ms)
+            for window in self._windows:
+                window.samples.append(lag_ms)
+
+            if lag_ms >= self.warn_ms:
+                self.warnings += 1
+                logger.warning(f"Event loop blocked for {lag_ms:.0f} ms (heartbeats and progress were delayed)")
+
+            if self.report_every and time.monotonic() - last_report >= self.report_every:
+                last_report = time.monotonic()
+                summary = self.stats()
+                logger.info(
+                    f"Event loop lag: p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms, "
+                    f"max {summary['max_ms']} ms over {summary['samples']} samples"
+                )
+
+    def open_window(self) -> LagWindow:
+        """بدء جمع عينات التأخر (مثلًا عند بدء job)"""
+        window = LagWindow()
+        self._windows.append(window)
+        return window
+
+    def close_window(self, window: LagWindow):
+        if window in self._windows:
+            self._windows.remove(window)
+
+    @contextmanager
+    def window(self) -> Iterator[LagWindow]:
+        """جمع عينات التأخر داخل الـ with"""
+        window = self.open_window()
+        try:
+            yield window
+        finally:
+            self.close_window(window)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(lag_summary(list(self.samples)), warnings=self.warnings)
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Job Pipeline
+============
+
+معالجة ملفات GeoTIFF job كـ pipeline من ثلاث مراحل متصلة بـ queues محدودة:
+
+    download ──► [process queue] ──► process ──► [upload queue] ──► upload
+
+- الملف N+1 يُحمّل أثناء معالجة الملف N، ومخرجات الملف N تُرفع أثناء معالجة N+1
+- الـ queues محدودة (queue_size) فلا يتقدم التحميل كثيرًا على المعالجة (مساحة القرص)
+- المعالجة تعمل في ProcessingExecutor حتى يبقى الـ event loop حرًا للتحميل والرفع والـ heartbeats
+- result cache لكل ملف: الملف المطابق لنتيجة مخزنة يتجاوز المعالجة ويذهب مباشرة للرفع
+  (ملفاته تُربط في مجلد مخرجات الـ job، وعمليات القرص للـ cache تعمل في thread)
+- نسبة انشغال كل مرحلة (utilization) تُضاف إلى الـ output payload
+"""
+
+import asyncio
+import os
+import shutil
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Awaitable, List, Optional, Tuple
+
+from processor import (
+    batch_output_dir, new_batch_result, record_batch_file, finalize_batch_result, process_batch_file
+)
+from result_cache import cache_key
+
+import logging
+logger = logging.getLogger('job-pipeline')
+
+GEOTIFF_EXTENSIONS = ('.tif', '.tiff', '.geotiff')
+_END = object()
+
+
+class StageMeter:
+    """
+    زمن انشغال مرحلة: الفترات التي يعمل فيها عنصر واحد على الأقل
+    (التحميلات المتزامنة لا تُحسب مرتين)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._active = 0
+        self._since: Optional[float] = None
+
+    @contextmanager
+    def active(self):
+        if self._active == 0:
+            self._since = time.perf_counter()
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self.items += 1
+            if self._active == 0:
+                self.busy_seconds += time.perf_counter() - self._since
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        return {
+            'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 4),
+            'utilization': round(self.busy_seconds / wall_seconds, 4) if wall_seconds > 0 else 0.0
+        }
+
+
+class JobPipeline:
+    """
+    pipeline لـ job واحد من نوع geotiff_to_png
+
+    مثال:
+        pipeline = JobPipeline(file_manager, processor, executor, result_cache, job, version, queue_size=2)
+        result = await pipeline.run(output_base_dir)
+        result['batch_result'], result['output_keys'], result['pipeline']
+    """
+
+    def __init__(self, file_manager, processor, executor, result_cache, job: Dict[str, Any], version: str,
+                 queue_size: int = 2, on_progress: Optional[Callable[[int, str], Awaitable[Any]]] = None):
+        """
+        Args:
+            file_manager: FileManager (قائمة الملفات، التحميل، الرفع)
+            processor: GeoprocessingProcessor (إعداداته جزء من مفتاح الـ cache)
+            executor: ProcessingExecutor لتشغيل المعالجة خارج الـ event loop
+            result_cache: ResultCache (مفتاح لكل ملف إدخال)
+            version: إصدار الـ worker (جزء من مفتاح الـ cache)
+            queue_size: أقصى عدد عناصر تنتظر في كل queue
+            on_progress: coroutine(progress, message) لتحديث تقدم الـ job
+        """
+        self.file_manager = file_manager
+        self.processor = processor
+        self.executor = executor
+        self.result_cache = result_cache
+        self.job = job
+        self.job_id = job['id']
+        self.job_config = job.get('inputPayload', {})
+        self.version = version
+        self.queue_size = max(1, queue_size)
+        self.on_progress = on_progress
+        self.meters = {name: StageMeter(name) for name in ('download', 'process', 'upload')}
+
+        self.input_file_infos: List[Dict[str, Any]] = []
+        self.geotiff_count = 0
+        self.cache_hits = 0
+        self.output_keys: List[str] = []
+        self._results: Dict[int, Tuple[str, Dict[str, Any]]] = {}
+        self._batch_result: Optional[Dict[str, Any]] = None
+        self._uploaded_files = 0
+        # Files processed at once and cores per file; set from the job's GeoTIFF count in run()
+        self.workers = max(1, getattr(processor, 'cpu_cores', 1))
+        self.file_cores: Optional[int] = None
+        self.max_parallel = 0
+        self._running = 0
+
+    def _file_cache_key(self, file_info: Dict[str, Any]) -> Optional[str]:
+        if not file_info.get('sha256'):
+            return None
+        # Content only: the file name carries a per-upload UUID
+        return cache_key(
+            [file_info['sha256']],
+            {'taskType': self.job['taskType'], 'inputPayload': self.job_config},
+            self.processor.config,
+            self.version
+        )
+
+    def _split_cores(self, files_info: List[Dict[str, Any]]):
+        """
+        توزيع CPU_CORES كما في batch_process_files: ملف واحد يأخذ جميع الـ cores (block engine)،
+        وعدة ملفات تُعالج جنبًا إلى جنب بنصيب متساوٍ من الـ cores لكل ملف
+        """
+        cpu_cores = max(1, getattr(self.processor, 'cpu_cores', 1))
+        geotiffs = sum(
+            1 for file_info in files_info
+            if str(file_info.get('fileName', '')).lower().endswith(GEOTIFF_EXTENSIONS)
+        )
+        self.workers = max(1, min(cpu_cores, geotiffs))
+        file_cores = max(1, cpu_cores // self.workers)
+        self.file_cores = file_cores if file_cores != cpu_cores else None
+
+    async def _report_progress(self):
+        if self.on_progress and self._batch_result is not None:
+            total = self._batch_result['summary']['total_files'] or 1
+            await self.on_progress(
+                10 + int(80 * self._uploaded_files / total),
+                f"Processed and uploaded {self._uploaded_files}/{total} files"
+            )
+
+    async def _download_stage(self, files_info: List[Dict[str, Any]], temp_dir: str, process_queue: asyncio.Queue):
+        """تحميل الملفات بالتوازي (download_concurrency) ووضع كل ملف في queue المعالجة فور اكتماله"""
+        semaphore = asyncio.Semaphore(self.file_manager.download_concurrency)
+
+        async def download_one(index: int, file_info: Dict[str, Any]):
+            async with semaphore:
+                with self.meters['download'].active():
+                    downloaded = await self.file_manager.download_input_file(file_info, temp_dir, index)
+            if downloaded is None:
+                return
+            self.input_file_infos.append(downloaded)
+            if not downloaded['local_path'].lower().endswith(GEOTIFF_EXTENSIONS):
+                logger.warning(f"Skipping non-GeoTIFF file: {downloaded['file_name']}")
+                return
+            # Blocks while the queue is full, so downloads stay a bounded distance ahead
+            await process_queue.put((index, downloaded))
+
+        try:
+            await asyncio.gather(*(download_one(index, file_info) for index, file_info in enumerate(files_info)))
+        finally:
+            await process_queue.put(_END)
+
+    async def _process_file(self, index: int, file_info: Dict[str, Any], output_base_dir: str,
+                            upload_queue: asyncio.Queue):
+        """معالجة ملف واحد (في الـ executor) أو استخدام النتيجة المخزنة، ثم وضعه في queue الرفع"""
+        file_name = os.path.basename(file_info['local_path'])
+        result_key = self._file_cache_key(file_info)
+
+        output_dir = batch_output_dir(output_base_dir, index, file_info['local_path'])
+        # A hit is linked into output_dir, so eviction by a concurrent put cannot remove it before upload
+        stem = os.path.splitext(file_name)[0]
+        cached = await asyncio.to_thread(self.result_cache.get, result_key, output_dir, stem) if result_key else None
+        if cached:
+            logger.info(f"Job {self.job_id}: result cache hit for {file_name} ({result_key[:12]})")
+            self.cache_hits += 1
+            file_result, error_msg = dict(cached['result'], input_file=file_name), None
+        else:
+            with self.meters['process'].active():
+                self._running += 1
+                self.max_parallel = max(self.max_parallel, self._running)
+                try:
+                    _, file_result, error_msg = await self.executor.run(
+                        process_batch_file, index, file_info['local_path'], output_dir, self.job_config,
+                        self._batch_result['summary']['total_files'], self.file_cores
+                    )
+                except Exception as e:
+                    # e.g. BrokenProcessPool when the child is OOM-killed: this file fails, the job goes on
+                    # (only CancelledError, a BaseException, stops the pipeline)
+                    error_msg = f"Failed to process {file_name}: {type(e).__name__}: {e}"
+                    file_result = {'error': error_msg, 'traceback': traceback.format_exc()}
+                finally:
+                    self._running -= 1
+            logger.info(f"Job {self.job_id}: finished {file_name}" + (" with errors" if error_msg else ""))
+
+        self._results[index] = (file_name, file_result)
+        record_batch_file(self._batch_result, file_result, error_msg)
+
+        output_files = list(file_result.get('output_files', {}).values()) if not error_msg else []
+        cacheable = bool(result_key) and not cached and not error_msg and not file_result['summary']['has_errors']
+        await upload_queue.put((output_files, output_dir, result_key if cacheable else None, file_result, stem))
+
+    async def _process_stage(self, output_base_dir: str, process_queue: asyncio.Queue, upload_queue: asyncio.Queue):
+        """معالجة حتى workers ملفات في نفس الوقت، بترتيب وصولها من التحميل"""
+        slots = asyncio.Semaphore(self.workers)
+        tasks: List[asyncio.Task] = []
+
+        async def process_one(index: int, file_info: Dict[str, Any]):
+            try:
+                await self._process_file(index, file_info, output_base_dir, upload_queue)
+            finally:
+                slots.release()
+
+        try:
+            while True:
+                # Take the next file only when a slot is free, so the process queue keeps back-pressure
+                await slots.acquire()
+                item = await process_queue.get()
+                if item is _END:
+                    slots.release()
+                    break
+                index, file_info = item
+                self.geotiff_count += 1
+                tasks.append(asyncio.create_task(process_one(index, file_info)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        await upload_queue.put(_END)
+
+    async def _upload_stage(self, upload_queue: asyncio.Queue):
+        """رفع مخرجات كل ملف فور انتهاء معالجته، ثم نقلها إلى الـ cache أو حذفها"""
+        while True:
+            item = await upload_queue.get()
+            if item is _END:
+                break
+            output_files, output_dir, result_key, file_result, stem = item
+
+            if output_files:
+                with self.meters['upload'].active():
+                    self.output_keys.extend(
+                        await self.file_manager.upload_job_output_files(self.job_id, output_files)
+                    )
+
+            if output_dir:
+                # Complete results move into the cache; anything else is temporary
+                stored = False
+                if result_key:
+                    try:
+                        stored = await asyncio.to_thread(
+                            self.result_cache.put, result_key, output_dir, file_result, output_files, stem
+                        )
+                    except Exception as e:
+                        logger.warning(f"Failed to cache result for job {self.job_id}: {e}")
+                if not stored and os.path.isdir(output_dir):
+                    await asyncio.to_thread(shutil.rmtree, output_dir, True)
+
+            self._uploaded_files += 1
+            await self._report_progress()
+
+    async def run(self, output_base_dir: str) -> Dict[str, Any]:
+        """
+        تشغيل المراحل الثلاث حتى اكتمال جميع الملفات
+
+        الملفات المحمّلة تُحذف عند العودة (input_file_infos تبقى للـ payload فقط)
+
+        Returns:
+            {'batch_result', 'output_keys', 'input_file_infos', 'geotiff_files', 'pipeline'}
+        """
+        files_info, temp_dir = await self.file_manager.list_job_input_files(self.job_id)
+        if not files_info:
+            raise Exception("No input files downloaded")
+
+        # The pipeline owns the inputs: failed downloads, partial files and the per-file
+        # subdirectories go with temp_dir whether the job succeeds, fails or is cancelled
+        try:
+            return await self._run(output_base_dir, files_info, temp_dir)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    async def _run(self, output_base_dir: str, files_info: List[Dict[str, Any]], temp_dir: str) -> Dict[str, Any]:
+        self._batch_result = new_batch_result(len(files_info))
+        self._split_cores(files_info)
+        process_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        upload_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        start = time.perf_counter()
+        stages = [
+            asyncio.create_task(self._download_stage(files_info, temp_dir, process_queue)),
+            asyncio.create_task(self._process_stage(output_base_dir, process_queue, upload_queue)),
+            asyncio.create_task(self._upload_stage(upload_queue)),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            raise
+        wall_seconds = time.perf_counter() - start
+
+        if not self.input_file_infos:
+            raise Exception("No input files downloaded")
+        if not self.geotiff_count:
+            raise Exception("No GeoTIFF files found in input")
+
+        # Only files that reached the processor count towards the batch
+        self._batch_result['summary']['total_files'] = self.geotiff_count
+        finalize_batch_result(
+            self._batch_result,
+            [self._results[index] for index in sorted(self._results)],
+            wall_seconds,
+            max(1, self.max_parallel)
+        )
+
+        pipeline_report = {
+            'wall_seconds': round(wall_seconds, 4),
+            'queue_size': self.queue_size,
+            'process_workers': self.workers,
+            'cores_per_file': self.file_cores or max(1, getattr(self.processor, 'cpu_cores', 1)),
+            'stages': {name: meter.report(wall_seconds) for name, meter in self.meters.items()},
+            # Sum of stage busy times over wall time: 1.0 = strictly phased, up to 3.0 = fully overlapped
+            'overlap': round(sum(meter.busy_seconds for meter in self.meters.values()) / wall_seconds, 4)
+                if wall_seconds > 0 else 0.0,
+            'cache_hits': self.cache_hits
+        }
+        logger.info(
+            f"Job {self.job_id} pipeline: {wall_seconds:.2f}s, " + ", ".join(
+                f"{name} {report['utilization']:.0%}" for name, report in pipeline_report['stages'].items()
+            )
+        )
+
+        return {
+            'batch_result': self._batch_result,
+            'output_keys': self.output_keys,
+            'input_file_infos': self.input_file_infos,
+            'geotiff_files': self.geotiff_count,
+            'pipeline': pipeline_report
+        }
+
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Poll Scheduler
+==============
+
+توقيت طلبات الـ claim بدل الانتظار الثابت (POLL_INTERVAL):
+
+- بعد إيجاد عمل: الطلب التالي فورًا، وأول طلب فارغ بعده ينتظر min_interval فقط
+- عند الخمول: الانتظار يتضاعف مع كل طلب فارغ حتى max_interval
+- عند الأخطاء: backoff أسرع ومستقل يُصفّر عند أول طلب ناجح
+- jitter على كل انتظار حتى لا تطلب جميع الـ workers في نفس اللحظة
+
+التشغيل المباشر يطبع تسلسل الانتظار:
+    python poll_scheduler.py
+"""
+
+import random
+from typing import Any, Dict, Optional
+
+
+class PollScheduler:
+    """
+    مثال:
+        scheduler = PollScheduler(min_interval=0.5, max_interval=30)
+        jobs = await claim()
+        if jobs:
+            scheduler.found_work()
+        else:
+            await asyncio.sleep(scheduler.idle_delay())
+    """
+
+    def __init__(self, min_interval: float = 0.5, max_interval: float = 30.0, multiplier: float = 2.0,
+                 jitter: float = 0.5, rng: Optional[random.Random] = None):
+        """
+        Args:
+            min_interval: الانتظار بعد أول طلب فارغ (ثانية)
+            max_interval: أقصى انتظار عند الخمول أو الأخطاء (ثانية)
+            multiplier: معامل التضاعف لكل طلب فارغ
+            jitter: الجزء العشوائي من كل انتظار (0 = بدون، 0.5 = بين نصف الانتظار وكامله)
+        """
+        self.min_interval = max(0.0, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.multiplier = max(1.0, multiplier)
+        self.jitter = min(1.0, max(0.0, jitter))
+        self.rng = rng or random.Random()
+        self.polls = 0
+        self.empty_polls = 0
+        self.failed_polls = 0
+        self._idle_streak = 0
+        self._failure_streak = 0
+
+    def _jittered(self, delay: float) -> float:
+        # "Equal jitter": keep (1 - jitter) of the delay, randomize the rest
+        return delay * (1 - self.jitter) + self.rng.uniform(0, delay * self.jitter)
+
+    def _backoff(self, base: float, streak: int, max_interval: float) -> float:
+        return min(max_interval, base * self.multiplier ** streak)
+
+    def found_work(self):
+        """طلب أعاد jobs: العودة إلى الـ polling السريع"""
+        self.polls += 1
+        self._idle_streak = 0
+        self._failure_streak = 0
+
+    def idle_delay(self, max_interval: Optional[float] = None) -> float:
+        """
+        الانتظار بعد طلب فارغ (ثانية)
+
+        Args:
+            max_interval: حد أعلى مؤقت بدل self.max_interval (مثلًا أثناء الاستماع للإشعارات)
+        """
+        self.polls += 1
+        self.empty_polls += 1
+        self._failure_streak = 0
+        delay = self._backoff(self.min_interval, self._idle_streak, max_interval or self.max_interval)
+        self._idle_streak += 1
+        return self._jittered(delay)
+
+    def failure_delay(self) -> float:
+        """الانتظار بعد طلب فاشل (ثانية)؛ يبدأ من 4 × min_interval"""
+        self.polls += 1
+        self.failed_polls += 1
+        delay = self._backoff(max(self.min_interval * 4, 1.0), self._failure_streak, self.max_interval)
+        self._failure_streak += 1
+        return self._jittered(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'polls': self.polls,
+            'empty_polls': self.empty_polls,
+            'failed_polls': self.failed_polls,
+            'idle_streak': self._idle_streak
+        }
+
+
+if __name__ == '__main__':
+    scheduler = PollScheduler(min_interval=0.5, max_interval=30, rng=random.Random(1))
+    print("idle:   " + ", ".join(f"{scheduler.idle_delay():.2f}" for _ in range(10)))
+    scheduler.found_work()
+    print("work -> " + ", ".join(f"{scheduler.idle_delay():.2f}" for _ in range(3)))
+    print("errors: " + ", ".join(f"{scheduler.failure_delay():.2f}" for _ in range(8)))
+    print(scheduler.stats())
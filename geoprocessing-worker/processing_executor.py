@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Processing Executor
+===================
+
+تشغيل المعالجة (CPU-bound) خارج الـ event loop حتى تستمر الـ heartbeats
+وتحديثات التقدم والإلغاء أثناء معالجة الملفات الكبيرة.
+
+- mode = 'process' (الافتراضي): process منفصل لكل slot مع processor خاص به؛
+  لا تنافس على الـ GIL مع الـ event loop، والمهمة الملغاة أو المتجاوزة للوقت
+  تُوقف فعليًا بإنهاء الـ process الخاص بها فقط
+- mode = 'thread': thread pool بنفس الـ processor (أخف، لكن لا يمكن إيقاف مهمة جارية)
+
+الدوال المنفذة بمستوى الـ module وتستقبل processor أولًا (None داخل الـ process):
+    result = await executor.run(process_batch_file, index, input_file, output_dir, job_config, total)
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from processor import GeoprocessingProcessor, init_batch_worker
+
+import logging
+logger = logging.getLogger('processing-executor')
+
+EXECUTOR_MODES = ('process', 'thread')
+
+
+class ProcessingExecutor:
+    """
+    slots للمعالجة: كل slot إما process واحد أو thread واحد
+
+    مثال:
+        executor = ProcessingExecutor(processor, mode='process', slots=2)
+        index, file_result, error = await executor.run(process_batch_file, 0, path, output_dir, {}, 1)
+        executor.shutdown()
+    """
+
+    def __init__(self, processor: GeoprocessingProcessor, mode: str = 'process', slots: int = 1):
+        """
+        Args:
+            processor: processor الـ worker (يُستخدم مباشرة في mode = 'thread'، وإعداداته لإنشاء processor كل process)
+            mode: 'process' أو 'thread'
+            slots: عدد المهام التي يمكن تشغيلها في نفس الوقت
+        """
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown processing executor mode: {mode} (expected one of {EXECUTOR_MODES})")
+
+        self.processor = processor
+        self.mode = mode
+        self.slots = max(1, slots)
+        self.restarts = 0
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._idle: Optional[asyncio.Queue] = None
+
+    def _new_process(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=1, initializer=init_batch_worker, initargs=(self.processor.config,))
+
+    def _idle_slots(self) -> asyncio.Queue:
+        # Created lazily so the queue binds to the running event loop
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.slots):
+                self._idle.put_nowait(self._new_process())
+        return self._idle
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """
+        تشغيل func(processor, *args) في slot حر (ينتظر إذا كانت جميع الـ slots مشغولة)
+
+        إلغاء الـ coroutine (cancel أو timeout) ينهي الـ process الذي يشغّل المهمة.
+        """
+        loop = asyncio.get_running_loop()
+
+        if self.mode == 'thread':
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix='processing')
+            return await loop.run_in_executor(self._thread_pool, func, self.processor, *args)
+
+        idle = self._idle_slots()
+        process = await idle.get()
+        try:
+            result = await loop.run_in_executor(process, func, None, *args)
+        except asyncio.CancelledError:
+            # The coroutine stops waiting, but the child would keep burning CPU: stop it
+            logger.warning("Processing task cancelled, terminating its process")
+            process = self._restart(process)
+            raise
+        except BrokenProcessPool:
+            # The child died (e.g. OOM-killed); the pool cannot be reused
+            process = self._restart(process)
+            raise
+        finally:
+            idle.put_nowait(process)
+        return result
+
+    def _restart(self, process: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """إنهاء process الـ slot واستبداله بآخر جديد"""
+        # ProcessPoolExecutor has no public way to kill a running task
+        for child in list((getattr(process, '_processes', None) or {}).values()):
+            child.terminate()
+        process.shutdown(wait=False, cancel_futures=True)
+        self.restarts += 1
+        return self._new_process()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'mode': self.mode, 'slots': self.slots, 'restarts': self.restarts}
+
+    def shutdown(self):
+        """إيقاف جميع الـ processes / threads"""
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=True)
+            self._thread_pool = None
+        if self._idle is not None:
+            while not self._idle.empty():
+                self._idle.get_nowait().shutdown(wait=True)
+            self._idle = None
@@ -11,12 +11,15 @@ import os
 import sys
 import json
 import tempfile
+import threading
 import traceback
+import tracemalloc
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
 
-import rasterio
 import numpy as np
 from PIL import Image
 from rasterio.warp import transform_bounds
@@ -24,12 +27,130 @@ from rasterio.crs import CRS
 
 # Import PoC functions
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'geotiff-processor-poc'))
-from main import process_geotiff, extract_metadata, convert_to_png, create_world_file
+from main import process_geotiff, extract_metadata, convert_to_png, target_shape
+from raster_context import RasterContext, raster_context
+from tiles import generate_tile_pyramid
+from cog import write_cog
+from rendering import RenderSpec, render_spec_from_payload, render_image
+from encoders import encode_image, normalize_format, resolve_profile, file_extension, world_file_extension
+from raster_stats import compute_band_statistics
+from stretch import Stretch, compute_histograms, stretch_from_histograms, parse_percentiles
+from reprojection import target_crs, needs_reprojection, warp_to_crs, image_transform, write_world_file
 
 import logging
 logger = logging.getLogger('geoprocessing-processor')
 
 
+def _current_rss_bytes() -> Optional[int]:
+    """الذاكرة المقيمة الحالية للعملية (RSS)، بخلاف ru_maxrss الذي يبقى أقصى قيمة طوال عمرها"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _megabytes(value: Optional[float]) -> Optional[float]:
+    return round(value / (1024 * 1024), 2) if value is not None else None
+
+
+def _high_water_rss_bytes() -> Optional[int]:
+    """أقصى RSS للعملية منذ آخر reset (VmHWM)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_high_water_rss() -> bool:
+    """إعادة VmHWM إلى الـ RSS الحالي (Linux >= 4.0)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+_peak_meters_active = 0
+_peak_meters_lock = threading.Lock()
+
+
+class PeakRssMeter:
+    """
+    ذروة RSS أثناء معالجة ملف واحد (تشمل buffers الـ GDAL و PIL)
+
+    يُعاد ضبط VmHWM في بداية الملف ويُقرأ في نهايته. إذا كان ملف آخر يُقاس في نفس
+    العملية (processing executor بـ mode = 'thread') فلا يُعاد الضبط حتى لا تضيع ذروته،
+    وتُؤخذ الذروة من عينات RSS دورية بدلًا من ذلك. في الحالتين القيمة على مستوى العملية.
+    """
+
+    SAMPLE_INTERVAL = 0.01
+
+    def __init__(self):
+        self.start_bytes: Optional[int] = None
+        self.peak_bytes: Optional[int] = None
+        self.source: Optional[str] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stopped = False
+
+    def __enter__(self) -> 'PeakRssMeter':
+        global _peak_meters_active
+        with _peak_meters_lock:
+            exclusive = _peak_meters_active == 0
+            _peak_meters_active += 1
+
+        self.start_bytes = _current_rss_bytes()
+        if exclusive and _reset_high_water_rss() and _high_water_rss_bytes() is not None:
+            self.source = 'vmhwm'
+        elif self.start_bytes is not None:
+            self.source = 'sampled'
+            self.peak_bytes = self.start_bytes
+            self._sampler = threading.Thread(target=self._sample, name='peak-rss-sampler', daemon=True)
+            self._sampler.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.SAMPLE_INTERVAL):
+            rss = _current_rss_bytes()
+            if rss is not None and rss > self.peak_bytes:
+                self.peak_bytes = rss
+
+    def stop(self):
+        """إنهاء القياس (مرة واحدة؛ __exit__ بعده لا يفعل شيئًا)"""
+        global _peak_meters_active
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            rss = _current_rss_bytes()
+            if rss is not None:
+                self.peak_bytes = max(self.peak_bytes, rss)
+        elif self.source == 'vmhwm':
+            self.peak_bytes = _high_water_rss_bytes()
+        with _peak_meters_lock:
+            _peak_meters_active -= 1
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def report(self) -> Dict[str, Any]:
+        """peak_rss_mb و peak_rss_delta_mb (الذروة فوق RSS بداية الملف)"""
+        delta = self.peak_bytes - self.start_bytes if None not in (self.peak_bytes, self.start_bytes) else None
+        return {
+            'peak_rss_mb': _megabytes(self.peak_bytes),
+            'peak_rss_delta_mb': _megabytes(delta),
+            'peak_source': self.source
+        }
+
+
 class GeoprocessingProcessor:
     """
     معالج متخصص للملفات الجغرافية
@@ -48,6 +169,23 @@ class GeoprocessingProcessor:
         self.generate_thumbnails = self.config.get('generate_thumbnails', True)
         self.thumbnail_size = self.config.get('thumbnail_size', 256)
         self.include_statistics = self.config.get('include_statistics', True)
+        self.decimated_rendering = self.config.get('decimated_rendering', True)
+        self.cpu_cores = self.config.get('cpu_cores', 1)
+        self.tile_format = self.config.get('tile_format', 'png')
+        self.tile_size = self.config.get('tile_size', 256)
+        self.tile_max_count = self.config.get('tile_max_count', 50000)
+        self.cog_mode = self.config.get('cog_mode', 'off')  # off | alongside | only
+        self.cog_block_size = self.config.get('cog_block_size', 512)
+        self.build_overviews = self.config.get('build_overviews', False)
+        self.preserve_transparency = self.config.get('preserve_transparency', True)
+        self.stretch_percentiles = parse_percentiles(self.config.get('stretch_percentiles'))
+        self.distinct_count_error = float(self.config.get('distinct_count_error', 0.01))
+        self.encoding_profile = resolve_profile(self.config.get('encoding_profile'))
+        self.output_format = normalize_format(self.config.get('output_format'))
+        self.output_crs = self.config.get('coordinate_system')
+        self.warp_chunk_size = self.config.get('warp_chunk_size', 1024)
+        # tracemalloc is process-wide: only meaningful when one file is processed at a time
+        self.trace_memory = self.config.get('trace_memory', False)
         
         logger.info(f"Processor initialized with config: {self.config}")
     
@@ -86,21 +224,23 @@ class GeoprocessingProcessor:
             logger.warning(f"Failed to transform bounds to WGS84: {e}")
             return None
     
-    def validate_geotiff_file(self, file_path: str) -> Dict[str, Any]:
+    def validate_geotiff_file(self, file_path: str, context: Optional[RasterContext] = None) -> Dict[str, Any]:
         """
         التحقق من صحة ملف GeoTIFF قبل المعالجة
         """
         try:
-            with rasterio.open(file_path) as dataset:
+            with raster_context(file_path, context) as ctx:
+                dataset = ctx.dataset
                 validation = {
                     'valid': True,
-                    'file_size_mb': os.path.getsize(file_path) / (1024 * 1024),
+                    'file_size_mb': ctx.file_size / (1024 * 1024),
                     'dimensions': (dataset.width, dataset.height),
                     'bands': dataset.count,
                     'data_type': str(dataset.dtypes[0]),
                     'has_crs': dataset.crs is not None,
                     'has_transform': dataset.transform is not None,
-                    'compression': dataset.profile.get('compress', 'none'),
+                    'compression': ctx.profile.get('compress', 'none'),
+                    'block_shape': list(ctx.block_shapes[0]),
                     'issues': []
                 }
                 
@@ -134,15 +274,16 @@ class GeoprocessingProcessor:
                 'issues': [f'Cannot open file as GeoTIFF: {str(e)}']
             }
     
-    def generate_statistics(self, file_path: str) -> Dict[str, Any]:
+    def generate_statistics(self, file_path: str, context: Optional[RasterContext] = None) -> Dict[str, Any]:
         """
         إنشاء إحصائيات مفصلة للملف الجغرافي
         """
         try:
-            with rasterio.open(file_path) as dataset:
+            with raster_context(file_path, context, self.cpu_cores) as ctx:
+                dataset = ctx.dataset
                 stats = {
                     'general': {
-                        'file_size_bytes': os.path.getsize(file_path),
+                        'file_size_bytes': ctx.file_size,
                         'creation_time': datetime.fromtimestamp(os.path.getctime(file_path)).isoformat(),
                         'modification_time': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
                     },
@@ -168,31 +309,40 @@ class GeoprocessingProcessor:
                     'data_analysis': {}
                 }
                 
-                # Analyze first band data
+                # Exact statistics for all bands in one streaming pass over the native blocks
                 try:
-                    # Read data in chunks to avoid memory issues
-                    sample_size = min(1000, dataset.width, dataset.height)
-                    sample_data = dataset.read(1, window=((0, sample_size), (0, sample_size)))
+                    analysis_start = datetime.now()
+                    accumulators = compute_band_statistics(
+                        dataset, nodata=ctx.nodata, distinct_error=self.distinct_count_error, engine=ctx.engine()
+                    )
+                    
+                    # Share the histograms with the contrast stretch (no second pass)
+                    for band, accumulator in accumulators.items():
+                        ctx.cache[('histogram', band)] = accumulator.histogram
                     
-                    # Remove no-data values
-                    valid_data = sample_data[~np.isnan(sample_data)]
-                    if dataset.nodata is not None:
-                        valid_data = valid_data[valid_data != dataset.nodata]
+                    bands = [dict(band=band, **accumulator.to_dict()) for band, accumulator in accumulators.items()]
+                    first_band = accumulators[1]
                     
-                    if len(valid_data) > 0:
+                    if first_band.count > 0:
                         stats['data_analysis'] = {
-                            'min_value': float(np.min(valid_data)),
-                            'max_value': float(np.max(valid_data)),
-                            'mean_value': float(np.mean(valid_data)),
-                            'std_value': float(np.std(valid_data)),
-                            'unique_values': int(len(np.unique(valid_data))),
-                            'no_data_percentage': float((len(sample_data.flatten()) - len(valid_data)) / len(sample_data.flatten()) * 100),
-                            'sample_size': len(sample_data.flatten())
+                            'min_value': first_band.min_value,
+                            'max_value': first_band.max_value,
+                            'mean_value': first_band.mean,
+                            'std_value': first_band.std,
+                            'unique_values': bands[0]['unique_values'],
+                            'unique_values_method': bands[0]['unique_values_method'],
+                            'unique_values_error': bands[0]['unique_values_error'],
+                            'no_data_percentage': bands[0]['no_data_percentage'],
+                            'sample_size': first_band.count + first_band.nodata_count
                         }
                     else:
                         stats['data_analysis'] = {
-                            'error': 'No valid data found in sample'
+                            'error': 'No valid data found'
                         }
+                    
+                    stats['data_analysis']['bands'] = bands
+                    stats['data_analysis']['workers'] = ctx.workers
+                    stats['data_analysis']['processing_time_seconds'] = (datetime.now() - analysis_start).total_seconds()
                         
                 except Exception as e:
                     stats['data_analysis'] = {
@@ -206,14 +356,69 @@ class GeoprocessingProcessor:
                 'error': f'Statistics generation failed: {str(e)}'
             }
     
-    def create_thumbnail(self, geotiff_path: str, output_path: str) -> bool:
+    def render_spec(self, context: RasterContext, job_config: Dict[str, Any] = None) -> RenderSpec:
+        """اختيار النطاقات (grayscale / RGB) وقناة alpha من inputPayload"""
+        return render_spec_from_payload(
+            job_config or {}, context.count, context.has_mask, self.preserve_transparency, self.stretch_percentiles
+        )
+    
+    def band_stretch(self, context: RasterContext, spec: RenderSpec) -> Stretch:
+        """
+        حدود تمديد التباين (percentiles) للنطاقات المطلوبة
+        
+        الـ histogram لكل نطاق يُبنى مرة واحدة لكل ملف في مرور streaming واحد
+        ويُعاد استخدامه في PNG والـ thumbnail والـ tiles
+        """
+        stretch_key = ('stretch', spec.bands, spec.percentiles)
+        if stretch_key in context.cache:
+            return context.cache[stretch_key]
+        
+        missing = [band for band in dict.fromkeys(spec.bands) if ('histogram', band) not in context.cache]
+        if missing:
+            histogram_start = datetime.now()
+            for band, histogram in compute_histograms(context.dataset, missing, context.nodata, engine=context.engine()).items():
+                context.cache[('histogram', band)] = histogram
+            logger.debug(f"Histograms for bands {missing} built in {(datetime.now() - histogram_start).total_seconds():.2f}s")
+        
+        histograms = [context.cache[('histogram', band)] for band in spec.bands]
+        stretch = stretch_from_histograms(histograms, context.dtypes[spec.bands[0] - 1], spec.percentiles)
+        context.cache[stretch_key] = stretch
+        return stretch
+    
+    def render_preview(self, context: RasterContext, spec: RenderSpec, out_shape: Tuple[int, int]) -> Image.Image:
+        """
+        عرض الملف بحجم out_shape من أصغر overview كافٍ بحدود التمديد المشتركة للملف
+        """
+        reader = context.reader_for(out_shape[1], out_shape[0])
+        return render_image(reader, spec, out_shape, stretch=self.band_stretch(context, spec), nodata=context.nodata,
+                            engine=context.engine(reader))
+    
+    def derive_image(self, image: Image.Image, out_shape: Tuple[int, int]) -> Image.Image:
+        """
+        تصغير صورة معروضة مسبقًا (مثل الـ preview) إلى out_shape (height, width) في الذاكرة
+        
+        BOX يطابق الـ average resampling المستخدم عند القراءة من الملف.
+        """
+        out_height, out_width = out_shape
+        return image.resize((out_width, out_height), Image.Resampling.BOX, reducing_gap=2.0)
+    
+    def create_thumbnail(self, geotiff_path: str, output_path: str, context: Optional[RasterContext] = None,
+                         spec: Optional[RenderSpec] = None, image_format: Optional[str] = None,
+                         profile: Optional[str] = None,
+                         source_image: Optional[Image.Image] = None) -> Optional[Dict[str, Any]]:
         """
         إنشاء thumbnail من ملف GeoTIFF
+        
+        source_image: صورة أكبر معروضة مسبقًا (render chain: raster -> preview -> thumbnail)؛
+        إذا كانت كافية يُشتق الـ thumbnail منها دون قراءة الملف مرة أخرى
+        
+        Returns:
+            تقرير الترميز (الحجم والزمن ومصدر الصورة)، أو None عند الفشل
         """
         try:
-            with rasterio.open(geotiff_path) as dataset:
+            with raster_context(geotiff_path, context) as ctx:
                 # Calculate thumbnail dimensions
-                width, height = dataset.width, dataset.height
+                width, height = ctx.width, ctx.height
                 aspect_ratio = width / height
                 
                 if aspect_ratio > 1:
@@ -223,198 +428,509 @@ class GeoprocessingProcessor:
                     thumb_height = self.thumbnail_size
                     thumb_width = int(self.thumbnail_size * aspect_ratio)
                 
-                # Read and resample data
-                data = dataset.read(1, out_shape=(thumb_height, thumb_width), resampling=rasterio.enums.Resampling.average)
-                
-                # Convert to image
-                if np.issubdtype(data.dtype, np.floating):
-                    data = np.nan_to_num(data, nan=0.0)
-                
-                if data.max() > 0:
-                    data = (data - data.min()) / (data.max() - data.min()) * 255
-                data = data.astype(np.uint8)
+                if source_image is not None and source_image.width >= thumb_width and source_image.height >= thumb_height:
+                    image = self.derive_image(source_image, (thumb_height, thumb_width))
+                    source = 'preview'
+                else:
+                    # Render from the smallest overview that still covers the thumbnail size
+                    image = self.render_preview(ctx, spec or self.render_spec(ctx), (thumb_height, thumb_width))
+                    source = 'raster'
                 
-                # Create and save image
-                image = Image.fromarray(data)
-                image.save(output_path, 'PNG', optimize=True)
+                encoding = encode_image(
+                    image, output_path, image_format or self.output_format, profile or self.encoding_profile,
+                    self.compression_quality
+                )
+                encoding['source'] = source
                 
-                logger.info(f"Thumbnail created: {output_path} ({thumb_width}x{thumb_height})")
-                return True
+                logger.info(f"Thumbnail created: {output_path} ({thumb_width}x{thumb_height}, from {source})")
+                return encoding
                 
         except Exception as e:
             logger.error(f"Thumbnail creation failed: {e}")
-            return False
+            return None
     
     def process_geotiff_advanced(self, input_path: str, output_dir: str, job_config: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         معالجة متقدمة لملف GeoTIFF مع جميع الخيارات
         """
         job_config = job_config or {}
-        
-        # Validate input file
-        validation = self.validate_geotiff_file(input_path)
-        if not validation['valid']:
-            raise Exception(f"Invalid GeoTIFF file: {validation.get('error', 'Unknown validation error')}")
-        
-        # Create output directory
-        os.makedirs(output_dir, exist_ok=True)
-        file_name = Path(input_path).stem
-        
-        # Initialize result
-        result = {
-            'input_file': os.path.basename(input_path),
-            'validation': validation,
-            'output_files': {},
-            'processing_time': {},
-            'errors': []
-        }
-        
-        start_time = datetime.now()
-        
+
+        # Open the dataset once and share it between all stages
         try:
-            # 1. Extract metadata
-            logger.info("Extracting metadata...")
-            metadata_start = datetime.now()
-            metadata = extract_metadata(input_path)
+            context = RasterContext(input_path, workers=self.cpu_cores)
+        except Exception as e:
+            raise Exception(f"Invalid GeoTIFF file: {str(e)}")
+        
+        with context, ExitStack() as cleanup:
+            # Validate input file
+            validation = self.validate_geotiff_file(input_path, context)
+            if not validation['valid']:
+                raise Exception(f"Invalid GeoTIFF file: {validation.get('error', 'Unknown validation error')}")
+            
+            # Create output directory
+            os.makedirs(output_dir, exist_ok=True)
+            file_name = Path(input_path).stem
             
-            # Add advanced statistics if requested
-            if self.include_statistics:
-                metadata['statistics'] = self.generate_statistics(input_path)
+            # Initialize result
+            result = {
+                'input_file': os.path.basename(input_path),
+                'validation': validation,
+                'output_files': {},
+                'processing_time': {},
+                'errors': []
+            }
             
-            metadata_path = os.path.join(output_dir, f"{file_name}_metadata.json")
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=2, ensure_ascii=False)
+            start_time = datetime.now()
             
-            result['output_files']['metadata'] = metadata_path
-            result['processing_time']['metadata'] = (datetime.now() - metadata_start).total_seconds()
+            # Per-file memory: measured RSS peak plus RSS before/after (includes GDAL and PIL
+            # buffers); tracemalloc only on request (benchmarks / debugging) since it is process-wide
+            peak_meter = cleanup.enter_context(PeakRssMeter())
+            rss_start = peak_meter.start_bytes
+            buffer_estimate = None
+            started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            if self.trace_memory:
+                tracemalloc.reset_peak()
             
-        except Exception as e:
-            error_msg = f"Metadata extraction failed: {str(e)}"
-            logger.error(error_msg)
-            result['errors'].append(error_msg)
-        
-        try:
-            # 2. Convert to PNG
-            logger.info("Converting to PNG...")
-            png_start = datetime.now()
+            # Overviews: use existing levels, optionally build them once per job
+            result['overviews'] = {'available': context.overview_factors, 'built': False}
+            if not context.overview_factors and job_config.get('buildOverviews', self.build_overviews):
+                try:
+                    logger.info("Building overviews...")
+                    overviews_start = datetime.now()
+                    result['overviews']['available'] = context.build_overviews()
+                    result['overviews']['built'] = True
+                    result['processing_time']['overviews'] = (datetime.now() - overviews_start).total_seconds()
+                except Exception as e:
+                    error_msg = f"Overview building failed: {str(e)}"
+                    logger.warning(error_msg)
+                    result['errors'].append(error_msg)
+            
+            try:
+                # 1. Extract metadata
+                logger.info("Extracting metadata...")
+                metadata_start = datetime.now()
+                metadata = extract_metadata(context.dataset)
+                
+                # Add advanced statistics if requested
+                if self.include_statistics:
+                    metadata['statistics'] = self.generate_statistics(input_path, context)
+                
+                metadata_path = os.path.join(output_dir, f"{file_name}_metadata.json")
+                with open(metadata_path, 'w', encoding='utf-8') as f:
+                    json.dump(metadata, f, indent=2, ensure_ascii=False)
+                
+                result['output_files']['metadata'] = metadata_path
+                result['processing_time']['metadata'] = (datetime.now() - metadata_start).total_seconds()
+                
+            except Exception as e:
+                error_msg = f"Metadata extraction failed: {str(e)}"
+                logger.error(error_msg)
+                result['errors'].append(error_msg)
             
-            # Use custom max size if provided
+            cog_mode = job_config.get('cogMode', self.cog_mode)
+            render_png = cog_mode != 'only'
+            render_spec = self.render_spec(context, job_config)
+            output_format = normalize_format(job_config.get('outputFormat', self.output_format))
+            encoding_profile = resolve_profile(job_config.get('encodingProfile', self.encoding_profile))
+            result['encoding'] = {}
+            preview_image = None
+            
+            # Map-facing products (PNG, world file, thumbnail) are rendered in OUTPUT_CRS
             max_size = job_config.get('maxSize') or self.max_image_size
+            render_context = context
+            if render_png or self.generate_thumbnails:
+                try:
+                    render_context = self.reprojected_context(
+                        context, output_dir, file_name, job_config, max_size, render_spec, result, cleanup
+                    )
+                    # Areas outside the warped footprint are masked, so the spec may gain an alpha channel
+                    render_spec = self.render_spec(render_context, job_config)
+                except Exception as e:
+                    error_msg = f"Reprojection failed: {str(e)}"
+                    logger.error(error_msg)
+                    result['errors'].append(error_msg)
             
-            png_path = os.path.join(output_dir, f"{file_name}.png")
-            convert_to_png(input_path, png_path, max_size)
+            if render_png:
+                try:
+                    # 2. Convert to PNG
+                    logger.info("Converting to PNG...")
+                    png_start = datetime.now()
+                    
+                    decimated = job_config.get('renderMode', 'decimated' if self.decimated_rendering else 'full') == 'decimated'
+                    
+                    image_path = os.path.join(output_dir, f"{file_name}.{file_extension(output_format)}")
+                    out_shape = target_shape(render_context.width, render_context.height, max_size)
+                    # Decimated band reads plus the rendered image
+                    pixel_bytes = len(render_spec.bands) * np.dtype(render_context.dtype).itemsize + len(render_spec.mode)
+                    buffer_estimate = out_shape[0] * out_shape[1] * pixel_bytes
+                    if decimated:
+                        reader = render_context.reader_for(out_shape[1], out_shape[0])
+                        result['overviews']['png_factor'] = render_context.reader_factor(reader)
+                        preview_image = self.render_preview(render_context, render_spec, out_shape)
+                        result['encoding']['preview'] = encode_image(
+                            preview_image, image_path, output_format, encoding_profile, self.compression_quality
+                        )
+                        result['encoding']['preview']['source'] = 'raster'
+                        result['render'] = {
+                            'bands': list(render_spec.bands),
+                            'mode': preview_image.mode,
+                            'stretch_percentiles': list(render_spec.percentiles),
+                            'stretch_cutoffs': self.band_stretch(render_context, render_spec).cutoffs
+                        }
+                    else:
+                        # Legacy single-band grayscale path (PNG only)
+                        output_format = 'png'
+                        image_path = os.path.join(output_dir, f"{file_name}.png")
+                        convert_to_png(render_context.dataset, image_path, max_size)
+                    
+                    result['output_files'][output_format] = image_path
+                    result['processing_time']['png'] = (datetime.now() - png_start).total_seconds()
+                    
+                except Exception as e:
+                    error_msg = f"PNG conversion failed: {str(e)}"
+                    logger.error(error_msg)
+                    result['errors'].append(error_msg)
+                
+                try:
+                    # 3. Create World File
+                    logger.info("Creating World File...")
+                    world_start = datetime.now()
+                    
+                    world_file_path = os.path.join(output_dir, f"{file_name}.{world_file_extension(output_format)}")
+                    # Georeference the image as written (its size and CRS), not the source raster
+                    write_world_file(
+                        image_transform(render_context.transform, render_context.width, render_context.height, out_shape),
+                        world_file_path
+                    )
+                    
+                    result['output_files']['world_file'] = world_file_path
+                    result['processing_time']['world_file'] = (datetime.now() - world_start).total_seconds()
+                    
+                except Exception as e:
+                    error_msg = f"World file creation failed: {str(e)}"
+                    logger.error(error_msg)
+                    result['errors'].append(error_msg)
+                
+            try:
+                # 4. Create thumbnail if requested
+                if self.generate_thumbnails:
+                    logger.info("Creating thumbnail...")
+                    thumb_start = datetime.now()
+                    
+                    thumbnail_path = os.path.join(output_dir, f"{file_name}_thumbnail.{file_extension(output_format)}")
+                    thumbnail_encoding = self.create_thumbnail(
+                        render_context.file_path, thumbnail_path, render_context, render_spec, output_format, encoding_profile,
+                        source_image=preview_image
+                    )
+                    if thumbnail_encoding:
+                        result['encoding']['thumbnail'] = thumbnail_encoding
+                        result['output_files']['thumbnail'] = thumbnail_path
+                        result['processing_time']['thumbnail'] = (datetime.now() - thumb_start).total_seconds()
+                    
+            except Exception as e:
+                error_msg = f"Thumbnail creation failed: {str(e)}"
+                logger.error(error_msg)
+                result['errors'].append(error_msg)
             
-            result['output_files']['png'] = png_path
-            result['processing_time']['png'] = (datetime.now() - png_start).total_seconds()
+            # The preview is no longer needed once the smaller products are derived
+            preview_image = None
             
-        except Exception as e:
-            error_msg = f"PNG conversion failed: {str(e)}"
-            logger.error(error_msg)
-            result['errors'].append(error_msg)
+            try:
+                # 5. Cloud-Optimized GeoTIFF if requested
+                if cog_mode in ('alongside', 'only'):
+                    logger.info("Writing Cloud-Optimized GeoTIFF...")
+                    cog_start = datetime.now()
+                    
+                    cog_path = os.path.join(output_dir, f"{file_name}_cog.tif")
+                    result['cog'] = write_cog(context.dataset, cog_path, block_size=self.cog_block_size)
+                    
+                    result['output_files']['cog'] = cog_path
+                    result['processing_time']['cog'] = (datetime.now() - cog_start).total_seconds()
+                
+            except Exception as e:
+                error_msg = f"COG creation failed: {str(e)}"
+                logger.error(error_msg)
+                result['errors'].append(error_msg)
         
-        try:
-            # 3. Create World File
-            logger.info("Creating World File...")
-            world_start = datetime.now()
+            # Calculate total processing time
+            total_time = (datetime.now() - start_time).total_seconds()
+            result['processing_time']['total'] = total_time
+            
+            peak_meter.stop()
+            rss_end = _current_rss_bytes()
+            result['memory'] = dict(
+                peak_meter.report(),
+                rss_mb=_megabytes(rss_end),
+                rss_delta_mb=_megabytes(rss_end - rss_start) if rss_start is not None and rss_end is not None else None,
+                buffer_estimate_mb=_megabytes(buffer_estimate)
+            )
+            if self.trace_memory:
+                _, peak_traced = tracemalloc.get_traced_memory()
+                result['memory']['peak_traced_mb'] = _megabytes(peak_traced)
+            if started_tracing:
+                tracemalloc.stop()
             
-            world_file_path = os.path.join(output_dir, f"{file_name}.pgw")
-            create_world_file(input_path, world_file_path)
+            # Summary
+            result['summary'] = {
+                'total_output_files': len(result['output_files']),
+                'has_errors': len(result['errors']) > 0,
+                'processing_time_seconds': total_time,
+                'successful_operations': len([k for k in result['output_files'].keys()]),
+                'failed_operations': len(result['errors']),
+                'peak_rss_delta_mb': result['memory']['peak_rss_delta_mb'],
+                'rss_delta_mb': result['memory']['rss_delta_mb']
+            }
             
-            result['output_files']['world_file'] = world_file_path
-            result['processing_time']['world_file'] = (datetime.now() - world_start).total_seconds()
+            logger.info(f"Processing completed in {total_time:.2f}s with {len(result['errors'])} errors")
             
-        except Exception as e:
-            error_msg = f"World file creation failed: {str(e)}"
-            logger.error(error_msg)
-            result['errors'].append(error_msg)
+            return result
+    
+    def reprojected_context(self, context: RasterContext, output_dir: str, file_name: str,
+                            job_config: Dict[str, Any], max_size: int, spec: RenderSpec,
+                            result: Dict[str, Any], cleanup: ExitStack) -> RasterContext:
+        """
+        سياق العرض بنظام OUTPUT_CRS (أو "outputCrs" في inputPayload)
         
-        try:
-            # 4. Create thumbnail if requested
-            if self.generate_thumbnails:
-                logger.info("Creating thumbnail...")
-                thumb_start = datetime.now()
-                
-                thumbnail_path = os.path.join(output_dir, f"{file_name}_thumbnail.png")
-                if self.create_thumbnail(input_path, thumbnail_path):
-                    result['output_files']['thumbnail'] = thumbnail_path
-                    result['processing_time']['thumbnail'] = (datetime.now() - thumb_start).total_seconds()
-                
-        except Exception as e:
-            error_msg = f"Thumbnail creation failed: {str(e)}"
-            logger.error(error_msg)
-            result['errors'].append(error_msg)
+        إذا اختلف نظام الملف يُعاد إسقاطه إلى GeoTIFF مؤقت بدقة المعاينة، ويُعاد استخدام
+        حدود التمديد المحسوبة من الملف الأصلي. الملف المؤقت يُحذف بعد انتهاء المعالجة.
+        """
+        dst_crs = target_crs(job_config.get('outputCrs', self.output_crs))
+        if not needs_reprojection(context.crs, dst_crs):
+            return context
         
-        # Calculate total processing time
-        total_time = (datetime.now() - start_time).total_seconds()
-        result['processing_time']['total'] = total_time
+        logger.info(f"Reprojecting {context.crs} -> {dst_crs}...")
+        warp_start = datetime.now()
+        warped_path = os.path.join(output_dir, f".{file_name}_warped.tif")
+        cleanup.callback(lambda: os.path.exists(warped_path) and os.remove(warped_path))
         
-        # Summary
-        result['summary'] = {
-            'total_output_files': len(result['output_files']),
-            'has_errors': len(result['errors']) > 0,
-            'processing_time_seconds': total_time,
-            'successful_operations': len([k for k in result['output_files'].keys()]),
-            'failed_operations': len(result['errors'])
-        }
+        # The stretch comes from the source histograms, so warping does not shift the contrast
+        self.band_stretch(context, spec)
+        result['reprojection'] = warp_to_crs(
+            context.dataset, warped_path, dst_crs, workers=self.cpu_cores, max_size=max_size,
+            chunk_size=self.warp_chunk_size
+        )
         
-        logger.info(f"Processing completed in {total_time:.2f}s with {len(result['errors'])} errors")
+        render_context = cleanup.enter_context(RasterContext(warped_path, workers=self.cpu_cores))
+        render_context.cache.update(context.cache)
+        result['processing_time']['reprojection'] = (datetime.now() - warp_start).total_seconds()
+        return render_context
+    
+    def generate_tiles(self, input_path: str, output_dir: str, job_config: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        إنشاء هرم tiles (z/x/y) بنظام Web Mercator لعرضه في Leaflet
+        """
+        job_config = job_config or {}
+        
+        # One open for validation, histograms, stretch and tiles (shared per-thread dataset handles)
+        try:
+            context = RasterContext(input_path, workers=self.cpu_cores)
+        except Exception as e:
+            raise Exception(f"Invalid GeoTIFF file: {str(e)}")
+        
+        with context:
+            validation = self.validate_geotiff_file(input_path, context)
+            if not validation['valid']:
+                raise Exception(f"Invalid GeoTIFF file: {validation.get('error', 'Unknown validation error')}")
+            
+            # Low zooms are rendered from overviews; build them once if the file has none
+            overviews_built = False
+            if not context.overview_factors and job_config.get('buildOverviews', self.build_overviews):
+                try:
+                    context.build_overviews()
+                    overviews_built = True
+                except Exception as e:
+                    logger.warning(f"Overview building failed: {str(e)}")
+            
+            render_spec = self.render_spec(context, job_config)
+            stretch = self.band_stretch(context, render_spec)
+            
+            logger.info(f"Generating tile pyramid for {os.path.basename(input_path)}...")
+            result = generate_tile_pyramid(
+                input_path,
+                output_dir,
+                min_zoom=job_config.get('minZoom'),
+                max_zoom=job_config.get('maxZoom'),
+                tile_format=job_config.get('tileFormat', self.tile_format),
+                tile_size=job_config.get('tileSize', self.tile_size),
+                max_tiles=self.tile_max_count,
+                bands=list(render_spec.bands),
+                stretch=stretch,
+                encoding_profile=resolve_profile(job_config.get('encodingProfile', self.encoding_profile)),
+                context=context
+            )
+            result['overviews'] = {'available': context.overview_factors, 'built': overviews_built}
+        result['input_file'] = os.path.basename(input_path)
+        result['validation'] = validation
         
         return result
     
-    def batch_process_files(self, input_files: List[str], output_base_dir: str, job_config: Dict[str, Any] = None) -> Dict[str, Any]:
+    def batch_process_files(self, input_files: List[str], output_base_dir: str, job_config: Dict[str, Any] = None,
+                            on_file_result: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """
         معالجة متعددة الملفات
+        
+        مع CPU_CORES > 1 تُوزع الملفات على process pool، وتصل نتيجة كل ملف فور
+        انتهائه (on_file_result) بترتيب الانتهاء. الملخص مطابق للمعالجة المتسلسلة.
         """
         batch_start = datetime.now()
-        batch_result = {
-            'files': {},
-            'summary': {
-                'total_files': len(input_files),
-                'successful': 0,
-                'failed': 0,
-                'total_output_files': 0
-            },
-            'errors': []
-        }
+        batch_result = new_batch_result(len(input_files))
         
-        for i, input_file in enumerate(input_files):
-            try:
-                logger.info(f"Processing file {i+1}/{len(input_files)}: {os.path.basename(input_file)}")
-                
-                # Create individual output directory
-                file_output_dir = os.path.join(output_base_dir, f"file_{i+1}_{Path(input_file).stem}")
-                
-                # Process the file
-                file_result = self.process_geotiff_advanced(input_file, file_output_dir, job_config)
-                
-                batch_result['files'][os.path.basename(input_file)] = file_result
-                
-                if file_result['summary']['has_errors']:
-                    batch_result['summary']['failed'] += 1
-                else:
-                    batch_result['summary']['successful'] += 1
-                
-                batch_result['summary']['total_output_files'] += file_result['summary']['total_output_files']
-                
-            except Exception as e:
-                error_msg = f"Failed to process {os.path.basename(input_file)}: {str(e)}"
-                logger.error(error_msg)
-                batch_result['errors'].append(error_msg)
-                batch_result['summary']['failed'] += 1
-                
-                batch_result['files'][os.path.basename(input_file)] = {
-                    'error': error_msg,
-                    'traceback': traceback.format_exc()
-                }
+        workers = max(1, min(self.cpu_cores, len(input_files)))
+        tasks = [
+            (input_file, batch_output_dir(output_base_dir, i, input_file))
+            for i, input_file in enumerate(input_files)
+        ]
+        
+        if workers > 1:
+            logger.info(f"Processing {len(input_files)} files with {workers} processes")
+            results = self._batch_results_parallel(tasks, job_config, workers)
+        else:
+            results = (
+                process_batch_file(self, i, input_file, file_output_dir, job_config, len(input_files))
+                for i, (input_file, file_output_dir) in enumerate(tasks)
+            )
+        
+        # Results arrive in completion order
+        completed = {}
+        for index, file_result, error_msg in results:
+            file_name = os.path.basename(input_files[index])
+            completed[index] = (file_name, file_result)
+            record_batch_file(batch_result, file_result, error_msg)
+            
+            if on_file_result:
+                on_file_result(file_name, file_result)
         
-        # Calculate total batch time
-        batch_time = (datetime.now() - batch_start).total_seconds()
-        batch_result['summary']['total_processing_time'] = batch_time
-        batch_result['summary']['average_time_per_file'] = batch_time / len(input_files) if input_files else 0
+        # Same file order as the input list (and the sequential mode)
+        finalize_batch_result(
+            batch_result,
+            [completed[index] for index in sorted(completed)],
+            (datetime.now() - batch_start).total_seconds(),
+            workers
+        )
         
         logger.info(f"Batch processing completed: {batch_result['summary']['successful']}/{batch_result['summary']['total_files']} successful")
         
         return batch_result
+    
+    def _batch_results_parallel(self, tasks: List[Tuple[str, str]], job_config: Optional[Dict[str, Any]],
+                                workers: int) -> Iterator[Tuple[int, Dict[str, Any], Optional[str]]]:
+        """تشغيل process_geotiff_advanced لكل ملف في process pool وإرجاع النتائج بترتيب الانتهاء"""
+        # Each process handles one file at a time, so nested thread pools stay at one core
+        child_config = dict(self.config, cpu_cores=1)
+        
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                                 initargs=(child_config,)) as executor:
+            futures = {
+                executor.submit(process_batch_file, None, i, input_file, file_output_dir, job_config, len(tasks)): i
+                for i, (input_file, file_output_dir) in enumerate(tasks)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # The worker process itself failed (e.g. killed by the OOM killer)
+                    error_msg = f"Failed to process {os.path.basename(tasks[index][0])}: {str(e)}"
+                    yield index, {'error': error_msg, 'traceback': traceback.format_exc()}, error_msg
+
+
+def batch_output_dir(output_base_dir: str, index: int, input_file: str) -> str:
+    """مجلد مخرجات الملف رقم index في الدفعة"""
+    return os.path.join(output_base_dir, f"file_{index+1}_{Path(input_file).stem}")
+
+
+def new_batch_result(total_files: int) -> Dict[str, Any]:
+    """نتيجة دفعة فارغة (نفس البنية سواء عولجت الملفات دفعة واحدة أو عبر pipeline)"""
+    return {
+        'files': {},
+        'summary': {
+            'total_files': total_files,
+            'successful': 0,
+            'failed': 0,
+            'total_output_files': 0
+        },
+        'errors': []
+    }
+
+
+def record_batch_file(batch_result: Dict[str, Any], file_result: Dict[str, Any], error_msg: Optional[str]):
+    """إضافة نتيجة ملف واحد إلى ملخص الدفعة"""
+    if error_msg:
+        logger.error(error_msg)
+        batch_result['errors'].append(error_msg)
+        batch_result['summary']['failed'] += 1
+        return
+    
+    if file_result['summary']['has_errors']:
+        batch_result['summary']['failed'] += 1
+    else:
+        batch_result['summary']['successful'] += 1
+    
+    batch_result['summary']['total_output_files'] += file_result['summary']['total_output_files']
+
+
+def finalize_batch_result(batch_result: Dict[str, Any], ordered_files: List[Tuple[str, Dict[str, Any]]],
+                          batch_time: float, workers: int):
+    """ترتيب نتائج الملفات حسب الإدخال وإضافة أزمنة الدفعة"""
+    for file_name, file_result in ordered_files:
+        batch_result['files'][file_name] = file_result
+    
+    total_files = batch_result['summary']['total_files']
+    batch_result['summary']['total_processing_time'] = batch_time
+    batch_result['summary']['average_time_per_file'] = batch_time / total_files if total_files else 0
+    batch_result['summary']['workers'] = workers
+
+
+# Per-process processor for batch workers
+_batch_processor: Optional[GeoprocessingProcessor] = None
+# Single-core siblings used when files of one job are processed in parallel
+_core_processors: Dict[Tuple[int, int], GeoprocessingProcessor] = {}
+
+
+def init_batch_worker(config: Dict[str, Any]):
+    """إنشاء processor مرة واحدة لكل process"""
+    global _batch_processor
+    _batch_processor = GeoprocessingProcessor(config)
+
+
+def _processor_with_cores(processor: GeoprocessingProcessor, cpu_cores: int) -> GeoprocessingProcessor:
+    """نسخة من processor بعدد cores مختلف (تُنشأ مرة واحدة لكل process)"""
+    key = (id(processor), cpu_cores)
+    if key not in _core_processors:
+        _core_processors[key] = GeoprocessingProcessor(dict(processor.config, cpu_cores=cpu_cores))
+    return _core_processors[key]
+
+
+def process_batch_file(processor: Optional[GeoprocessingProcessor], index: int, input_file: str,
+                        file_output_dir: str, job_config: Optional[Dict[str, Any]],
+                        total_files: int, cpu_cores: Optional[int] = None) -> Tuple[int, Dict[str, Any], Optional[str]]:
+    """
+    معالجة ملف واحد من الدفعة
+    
+    Args:
+        cpu_cores: cores هذا الملف (1 عند معالجة عدة ملفات بالتوازي)، None = إعداد الـ processor
+    
+    Returns:
+        (index, نتيجة الملف, رسالة الخطأ أو None)
+    """
+    processor = processor or _batch_processor
+    if cpu_cores and cpu_cores != processor.cpu_cores:
+        processor = _processor_with_cores(processor, cpu_cores)
+    try:
+        logger.info(f"Processing file {index+1}/{total_files}: {os.path.basename(input_file)}")
+        return index, processor.process_geotiff_advanced(input_file, file_output_dir, job_config), None
+        
+    except Exception as e:
+        error_msg = f"Failed to process {os.path.basename(input_file)}: {str(e)}"
+        return index, {'error': error_msg, 'traceback': traceback.format_exc()}, error_msg
+
+
+def generate_tiles_file(processor: Optional[GeoprocessingProcessor], input_path: str, output_dir: str,
+                        job_config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """generate_tiles بنفس واجهة process_batch_file (processor = None يعني processor الـ process الحالي)"""
+    return (processor or _batch_processor).generate_tiles(input_path, output_dir, job_config)
 
 
 def create_processor(config: Dict[str, Any] = None) -> GeoprocessingProcessor:
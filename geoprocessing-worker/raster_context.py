@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Raster Processing Context
+=========================
+
+سياق معالجة لملف raster واحد: يُفتح الملف مرة واحدة فقط وتُحفظ
+معلومات الـ header والـ transform والـ CRS والـ nodata وتخطيط الـ blocks
+لتستخدمها جميع مراحل المعالجة بدلًا من إعادة فتح الملف في كل مرحلة.
+"""
+
+import os
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterator
+
+import rasterio
+from rasterio.enums import MaskFlags, Resampling
+from rasterio.windows import Window
+
+from block_engine import BlockEngine
+
+import logging
+logger = logging.getLogger('raster-context')
+
+
+class RasterContext:
+    """
+    dataset مفتوح مرة واحدة مع header مخزّن مؤقتًا
+
+    مثال:
+        with RasterContext('input.tif') as context:
+            metadata = extract_metadata(context.dataset)
+    """
+
+    def __init__(self, file_path: str, workers: int = 1):
+        self.file_path = file_path
+        self.workers = max(1, int(workers))
+        self.file_size = os.path.getsize(file_path)
+        self.dataset = rasterio.open(file_path)
+
+        dataset = self.dataset
+        self.driver = dataset.driver
+        self.width = dataset.width
+        self.height = dataset.height
+        self.count = dataset.count
+        self.dtypes = dataset.dtypes
+        self.dtype = dataset.dtypes[0]
+        self.crs = dataset.crs
+        self.transform = dataset.transform
+        self.bounds = dataset.bounds
+        self.nodata = dataset.nodata
+        self.profile = dict(dataset.profile)
+        self.block_shapes = dataset.block_shapes
+        self.has_mask = any(MaskFlags.all_valid not in flags for flags in dataset.mask_flag_enums)
+
+        # Derived products shared between stages (histograms, statistics, ...)
+        self.cache: Dict[str, Any] = {}
+        self._block_windows: Dict[int, List[Window]] = {}
+        self._overview_factors: Optional[List[int]] = None
+        self._overview_datasets: Dict[int, Any] = {}
+        self._engines: Dict[Optional[int], BlockEngine] = {}
+
+        logger.debug(f"Opened raster context: {file_path} ({self.width}x{self.height}x{self.count})")
+
+    @property
+    def header(self) -> Dict[str, Any]:
+        """ملخص الـ header المخزّن دون الرجوع إلى الملف"""
+        return {
+            'driver': self.driver,
+            'width': self.width,
+            'height': self.height,
+            'count': self.count,
+            'dtype': str(self.dtype),
+            'crs': str(self.crs) if self.crs else None,
+            'transform': list(self.transform)[:6],
+            'nodata': self.nodata,
+            'has_mask': self.has_mask,
+            'block_shapes': [list(shape) for shape in self.block_shapes],
+            'compression': self.profile.get('compress', 'none'),
+            'file_size_bytes': self.file_size
+        }
+
+    def block_windows(self, band: int = 1) -> List[Window]:
+        """نوافذ الـ blocks الأصلية للـ band (تُحسب مرة واحدة)"""
+        if band not in self._block_windows:
+            self._block_windows[band] = [window for _, window in self.dataset.block_windows(band)]
+        return self._block_windows[band]
+
+    @property
+    def overview_factors(self) -> List[int]:
+        """معاملات الـ overviews المتاحة (داخلية أو ملف .ovr خارجي)، مثل [2, 4, 8]"""
+        if self._overview_factors is None:
+            self._overview_factors = list(self.dataset.overviews(1))
+        return self._overview_factors
+
+    def select_overview(self, out_width: int, out_height: int) -> Optional[int]:
+        """
+        أصغر مستوى overview لا تقل أبعاده عن الحجم المطلوب
+
+        Returns:
+            index المستوى (لاستخدامه مع overview_level)، أو None للدقة الكاملة
+        """
+        selected = None
+        for level, factor in enumerate(self.overview_factors):
+            level_width = (self.width + factor - 1) // factor
+            level_height = (self.height + factor - 1) // factor
+            if level_width >= out_width and level_height >= out_height:
+                selected = level
+        return selected
+
+    def reader_for(self, out_width: int, out_height: int):
+        """
+        dataset مناسب للقراءة بحجم المخرجات: أصغر overview كافٍ أو الملف الأصلي
+
+        يُفتح كل مستوى overview مرة واحدة فقط ويُعاد استخدامه بين المراحل.
+        """
+        level = self.select_overview(out_width, out_height)
+        if level is None:
+            return self.dataset
+
+        if level not in self._overview_datasets:
+            self._overview_datasets[level] = rasterio.open(self.file_path, overview_level=level)
+            logger.debug(f"Reading from overview level {level} (x{self.overview_factors[level]})")
+        return self._overview_datasets[level]
+
+    def engine(self, reader=None) -> BlockEngine:
+        """
+        BlockEngine بعدد self.workers من الـ threads للـ dataset الأصلي أو لمستوى overview مفتوح
+
+        محرك واحد لكل مستوى يُعاد استخدامه (مع الـ handles الخاصة بكل thread) بين المراحل.
+        """
+        level = None
+        if reader is not None and reader is not self.dataset:
+            level = next(level for level, dataset in self._overview_datasets.items() if dataset is reader)
+
+        if level not in self._engines:
+            open_kwargs = {} if level is None else {'overview_level': level}
+            self._engines[level] = BlockEngine(
+                self.file_path, self.workers, dataset=self.dataset if reader is None else reader, **open_kwargs
+            )
+        return self._engines[level]
+
+    def _close_engines(self):
+        for engine in self._engines.values():
+            engine.close()
+        self._engines.clear()
+
+    def reader_factor(self, reader) -> int:
+        """معامل التصغير للـ dataset المستخدم في القراءة (1 للدقة الكاملة)"""
+        return max(1, round(self.width / reader.width))
+
+    def build_overviews(self, min_size: int = 256, resampling: str = 'average') -> List[int]:
+        """
+        بناء overviews خارجية (.ovr) مرة واحدة إذا لم تكن موجودة
+
+        الملف الأصلي لا يُعدّل؛ GDAL يكتب الـ overviews في ملف .ovr بجانبه.
+        """
+        if self.overview_factors:
+            return self.overview_factors
+
+        factors = []
+        factor = 2
+        while max(self.width, self.height) / factor >= min_size:
+            factors.append(factor)
+            factor *= 2
+        if not factors:
+            return []
+
+        self._close_engines()
+        self.dataset.close()
+        try:
+            with rasterio.Env(TIFF_USE_OVR=True):
+                with rasterio.open(self.file_path, 'r+') as dataset:
+                    dataset.build_overviews(factors, Resampling[resampling])
+        finally:
+            self.dataset = rasterio.open(self.file_path)
+
+        self._overview_factors = None
+        logger.info(f"Built overviews {factors} for {os.path.basename(self.file_path)}")
+        return self.overview_factors
+
+    def close(self):
+        """إغلاق الـ dataset وأي overviews أو handles للـ threads مفتوحة"""
+        self._close_engines()
+        for overview_dataset in self._overview_datasets.values():
+            overview_dataset.close()
+        self._overview_datasets.clear()
+        if not self.dataset.closed:
+            self.dataset.close()
+
+    def __enter__(self) -> 'RasterContext':
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+@contextmanager
+def raster_context(file_path: str, context: Optional[RasterContext] = None,
+                   workers: int = 1) -> Iterator[RasterContext]:
+    """
+    إعادة استخدام سياق موجود أو فتح سياق مؤقت يُغلق بعد الاستخدام
+    """
+    if context is not None:
+        yield context
+        return
+
+    with RasterContext(file_path, workers) as new_context:
+        yield new_context
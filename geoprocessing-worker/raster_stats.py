@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Streaming Raster Statistics
+===========================
+
+إحصائيات دقيقة لكامل الملف (وليس عينة) في مرور streaming واحد على الـ blocks:
+min / max / mean / std عبر accumulators قابلة للدمج (Chan et al.)،
+مع histogram وعدد بكسلات nodata وعدد القيم المختلفة لكل نطاق.
+
+تُوزع الـ blocks على threads الـ BlockEngine (dataset handle خاص لكل thread)،
+وتُدمج النتائج الجزئية في النهاية. الذاكرة ثابتة مهما كان حجم الملف.
+"""
+
+from typing import Dict, Any, Optional, Sequence
+
+import numpy as np
+from rasterio.windows import Window
+
+from block_engine import BlockEngine
+from cardinality import HyperLogLog, DEFAULT_RELATIVE_ERROR
+from stretch import StreamingHistogram, stream_windows, valid_pixels
+
+import logging
+logger = logging.getLogger('raster-stats')
+
+
+class BandAccumulator:
+    """accumulator قابل للدمج لإحصائيات نطاق واحد"""
+
+    def __init__(self, dtype, distinct_error: float = DEFAULT_RELATIVE_ERROR):
+        self.count = 0
+        self.nodata_count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared deviations from the mean
+        self.min_value: Optional[float] = None
+        self.max_value: Optional[float] = None
+        self.histogram = StreamingHistogram(dtype)
+        # 8/16-bit data: the histogram has one bin per value, so the distinct count is exact
+        self.distinct = None if self.histogram.exact else HyperLogLog.for_error(distinct_error)
+
+    def update(self, values: np.ndarray, invalid_count: int = 0):
+        """إضافة قيم block واحد (القيم الصالحة فقط + عدد البكسلات غير الصالحة)"""
+        self.nodata_count += invalid_count
+        if values.size == 0:
+            return
+
+        mean = float(values.mean(dtype=np.float64))
+        m2 = float(np.square(values - mean, dtype=np.float64).sum())
+        self._merge_moments(int(values.size), mean, m2, float(values.min()), float(values.max()))
+        self.histogram.update(values)
+        if self.distinct is not None:
+            self.distinct.update(values)
+
+    def merge(self, other: 'BandAccumulator'):
+        """دمج accumulator جزئي من thread أو block آخر"""
+        self.nodata_count += other.nodata_count
+        if other.count:
+            self._merge_moments(other.count, other.mean, other.m2, other.min_value, other.max_value)
+        self.histogram.merge(other.histogram)
+        if self.distinct is not None:
+            self.distinct.merge(other.distinct)
+
+    def _merge_moments(self, count: int, mean: float, m2: float, min_value: float, max_value: float):
+        if self.count == 0:
+            self.count, self.mean, self.m2 = count, mean, m2
+            self.min_value, self.max_value = min_value, max_value
+            return
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min_value = min(self.min_value, min_value)
+        self.max_value = max(self.max_value, max_value)
+
+    @property
+    def std(self) -> float:
+        """الانحراف المعياري للمجتمع (مثل np.std)"""
+        return float(np.sqrt(self.m2 / self.count)) if self.count else 0.0
+
+    @property
+    def unique_values(self) -> int:
+        """عدد القيم المختلفة (دقيق لبيانات 8/16-bit، وتقدير HyperLogLog لغيرها)"""
+        if self.distinct is None:
+            return int(np.count_nonzero(self.histogram.counts))
+        return self.distinct.estimate()
+
+    def to_dict(self, histogram_bins: int = 64) -> Dict[str, Any]:
+        pixel_count = self.count + self.nodata_count
+        return {
+            'min_value': self.min_value,
+            'max_value': self.max_value,
+            'mean_value': self.mean if self.count else None,
+            'std_value': self.std if self.count else None,
+            'valid_count': self.count,
+            'nodata_count': self.nodata_count,
+            'no_data_percentage': float(self.nodata_count / pixel_count * 100) if pixel_count else 0.0,
+            'unique_values': self.unique_values,
+            'unique_values_method': 'exact' if self.distinct is None else 'hyperloglog',
+            'unique_values_error': 0.0 if self.distinct is None else round(self.distinct.relative_error, 6),
+            'histogram': self.histogram.summary(histogram_bins)
+        }
+
+
+def _accumulate_window(dataset, window: Window, bands: Sequence[int], nodata: Optional[float],
+                       accumulators: Dict[int, BandAccumulator]):
+    """kernel لنافذة واحدة: تحديث accumulator كل نطاق بالقيم الصالحة"""
+    data = dataset.read(bands, window=window)
+    mask_valid = dataset.dataset_mask(window=window) > 0
+    for index, band in enumerate(bands):
+        valid = valid_pixels(data[index], mask_valid, nodata)
+        values = data[index][valid]
+        accumulators[band].update(values, invalid_count=valid.size - values.size)
+
+
+def compute_band_statistics(dataset, bands: Optional[Sequence[int]] = None, nodata: Optional[float] = None,
+                            workers: int = 1, distinct_error: float = DEFAULT_RELATIVE_ERROR,
+                            engine: Optional[BlockEngine] = None) -> Dict[int, BandAccumulator]:
+    """
+    إحصائيات دقيقة لكل نطاق عبر كامل الملف
+
+    Args:
+        dataset: dataset مفتوح
+        bands: النطاقات المطلوبة (افتراضيًا جميع النطاقات)
+        workers: عدد الـ threads (عند عدم تمرير engine)
+        distinct_error: الخطأ النسبي المعياري المسموح لتقدير عدد القيم المختلفة
+        engine: BlockEngine مشترك (مثل RasterContext.engine())
+
+    Returns:
+        BandAccumulator لكل نطاق (يحتوي على الـ histogram لإعادة استخدامه في الـ stretch)
+    """
+    bands = list(bands or range(1, dataset.count + 1))
+    windows = list(stream_windows(dataset))
+    dtypes = dataset.dtypes
+
+    def new_accumulators() -> Dict[int, BandAccumulator]:
+        return {band: BandAccumulator(dtypes[band - 1], distinct_error) for band in bands}
+
+    def merge_accumulators(target: Dict[int, BandAccumulator], other: Dict[int, BandAccumulator]):
+        for band in bands:
+            target[band].merge(other[band])
+
+    def kernel(handle, window: Window, accumulators: Dict[int, BandAccumulator]):
+        _accumulate_window(handle, window, bands, nodata, accumulators)
+
+    if engine is not None:
+        return engine.reduce(kernel, windows, new_accumulators, merge_accumulators)
+
+    with BlockEngine(dataset.name, workers, dataset=dataset) as engine:
+        return engine.reduce(kernel, windows, new_accumulators, merge_accumulators)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Raster Rendering Engine
+=======================
+
+محرك عرض متعدد النطاقات (grayscale / RGB) مع قناة alpha من الـ nodata mask.
+
+- اختيار النطاقات من inputPayload (مثل "bands": [3, 2, 1])
+- القراءة بدقة المخرجات على شكل شرائح (strips)، موزعة على threads الـ BlockEngine
+- تمديد التباين بحدود percentiles (انظر stretch.py) لجميع النطاقات معًا
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from block_engine import BlockEngine, row_strips, strip_rows_for
+from kernels import buffer_pool
+from stretch import Stretch, DEFAULT_PERCENTILES, parse_percentiles
+
+import logging
+logger = logging.getLogger('rendering-engine')
+
+DEFAULT_STRIP_ROWS = 256
+
+
+@dataclass(frozen=True)
+class RenderSpec:
+    """النطاقات المستخدمة في العرض وما إذا كانت قناة alpha مطلوبة وحدود الـ percentiles"""
+    bands: Tuple[int, ...] = (1,)
+    alpha: bool = True
+    percentiles: Tuple[float, float] = DEFAULT_PERCENTILES
+
+    @property
+    def mode(self) -> str:
+        """PIL image mode للمخرجات"""
+        if len(self.bands) == 3:
+            return 'RGBA' if self.alpha else 'RGB'
+        return 'LA' if self.alpha else 'L'
+
+
+def render_spec_from_payload(job_config: Dict[str, Any], band_count: int, has_mask: bool = True,
+                             preserve_transparency: bool = True,
+                             percentiles: Tuple[float, float] = DEFAULT_PERCENTILES) -> RenderSpec:
+    """
+    إنشاء RenderSpec من inputPayload
+
+    - "bands": [r, g, b] أو [band] (أرقام تبدأ من 1)
+    - افتراضيًا: RGB من النطاقات 1-3 إذا كان الملف يحتوي 3 نطاقات أو أكثر، وإلا grayscale
+    - قناة alpha تُضاف فقط إذا كان للملف nodata/mask/alpha band
+    - "stretchPercentiles": [low, high] لحدود تمديد التباين
+    """
+    bands = job_config.get('bands')
+    if bands is None:
+        bands = (1, 2, 3) if band_count >= 3 else (1,)
+
+    bands = tuple(int(band) for band in bands)
+    if len(bands) not in (1, 3):
+        raise ValueError(f"bands must contain 1 (grayscale) or 3 (RGB) band indexes, got {list(bands)}")
+    for band in bands:
+        if not 1 <= band <= band_count:
+            raise ValueError(f"Band {band} out of range (file has {band_count} bands)")
+
+    alpha = bool(job_config.get('alpha', preserve_transparency and has_mask))
+    percentiles = parse_percentiles(job_config.get('stretchPercentiles'), percentiles)
+    return RenderSpec(bands=bands, alpha=alpha, percentiles=percentiles)
+
+
+def read_strip(reader, spec: RenderSpec, out_shape: Tuple[int, int], row_start: int, row_stop: int,
+               data: np.ndarray, mask: Optional[np.ndarray] = None,
+               resampling: Resampling = Resampling.average):
+    """
+    قراءة الصفوف [row_start, row_stop) من المخرجات (بشكل out_shape) في data و mask
+    """
+    out_width = out_shape[1]
+    scale = reader.height / out_shape[0]
+    window = Window(0, row_start * scale, reader.width, (row_stop - row_start) * scale)
+    reader.read(list(spec.bands), out=data, window=window, resampling=resampling)
+    if mask is not None:
+        # dataset_mask ignores out= for nodata-based masks, so copy the returned strip
+        mask[:] = reader.dataset_mask(out_shape=(row_stop - row_start, out_width), window=window)
+
+
+def read_bands(reader, spec: RenderSpec, out_shape: Tuple[int, int],
+               strip_rows: int = DEFAULT_STRIP_ROWS,
+               resampling: Resampling = Resampling.average) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    قراءة النطاقات المطلوبة بدقة المخرجات على شكل شرائح
+
+    المصفوفات تأتي من buffer_pool وتبقى صالحة حتى القراءة التالية في نفس الـ thread.
+
+    Returns:
+        (data بشكل (bands, height, width) بنوع البيانات الأصلي, mask بشكل (height, width) أو None)
+    """
+    out_height, out_width = out_shape
+    data = buffer_pool.get((len(spec.bands), out_height, out_width), reader.dtypes[spec.bands[0] - 1], key='read')
+    mask = buffer_pool.get((out_height, out_width), np.uint8, key='read_mask') if spec.alpha else None
+
+    for row_start, row_stop in row_strips(out_height, strip_rows):
+        read_strip(reader, spec, out_shape, row_start, row_stop, data[:, row_start:row_stop],
+                   None if mask is None else mask[row_start:row_stop], resampling)
+
+    return data, mask
+
+
+def band_ranges(data: np.ndarray, mask: Optional[np.ndarray] = None,
+                nodata: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    min/max لكل نطاق على البكسلات الصالحة فقط (بدون NaN أو nodata أو mask = 0)
+
+    Returns:
+        (lows, highs) كمصفوفات float64 بطول عدد النطاقات
+    """
+    valid = np.ones(data.shape, dtype=bool)
+    if mask is not None:
+        valid &= (mask > 0)[np.newaxis]
+    if np.issubdtype(data.dtype, np.floating):
+        valid &= ~np.isnan(data)
+    if nodata is not None:
+        valid &= data != nodata
+
+    limits = np.finfo(data.dtype) if np.issubdtype(data.dtype, np.floating) else np.iinfo(data.dtype)
+    lows = np.min(data, axis=(1, 2), where=valid, initial=limits.max).astype(np.float64)
+    highs = np.max(data, axis=(1, 2), where=valid, initial=limits.min).astype(np.float64)
+
+    # Bands without any valid pixel render as black
+    empty = ~valid.any(axis=(1, 2))
+    lows[empty] = 0.0
+    highs[empty] = 0.0
+    return lows, highs
+
+
+def render_image(reader, spec: RenderSpec, out_shape: Tuple[int, int],
+                 stretch: Optional[Stretch] = None, nodata: Optional[float] = None,
+                 engine: Optional[BlockEngine] = None) -> Image.Image:
+    """
+    عرض dataset (أو overview) كصورة PIL بحجم out_shape (height, width)
+
+    stretch: حدود التمديد المحسوبة من histogram الملف؛ إذا لم تُحدد
+    يُستخدم min/max للبيانات المقروءة نفسها
+    engine: BlockEngine لنفس الـ reader؛ مع stretch محدد تُقرأ كل شريحة وتُطبّع
+    في thread مستقل مباشرة في صفوفها من الصورة النهائية
+    """
+    if stretch is None:
+        data, mask = read_bands(reader, spec, out_shape)
+        lows, highs = band_ranges(data, mask, nodata)
+        stretch = Stretch(lows=lows, highs=highs, percentiles=(0.0, 100.0))
+        pixels = stretch.apply(data, alpha=mask)
+    else:
+        pixels = render_strips(reader, spec, out_shape, stretch, engine)
+
+    if pixels.shape[2] == 1:
+        pixels = pixels[:, :, 0]
+
+    return Image.fromarray(pixels, spec.mode)
+
+
+def render_strips(reader, spec: RenderSpec, out_shape: Tuple[int, int], stretch: Stretch,
+                  engine: Optional[BlockEngine] = None) -> np.ndarray:
+    """
+    قراءة وتطبيع الشرائح بشكل مستقل (بالتوازي عبر engine) في مصفوفة المخرجات
+
+    كل thread يستخدم buffers بحجم شريحة واحدة من الـ pool الخاص به، والشرائح لا تتداخل
+    في المخرجات فلا حاجة لأي قفل.
+    """
+    out_height, out_width = out_shape
+    dtype = reader.dtypes[spec.bands[0] - 1]
+    pixels = np.empty((out_height, out_width, len(spec.bands) + (1 if spec.alpha else 0)), dtype=np.uint8)
+    workers = engine.workers if engine is not None else 1
+    strip_rows = strip_rows_for(out_height, workers, max_rows=DEFAULT_STRIP_ROWS)
+
+    def render_strip(handle, rows: Tuple[int, int]):
+        row_start, row_stop = rows
+        strip_shape = (row_stop - row_start, out_width)
+        data = buffer_pool.get((len(spec.bands),) + strip_shape, dtype, key='read')
+        mask = buffer_pool.get(strip_shape, np.uint8, key='read_mask') if spec.alpha else None
+        read_strip(handle, spec, out_shape, row_start, row_stop, data, mask)
+        stretch.apply(data, alpha=mask, out=pixels[row_start:row_stop])
+
+    strips = row_strips(out_height, strip_rows)
+    if engine is None:
+        for rows in strips:
+            render_strip(reader, rows)
+    else:
+        engine.map(render_strip, strips)
+    return pixels
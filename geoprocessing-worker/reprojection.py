@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Chunked Reprojection
+====================
+
+إعادة إسقاط الملف إلى نظام الإحداثيات المطلوب (OUTPUT_CRS) قبل إنشاء المعاينة،
+حتى تتطابق الصور مع الخريطة (Leaflet) بدلًا من عرض بيانات UTM في موضع خاطئ.
+
+- الكتابة على شكل chunks (نوافذ من المخرجات) فلا يتجاوز استهلاك الذاكرة chunk واحد
+- الـ warp داخل كل chunk متعدد الـ threads عبر GDAL (NUM_THREADS)
+- المناطق خارج الملف الأصلي تُكتب في mask داخلي فتبقى شفافة في المعاينة
+"""
+
+import math
+import os
+import time
+from typing import Dict, Any, Iterator, Optional
+
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.warp import reproject, calculate_default_transform
+from rasterio.windows import Window, transform as window_transform
+
+from kernels import buffer_pool
+
+import logging
+logger = logging.getLogger('reprojection')
+
+DEFAULT_CHUNK_SIZE = 1024
+NATIVE_CRS_VALUES = ('', 'native', 'none')
+
+
+def target_crs(crs_value: Optional[str]) -> Optional[CRS]:
+    """CRS المطلوب من الإعدادات (None أو 'native' يعني الإبقاء على نظام الملف)"""
+    if crs_value is None or str(crs_value).strip().lower() in NATIVE_CRS_VALUES:
+        return None
+    return CRS.from_user_input(crs_value)
+
+
+def needs_reprojection(source_crs: Optional[CRS], dst_crs: Optional[CRS]) -> bool:
+    """هل يختلف نظام الملف عن النظام المطلوب (الملفات بدون CRS لا يمكن إسقاطها)"""
+    return source_crs is not None and dst_crs is not None and source_crs != dst_crs
+
+
+def chunk_windows(width: int, height: int, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Window]:
+    """نوافذ المخرجات بحجم chunk_size x chunk_size"""
+    for row_start in range(0, height, chunk_size):
+        for col_start in range(0, width, chunk_size):
+            yield Window(col_start, row_start, min(chunk_size, width - col_start), min(chunk_size, height - row_start))
+
+
+def warp_to_crs(dataset, output_path: str, dst_crs, workers: int = 1, max_size: Optional[int] = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE, resampling: str = 'bilinear',
+                warp_mem_limit: int = 64) -> Dict[str, Any]:
+    """
+    إعادة إسقاط جميع النطاقات إلى dst_crs في GeoTIFF (tiled) chunk بعد chunk
+
+    Args:
+        dataset: dataset مفتوح بنظام إحداثيات معروف
+        output_path: مسار الملف الناتج
+        workers: عدد threads الـ warp لكل chunk
+        max_size: حد أقصى لأبعاد المخرجات (مثل حجم المعاينة) لتجنب warp بدقة لن تُستخدم
+        warp_mem_limit: ذاكرة GDAL warper لكل chunk (MB)
+
+    Returns:
+        تقرير بالأبعاد وعدد الـ chunks وزمن الـ warp
+    """
+    dst_crs = CRS.from_user_input(dst_crs)
+    transform, width, height = calculate_default_transform(
+        dataset.crs, dst_crs, dataset.width, dataset.height, *dataset.bounds
+    )
+
+    # Warping straight to the output resolution avoids resampling twice
+    if max_size and max(width, height) > max_size:
+        scale = max(width, height) / max_size
+        width, height = max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale))
+        transform = transform * Affine.scale(scale)
+
+    bands = list(range(1, dataset.count + 1))
+    dtype = dataset.dtypes[0]
+    block_size = 256 if min(width, height) < 512 else 512
+    profile = {
+        'driver': 'GTiff',
+        'width': width,
+        'height': height,
+        'count': dataset.count,
+        'dtype': dtype,
+        'crs': dst_crs,
+        'transform': transform,
+        'nodata': dataset.nodata,
+        'tiled': True,
+        'blockxsize': block_size,
+        'blockysize': block_size,
+    }
+
+    chunks = 0
+    empty_chunks = 0
+    start = time.perf_counter()
+    with rasterio.Env(GDAL_TIFF_INTERNAL_MASK=True):
+        with rasterio.open(output_path, 'w', **profile) as output:
+            for window in chunk_windows(width, height, chunk_size):
+                chunks += 1
+                # Selected bands + alpha band written by the warper (0 = no source data)
+                destination = buffer_pool.get((len(bands) + 1, window.height, window.width), dtype, key='warp')
+                destination.fill(0 if dataset.nodata is None else dataset.nodata)
+                destination[-1] = 0
+                reproject(
+                    source=rasterio.band(dataset, bands),
+                    destination=destination,
+                    src_nodata=dataset.nodata,
+                    dst_nodata=dataset.nodata,
+                    dst_transform=window_transform(window, transform),
+                    dst_crs=dst_crs,
+                    dst_alpha=len(bands) + 1,
+                    resampling=Resampling[resampling],
+                    num_threads=workers,
+                    warp_mem_limit=warp_mem_limit,
+                )
+
+                valid = destination[-1] > 0
+                if not valid.any():
+                    # Unwritten blocks read back as nodata with an empty mask
+                    empty_chunks += 1
+                    continue
+
+                output.write(destination[:-1], window=window)
+                output.write_mask(valid, window=window)
+
+    warp_seconds = time.perf_counter() - start
+    logger.info(
+        f"Reprojected {dataset.crs} -> {dst_crs}: {width}x{height} in {chunks} chunks "
+        f"({empty_chunks} empty) in {warp_seconds:.2f}s"
+    )
+
+    return {
+        'source_crs': str(dataset.crs),
+        'target_crs': str(dst_crs),
+        'width': width,
+        'height': height,
+        'transform': list(transform)[:6],
+        'chunk_size': chunk_size,
+        'chunks': chunks,
+        'chunks_empty': empty_chunks,
+        'threads': max(1, workers),
+        'resampling': resampling,
+        'warp_seconds': round(warp_seconds, 4),
+        'size_bytes': os.path.getsize(output_path)
+    }
+
+
+def image_transform(transform: Affine, width: int, height: int, out_shape) -> Affine:
+    """transform صورة مخرجات بحجم out_shape (height, width) تغطي نفس حدود الـ raster"""
+    out_height, out_width = out_shape
+    return transform * Affine.scale(width / out_width, height / out_height)
+
+
+def write_world_file(transform: Affine, output_path: str):
+    """كتابة World File (.pgw / .jgw / .wld) لـ transform الصورة"""
+    with open(output_path, 'w') as f:
+        f.write(f"{transform.a}\n")  # Pixel size in X
+        f.write(f"{transform.b}\n")  # Rotation
+        f.write(f"{transform.d}\n")  # Rotation
+        f.write(f"{transform.e}\n")  # Pixel size in Y (usually negative)
+        # World files reference the centre of the top-left pixel
+        f.write(f"{transform.c + transform.a / 2 + transform.b / 2}\n")
+        f.write(f"{transform.f + transform.d / 2 + transform.e / 2}\n")
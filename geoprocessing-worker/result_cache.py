@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Result Cache
+============
+
+cache محلي على القرص لنتائج المعالجة، مفتاحه محتوى الطلب وليس اسم الـ job:
+
+    key = SHA-256(hash كل ملف إدخال + إعدادات الـ job + إعدادات المعالجة + إصدار الـ worker)
+
+عند إعادة إرسال نفس الملف بنفس الإعدادات تُرفع المخرجات المخزنة مباشرة دون معالجة.
+اسم الملف ليس جزءًا من المفتاح (مفاتيح التخزين تحمل UUID لكل رفع)؛ المخرجات المشتقة
+من اسم الملف تُعاد تسميتها باسم الإدخال الحالي عند الـ hit.
+الـ hit يُربط (hardlink، أو نسخ عبر أنظمة ملفات مختلفة) إلى مجلد مخرجات الـ job،
+فلا تحذف إزالة LRU متزامنة الملفات أثناء رفعها.
+الإزالة LRU بحد أقصى لحجم الـ cache، وعدّادات hit / miss متاحة عبر stats().
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Sequence
+
+import logging
+logger = logging.getLogger('result-cache')
+
+MANIFEST_NAME = 'manifest.json'
+PATH_PLACEHOLDER = '{cache_entry}'
+
+
+def cache_key(inputs: Sequence[str], job_config: Dict[str, Any],
+              processing_config: Dict[str, Any], version: str) -> str:
+    """
+    مفتاح الـ cache
+
+    Args:
+        inputs: SHA-256 لمحتوى كل ملف إدخال
+        job_config: inputPayload مع نوع المهمة
+        processing_config: إعدادات الـ processor
+        version: إصدار كود الـ worker
+    """
+    document = {
+        'inputs': list(inputs),
+        'job': job_config,
+        'processing': processing_config,
+        'version': version,
+    }
+    encoded = json.dumps(document, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _rename_stem(path: str, old_stem: Optional[str], new_stem: Optional[str]) -> str:
+    """إعادة تسمية ملف اسمه مشتق من اسم الإدخال (stem.png، stem_metadata.json، ...)"""
+    directory, file_name = os.path.split(path)
+    if old_stem and new_stem and old_stem != new_stem and file_name.startswith(old_stem):
+        return os.path.join(directory, new_stem + file_name[len(old_stem):])
+    return path
+
+
+def _rewrite_paths(value: Any, old_prefix: str, new_prefix: str,
+                   old_stem: Optional[str] = None, new_stem: Optional[str] = None) -> Any:
+    """استبدال بادئة المسارات (واسم الإدخال في أسماء الملفات) في نتيجة متداخلة (dict / list / str)"""
+    if isinstance(value, dict):
+        return {key: _rewrite_paths(item, old_prefix, new_prefix, old_stem, new_stem) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rewrite_paths(item, old_prefix, new_prefix, old_stem, new_stem) for item in value]
+    if isinstance(value, str) and value.startswith(old_prefix):
+        return _rename_stem(new_prefix + value[len(old_prefix):], old_stem, new_stem)
+    return value
+
+
+def _link_tree(source_dir: str, target_dir: str, skip: Sequence[str] = (),
+               old_stem: Optional[str] = None, new_stem: Optional[str] = None):
+    """نسخ شجرة ملفات بـ hardlinks (أو نسخ إذا تعذر الربط)، مع إعادة تسمية old_stem إلى new_stem"""
+    for root, _, file_names in os.walk(source_dir):
+        relative_root = os.path.relpath(root, source_dir)
+        target_root = os.path.normpath(os.path.join(target_dir, relative_root))
+        os.makedirs(target_root, exist_ok=True)
+        for file_name in file_names:
+            if relative_root == '.' and file_name in skip:
+                continue
+            source_path = os.path.join(root, file_name)
+            target_path = _rename_stem(os.path.join(target_root, file_name), old_stem, new_stem)
+            try:
+                os.link(source_path, target_path)
+            except OSError:
+                # Different filesystem, or links not supported
+                shutil.copy2(source_path, target_path)
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, file_name))
+        for root, _, file_names in os.walk(path)
+        for file_name in file_names
+    )
+
+
+class ResultCache:
+    """
+    cache بنظام LRU: مجلد لكل مفتاح يحتوي المخرجات و manifest.json
+
+    وقت آخر استخدام هو mtime الـ manifest، فيُستعاد ترتيب LRU بعد إعادة تشغيل الـ worker.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, enabled: bool = True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()  # key -> size in bytes, oldest first
+
+        if self.enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_index()
+            logger.info(
+                f"Result cache at {cache_dir}: {len(self._entries)} entries, "
+                f"{self.size_bytes / (1024 * 1024):.1f}/{max_bytes / (1024 * 1024):.0f} MB"
+            )
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _load_index(self):
+        """بناء فهرس LRU من المجلدات الموجودة (الأقدم استخدامًا أولًا)"""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            manifest_path = os.path.join(self._entry_dir(key), MANIFEST_NAME)
+            if not os.path.isfile(manifest_path):
+                # Leftover of an interrupted store
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                continue
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    size = json.load(f)['size_bytes']
+            except Exception as e:
+                logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                continue
+            entries.append((os.path.getmtime(manifest_path), key, size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(self._entries.values())
+
+    def get(self, key: str, target_dir: str, stem: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        البحث عن نتيجة مخزنة وربط ملفاتها داخل target_dir
+
+        الربط يتم تحت القفل، فالملفات في target_dir تبقى صالحة حتى لو أُزيل المدخل بعدها.
+        حذف target_dir بعد الرفع مسؤولية المستدعي.
+        stem: اسم الإدخال الحالي (بدون امتداد)؛ المخرجات المسماة باسم الإدخال المخزن تُعاد تسميتها به
+
+        Returns:
+            {'result', 'files', 'directory'} بمسارات داخل target_dir، أو None
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            entry_dir = self._entry_dir(key)
+            manifest_path = os.path.join(entry_dir, MANIFEST_NAME)
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except Exception as e:
+                logger.warning(f"Cache entry {key} is unreadable, dropping it: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            target_dir = os.path.abspath(target_dir)
+            try:
+                _link_tree(entry_dir, target_dir, (MANIFEST_NAME,), manifest.get('stem'), stem)
+            except OSError as e:
+                logger.warning(f"Cache entry {key} could not be copied out, dropping it: {e}")
+                shutil.rmtree(target_dir, ignore_errors=True)
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            os.utime(manifest_path)  # Most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        prefix = target_dir + os.sep
+        return {
+            'result': _rewrite_paths(manifest['result'], PATH_PLACEHOLDER + '/', prefix, manifest.get('stem'), stem),
+            'files': [
+                _rename_stem(os.path.join(target_dir, relative_path), manifest.get('stem'), stem)
+                for relative_path in manifest['files']
+            ],
+            'directory': target_dir
+        }
+
+    def put(self, key: str, source_dir: str, result: Dict[str, Any], files: List[str],
+            stem: Optional[str] = None) -> bool:
+        """
+        تخزين مخرجات job بنقل source_dir إلى الـ cache (دون نسخ)
+
+        files: مسارات المخرجات داخل source_dir (تُحفظ نسبية)
+        stem: اسم الإدخال (بدون امتداد) الذي اشتُقت منه أسماء المخرجات
+
+        Returns:
+            True إذا خُزنت النتيجة؛ المجلد لا يُنقل إذا تجاوز حجمه حد الـ cache
+        """
+        if not self.enabled:
+            return False
+
+        size = _directory_size(source_dir)
+        if size > self.max_bytes:
+            logger.info(f"Result too large to cache: {size} bytes > {self.max_bytes}")
+            return False
+
+        source_dir = os.path.abspath(source_dir)
+        manifest = {
+            'key': key,
+            'created_at': time.time(),
+            'size_bytes': size,
+            'stem': stem,
+            'files': [os.path.relpath(os.path.abspath(path), source_dir) for path in files],
+            'result': _rewrite_paths(result, source_dir + os.sep, PATH_PLACEHOLDER + '/'),
+        }
+
+        # Move next to the cache first, then publish with an atomic rename
+        staging_dir = os.path.join(self.cache_dir, f".staging-{uuid.uuid4().hex}")
+        shutil.move(source_dir, staging_dir)
+        with open(os.path.join(staging_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, default=str)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            os.replace(staging_dir, self._entry_dir(key))
+            self._entries[key] = size
+            self._evict()
+
+        logger.info(f"Cached result {key[:12]} ({size} bytes)")
+        return True
+
+    def _evict(self):
+        """إزالة الأقدم استخدامًا حتى يصبح الحجم ضمن الحد"""
+        while self._entries and self.size_bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+            logger.info(f"Evicted cached result {key[:12]}")
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """عدّادات الـ cache منذ تشغيل الـ worker"""
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'size_bytes': self.size_bytes,
+            'max_bytes': self.max_bytes
+        }
@@ -88,13 +88,18 @@ except Exception as e:
 # Set environment variables with defaults
 export WORKER_NAME="${WORKER_NAME:-geoprocessing-worker-$(hostname)}"
 export LOG_LEVEL="${LOG_LEVEL:-INFO}"
-export POLL_INTERVAL="${POLL_INTERVAL:-5}"
+# POLL_INTERVAL (deprecated fixed interval) is kept as the idle polling cap when set
+if [ -n "$POLL_INTERVAL" ]; then
+    echo "⚠️  POLL_INTERVAL is deprecated: it is the idle polling cap unless POLL_MAX_INTERVAL is set"
+fi
+export POLL_MAX_INTERVAL="${POLL_MAX_INTERVAL:-${POLL_INTERVAL:-30}}"
+export POLL_MIN_INTERVAL="${POLL_MIN_INTERVAL:-$(awk -v max="$POLL_MAX_INTERVAL" 'BEGIN { print (max < 0.5 ? max : 0.5) }')}"
 export HEARTBEAT_INTERVAL="${HEARTBEAT_INTERVAL:-30}"
 
 echo "🚀 Starting worker with configuration:"
 echo "   Worker Name: $WORKER_NAME"
 echo "   Log Level: $LOG_LEVEL"
-echo "   Poll Interval: ${POLL_INTERVAL}s"
+echo "   Poll Interval: ${POLL_MIN_INTERVAL}s-${POLL_MAX_INTERVAL}s (adaptive)"
 echo "   Heartbeat Interval: ${HEARTBEAT_INTERVAL}s"
 echo "   API Base URL: ${API_BASE_URL:-http://localhost:5000}"
 
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Percentile Contrast Stretch
+===========================
+
+تمديد التباين (contrast stretch) بالاعتماد على percentiles بدلًا من min/max،
+بحيث لا يؤدي بكسل شاذ واحد إلى صورة سوداء بالكامل.
+
+- histogram لكل نطاق يُبنى في مرور streaming واحد على الـ blocks
+  دون تحميل الملف كاملًا في الذاكرة
+- حدود القطع (مثل 2% / 98%) تُشتق من الـ histogram
+- للبيانات الصحيحة (8/16-bit) يُطبق التمديد عبر lookup table مسبقة الحساب
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Iterator, Sequence, Tuple
+
+import numpy as np
+from rasterio.windows import Window
+
+from block_engine import BlockEngine
+from kernels import is_lut_dtype, build_lut, normalize_bands
+
+import logging
+logger = logging.getLogger('contrast-stretch')
+
+DEFAULT_PERCENTILES = (2.0, 98.0)
+FLOAT_BINS = 1 << 16
+SIGN_BIT = np.uint32(0x80000000)
+STREAM_WINDOW_PIXELS = 1 << 20
+
+
+class StreamingHistogram:
+    """
+    histogram قابل للتحديث block بـ block ولدمج النتائج الجزئية
+
+    - بيانات 8/16-bit: bin لكل قيمة ممكنة (percentiles دقيقة)
+    - باقي الأنواع: 65536 bin بحسب أعلى 16 bit من تمثيل float32 المرتب
+      (دقة نسبية ~0.4% على أي مقياس، فلا تؤثر القيم الشاذة على دقة باقي النطاق)
+    """
+
+    def __init__(self, dtype):
+        dtype = np.dtype(dtype)
+        self.dtype = dtype
+        self.exact = is_lut_dtype(dtype)
+        self.offset = int(np.iinfo(dtype).min) if self.exact else 0
+        self.bins = 1 << (8 * dtype.itemsize) if self.exact else FLOAT_BINS
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.total = 0
+        self.min_value: Optional[float] = None
+        self.max_value: Optional[float] = None
+
+    def update(self, values: np.ndarray):
+        """إضافة قيم صالحة (مصفوفة أحادية البعد، بدون NaN) إلى الـ histogram"""
+        if values.size == 0:
+            return
+
+        value_min = float(values.min())
+        value_max = float(values.max())
+        self.min_value = value_min if self.min_value is None else min(self.min_value, value_min)
+        self.max_value = value_max if self.max_value is None else max(self.max_value, value_max)
+        self.total += int(values.size)
+
+        if self.exact:
+            indexes = values.astype(np.int64) - self.offset if self.offset else values
+        else:
+            indexes = _float_keys(values)
+        self.counts += np.bincount(indexes, minlength=self.bins)
+
+    def merge(self, other: 'StreamingHistogram'):
+        """دمج histogram جزئي (من block أو process آخر) لنفس نوع البيانات"""
+        if other.total == 0:
+            return
+        self.counts += other.counts
+        self.total += other.total
+        self.min_value = other.min_value if self.min_value is None else min(self.min_value, other.min_value)
+        self.max_value = other.max_value if self.max_value is None else max(self.max_value, other.max_value)
+
+    def bin_edges(self, index: int) -> Tuple[float, float]:
+        """حدود القيم [low, high) للـ bin"""
+        if self.exact:
+            return float(self.offset + index), float(self.offset + index + 1)
+        low, high = _float_key_values([index, index + 1])
+        return float(low), float(high)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """قيمة الـ percentile (0-100) من الـ histogram، أو None إذا لم تكن هناك بيانات صالحة"""
+        if self.total == 0:
+            return None
+        if percent <= 0:
+            return self.min_value
+        if percent >= 100:
+            return self.max_value
+
+        target = percent / 100.0 * self.total
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, target, side='left'))
+        low, high = self.bin_edges(index)
+
+        if self.exact:
+            value = low
+        else:
+            # Linear interpolation inside the bin, bounded by the observed range
+            low = max(low, self.min_value)
+            high = min(high, self.max_value)
+            before = float(cumulative[index - 1]) if index > 0 else 0.0
+            value = low + (target - before) / max(float(self.counts[index]), 1.0) * (high - low)
+
+        return float(min(max(value, self.min_value), self.max_value))
+
+    def summary(self, bins: int = 64) -> Dict[str, Any]:
+        """histogram مختصر بـ bins متساوية بين min و max (للـ payload)"""
+        if self.total == 0:
+            return {'bins': 0, 'range': None, 'counts': []}
+
+        span = self.max_value - self.min_value
+        nonzero = np.nonzero(self.counts)[0]
+        if self.exact:
+            centers = self.offset + nonzero.astype(np.float64)
+        else:
+            lows = np.maximum(_float_key_values(nonzero), self.min_value)
+            highs = np.minimum(_float_key_values(nonzero + 1), self.max_value)
+            centers = (lows + highs) / 2.0
+        if span > 0:
+            indexes = np.clip(((centers - self.min_value) / span * bins).astype(np.int64), 0, bins - 1)
+        else:
+            indexes = np.zeros(len(nonzero), dtype=np.int64)
+        counts = np.bincount(indexes, weights=self.counts[nonzero], minlength=bins)
+
+        return {
+            'bins': bins,
+            'range': [self.min_value, self.max_value],
+            'counts': [int(count) for count in counts]
+        }
+
+
+def _float_keys(values: np.ndarray) -> np.ndarray:
+    """
+    مفتاح bin لكل قيمة: أعلى 16 bit من تمثيل float32 بعد تحويله إلى ترتيب تصاعدي
+    (قلب جميع البتات للسالب وإضافة bit الإشارة للموجب)
+    """
+    bits = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    ordered = np.where(bits & SIGN_BIT, ~bits, bits | SIGN_BIT)
+    return (ordered >> 16).astype(np.intp)
+
+
+def _float_key_values(keys: np.ndarray) -> np.ndarray:
+    """أصغر قيمة float32 في كل bin (عكس _float_keys)"""
+    keys = np.asarray(keys, dtype=np.int64)
+    ordered = (np.minimum(keys, FLOAT_BINS - 1).astype(np.uint32) << 16)
+    bits = np.where(ordered & SIGN_BIT, ordered & ~SIGN_BIT, ~ordered).astype(np.uint32)
+    values = bits.view(np.float32).astype(np.float64)
+    return np.where(keys >= FLOAT_BINS, np.inf, values)
+
+
+def stream_windows(dataset, target_pixels: int = STREAM_WINDOW_PIXELS) -> Iterator[Window]:
+    """
+    نوافذ القراءة المتسلسلة: الـ blocks الأصلية للملفات الـ tiled،
+    أو مجموعات من الـ strips المتتالية للملفات الـ striped
+    """
+    block_height, block_width = dataset.block_shapes[0]
+    if block_width < dataset.width:
+        for _, window in dataset.block_windows(1):
+            yield window
+        return
+
+    rows = max(block_height, (target_pixels // max(dataset.width, 1)) // block_height * block_height)
+    for row_start in range(0, dataset.height, rows):
+        yield Window(0, row_start, dataset.width, min(rows, dataset.height - row_start))
+
+
+def valid_pixels(data: np.ndarray, mask_valid: np.ndarray, nodata: Optional[float] = None) -> np.ndarray:
+    """البكسلات الصالحة لنطاق واحد: داخل الـ mask وليست nodata أو NaN"""
+    valid = mask_valid
+    if np.issubdtype(data.dtype, np.floating):
+        valid = valid & ~np.isnan(data)
+    if nodata is not None:
+        valid = valid & (data != nodata)
+    return valid
+
+
+def compute_histograms(dataset, bands: Sequence[int], nodata: Optional[float] = None,
+                       engine: Optional[BlockEngine] = None) -> Dict[int, StreamingHistogram]:
+    """
+    histogram لكل نطاق في مرور streaming واحد على الملف
+
+    تُستبعد البكسلات خارج الـ mask وقيم nodata وNaN. الذاكرة المستخدمة ثابتة
+    (نافذة واحدة لكل thread + عدّادات الـ histogram) مهما كان حجم الملف.
+    engine: BlockEngine لتوزيع النوافذ على عدة threads (افتراضيًا متسلسل على dataset)
+    """
+    bands = list(bands)
+    dtypes = dataset.dtypes
+
+    def new_histograms() -> Dict[int, StreamingHistogram]:
+        return {band: StreamingHistogram(dtypes[band - 1]) for band in bands}
+
+    def merge_histograms(target: Dict[int, StreamingHistogram], other: Dict[int, StreamingHistogram]):
+        for band in bands:
+            target[band].merge(other[band])
+
+    def kernel(handle, window: Window, histograms: Dict[int, StreamingHistogram]):
+        data = handle.read(bands, window=window)
+        mask_valid = handle.dataset_mask(window=window) > 0
+        for index, band in enumerate(bands):
+            histograms[band].update(data[index][valid_pixels(data[index], mask_valid, nodata)])
+
+    engine = engine or BlockEngine(dataset.name, dataset=dataset)
+    return engine.reduce(kernel, list(stream_windows(dataset)), new_histograms, merge_histograms)
+
+
+@dataclass
+class Stretch:
+    """حدود القطع لكل نطاق، مع lookup tables للبيانات الصحيحة 8/16-bit"""
+    lows: np.ndarray
+    highs: np.ndarray
+    percentiles: Tuple[float, float] = DEFAULT_PERCENTILES
+    luts: Optional[np.ndarray] = None
+
+    @classmethod
+    def build(cls, lows: Sequence[float], highs: Sequence[float], dtype,
+              percentiles: Tuple[float, float] = DEFAULT_PERCENTILES) -> 'Stretch':
+        """إنشاء stretch مع LUT (قيمة الـ pixel -> uint8) إذا كان نوع البيانات يسمح بذلك"""
+        lows = np.asarray(lows, dtype=np.float64)
+        highs = np.asarray(highs, dtype=np.float64)
+        luts = None
+        if is_lut_dtype(dtype):
+            luts = np.stack([build_lut(dtype, low, high) for low, high in zip(lows, highs)])
+        return cls(lows=lows, highs=highs, percentiles=tuple(percentiles), luts=luts)
+
+    @property
+    def cutoffs(self) -> List[List[float]]:
+        """حدود القطع [low, high] لكل نطاق (للـ payload)"""
+        return [[float(low), float(high)] for low, high in zip(self.lows, self.highs)]
+
+    def apply(self, data: np.ndarray, alpha: Optional[np.ndarray] = None,
+              out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        تطبيق التمديد على مصفوفة (bands, height, width)
+
+        out: مصفوفة المخرجات (مثل شريحة من الصورة النهائية)
+
+        Returns:
+            مصفوفة uint8 بشكل (height, width, bands[+1])
+        """
+        return normalize_bands(data, self.lows, self.highs, luts=self.luts, alpha=alpha, out=out)
+
+
+def stretch_from_histograms(histograms: Sequence[StreamingHistogram], dtype,
+                            percentiles: Tuple[float, float] = DEFAULT_PERCENTILES) -> Stretch:
+    """اشتقاق حدود القطع من histogram كل نطاق (النطاقات الفارغة تُعرض سوداء)"""
+    low_percent, high_percent = percentiles
+    lows, highs = [], []
+    for histogram in histograms:
+        low = histogram.percentile(low_percent)
+        high = histogram.percentile(high_percent)
+        lows.append(0.0 if low is None else low)
+        highs.append(0.0 if high is None else high)
+    return Stretch.build(lows, highs, dtype, percentiles)
+
+
+def parse_percentiles(value: Any, default: Tuple[float, float] = DEFAULT_PERCENTILES) -> Tuple[float, float]:
+    """
+    قراءة percentiles من inputPayload أو متغير بيئة: [2, 98] أو "2,98"
+    """
+    if value is None:
+        return default
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+
+    low, high = (float(part) for part in value)
+    if not 0 <= low < high <= 100:
+        raise ValueError(f"Invalid stretch percentiles: {low}, {high} (expected 0 <= low < high <= 100)")
+    return low, high
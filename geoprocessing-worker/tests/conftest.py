@@ -0,0 +1,8 @@
+"""
+إعداد pytest للـ worker: وحدات الـ worker تُستورد مباشرة (المجلد ليس package)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,218 @@
+"""
+اختبارات DownloadEngine مقابل خادم HTTP محلي يدعم Range ويقطع الاتصال عمدًا
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional
+
+import httpx
+import pytest
+
+from downloader import DownloadEngine
+
+MB = 1024 * 1024
+
+
+class RangeServer:
+    """
+    خادم محلي يخدم payload واحدًا
+
+    drops: عدد الردود التي تُقطع بعد drop_after بايت
+    ignore_range: الرد دائمًا بـ 200 والمحتوى كاملًا
+    shift_resume: إزاحة بداية Content-Range في ردود الاستئناف (محاكاة خادم/cache معطوب)
+    stall_after: إرسال هذا العدد من البايتات ثم التوقف حتى إغلاق الخادم
+    """
+
+    def __init__(self, payload: bytes, drop_after: int = 0, drops: int = 0,
+                 ignore_range: bool = False, shift_resume: int = 0, stall_after: Optional[int] = None):
+        self.payload = payload
+        self.drop_after = drop_after
+        self.drops_left = drops
+        self.ignore_range = ignore_range
+        self.shift_resume = shift_resume
+        self.stall_after = stall_after
+        self.stalled = threading.Event()
+        self.closing = threading.Event()
+        self.ranges = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/input.tif"
+
+    def close(self):
+        self.closing.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stand_in = self
+        payload = self.payload
+
+        class RangeHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                range_header = self.headers.get('Range')
+                first, last = 0, len(payload) - 1
+                match = re.match(r'bytes=(\d+)-(\d*)', range_header or '')
+                with stand_in.lock:
+                    stand_in.ranges.append(range_header)
+                if match and not stand_in.ignore_range:
+                    first = int(match.group(1))
+                    last = int(match.group(2)) if match.group(2) else last
+                    if first and not match.group(2):
+                        first = max(0, first - stand_in.shift_resume)
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {first}-{last}/{len(payload)}')
+                else:
+                    self.send_response(200)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(last - first + 1))
+                self.end_headers()
+
+                body = payload[first:last + 1]
+                with stand_in.lock:
+                    drop = len(body) > stand_in.drop_after and stand_in.drops_left > 0
+                    if drop:
+                        stand_in.drops_left -= 1
+                if stand_in.stall_after is not None:
+                    # Simulate a stuck transfer: some bytes, then nothing until the test ends
+                    self.wfile.write(body[:stand_in.stall_after])
+                    self.wfile.flush()
+                    stand_in.stalled.set()
+                    stand_in.closing.wait(30)
+                    self.close_connection = True
+                    return
+                if drop:
+                    # Simulate a flaky link: send part of the body, then cut the connection
+                    self.wfile.write(body[:stand_in.drop_after])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        return RangeHandler
+
+
+@pytest.fixture
+def payload() -> bytes:
+    return os.urandom(4 * MB + 321)
+
+
+@pytest.fixture
+def serve(payload):
+    servers = []
+
+    def make(**kwargs) -> RangeServer:
+        servers.append(RangeServer(payload, **kwargs))
+        return servers[-1]
+
+    yield make
+    for server in servers:
+        server.close()
+
+
+async def _download(server: RangeServer, local_path: str, **engine_kwargs):
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as client:
+        engine = DownloadEngine(client, chunk_size=64 * 1024, write_buffer=256 * 1024,
+                                backoff_seconds=0.01, **engine_kwargs)
+        return await engine.download(server.url, local_path)
+
+
+def _file_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.asyncio
+async def test_stream_resumes_after_dropped_connection(tmp_path, payload, serve):
+    drop_after = 3 * MB // 2
+    server = serve(drop_after=drop_after, drops=1)
+    local_path = str(tmp_path / 'input.tif')
+
+    result = await _download(server, local_path)
+
+    assert result['mode'] == 'stream'
+    assert result['attempts'] == 2
+    assert server.ranges == [None, f'bytes={drop_after}-']
+    assert result['resumed_bytes'] == drop_after
+    assert result['bytes'] == len(payload)
+    assert result['sha256'] == hashlib.sha256(payload).hexdigest()
+    assert _file_bytes(local_path) == payload
+    assert not os.path.exists(f"{local_path}.part")
+
+
+@pytest.mark.asyncio
+async def test_mismatched_content_range_restarts_download(tmp_path, payload, serve):
+    drop_after = 2 * MB
+    server = serve(drop_after=drop_after, drops=1, shift_resume=1000)
+    local_path = str(tmp_path / 'input.tif')
+
+    result = await _download(server, local_path)
+
+    # The misaligned 206 is discarded and the next attempt starts from byte 0
+    assert server.ranges == [None, f'bytes={drop_after}-', None]
+    assert result['attempts'] == 3
+    assert result['resumed_bytes'] == 0
+    assert result['sha256'] == hashlib.sha256(payload).hexdigest()
+    assert _file_bytes(local_path) == payload
+
+
+@pytest.mark.asyncio
+async def test_server_ignoring_range_restarts_download(tmp_path, payload, serve):
+    drop_after = MB
+    server = serve(drop_after=drop_after, drops=1, ignore_range=True)
+    local_path = str(tmp_path / 'input.tif')
+
+    result = await _download(server, local_path)
+
+    assert server.ranges == [None, f'bytes={drop_after}-']
+    assert result['attempts'] == 2
+    assert result['resumed_bytes'] == 0
+    assert result['bytes'] == len(payload)
+    assert result['sha256'] == hashlib.sha256(payload).hexdigest()
+    assert _file_bytes(local_path) == payload
+
+
+@pytest.mark.asyncio
+async def test_segmented_download_matches_payload(tmp_path, payload, serve):
+    server = serve(drop_after=MB // 2, drops=2)
+    local_path = str(tmp_path / 'input.tif')
+
+    result = await _download(server, local_path, segments=4, segment_threshold=MB)
+
+    assert result['mode'] == 'segmented'
+    assert result['segments'] == 4
+    assert result['attempts'] == 6
+    assert result['resumed_bytes'] == 2 * (MB // 2)
+    assert result['sha256'] == hashlib.sha256(payload).hexdigest()
+    assert _file_bytes(local_path) == payload
+
+
+@pytest.mark.asyncio
+async def test_cancelled_download_removes_partial_file(tmp_path, serve):
+    server = serve(stall_after=MB)
+    local_path = str(tmp_path / 'input.tif')
+
+    task = asyncio.create_task(_download(server, local_path))
+    await asyncio.to_thread(server.stalled.wait, 10)
+    while not os.path.exists(f"{local_path}.part"):
+        await asyncio.sleep(0.01)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert not os.path.exists(f"{local_path}.part")
+    assert not os.path.exists(local_path)
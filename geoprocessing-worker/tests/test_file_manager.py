@@ -0,0 +1,89 @@
+"""
+اختبارات تحميل ملفات الإدخال المتوازي في FileManager
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from file_manager import FileManager
+
+TIFF_HEADER = b'II*\x00'
+
+
+@pytest.fixture
+def input_server():
+    """خادم API محلي: ملفا إدخال بنفس fileName ومحتوى مختلف"""
+    objects = {
+        'first': TIFF_HEADER + os.urandom(256 * 1024),
+        'second': TIFF_HEADER + os.urandom(384 * 1024),
+    }
+    authorizations = {'api': set(), 'objects': set()}
+
+    class InputHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            authorizations['api' if self.path.startswith('/api/') else 'objects'].add(self.headers.get('Authorization'))
+            if self.path == '/api/geo-jobs/job-1/download/input':
+                base = f"http://127.0.0.1:{self.server.server_port}/objects/"
+                body = json.dumps({'data': {'files': [
+                    {'fileName': 'input.tif', 'fileKey': f"geo-jobs/job-1/input/{key}/input.tif",
+                     'downloadUrl': base + key}
+                    for key in objects
+                ]}}).encode('utf-8')
+            else:
+                body = objects[self.path[len('/objects/'):]]
+                time.sleep(0.05)  # Keep both downloads in flight together
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), InputHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", objects, authorizations
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.asyncio
+async def test_inputs_with_the_same_name_download_to_separate_paths(input_server):
+    api_base_url, objects, _ = input_server
+    file_manager = FileManager(api_base_url, 'test-token', download_concurrency=2, download_segments=1)
+    try:
+        file_infos = await file_manager.download_job_input_files('job-1')
+    finally:
+        await file_manager.close()
+
+    assert len(file_infos) == 2
+    assert len({file_info['local_path'] for file_info in file_infos}) == 2
+    for file_info, payload in zip(file_infos, objects.values()):
+        assert os.path.basename(file_info['local_path']) == 'input.tif'
+        with open(file_info['local_path'], 'rb') as f:
+            assert f.read() == payload
+
+    temp_dir = os.path.dirname(os.path.dirname(file_infos[0]['local_path']))
+    file_manager.cleanup_temp_files(file_infos)
+    assert not os.path.exists(temp_dir)
+
+
+@pytest.mark.asyncio
+async def test_signed_url_downloads_do_not_send_the_worker_token(input_server):
+    api_base_url, _, authorizations = input_server
+    file_manager = FileManager(api_base_url, 'test-token', download_segments=1)
+    try:
+        file_infos = await file_manager.download_job_input_files('job-1')
+    finally:
+        await file_manager.close()
+    file_manager.cleanup_temp_files(file_infos)
+
+    assert authorizations['api'] == {'Worker test-token'}
+    assert authorizations['objects'] == {None}
@@ -0,0 +1,65 @@
+"""
+اختبارات تنظيف ملفات الإدخال المؤقتة في JobPipeline
+"""
+
+import asyncio
+import os
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import JobPipeline
+
+
+class StubFileManager:
+    """قائمة ملفات حقيقية في مجلد مؤقت، وتحميل يترك ملفًا جزئيًا ثم يفشل أو يتوقف"""
+
+    download_concurrency = 2
+
+    def __init__(self, hang: bool = False):
+        self.hang = hang
+        self.temp_dir = None
+        self.started = asyncio.Event()
+
+    async def list_job_input_files(self, job_id):
+        self.temp_dir = tempfile.mkdtemp(prefix=f"geojob_{job_id}_input_")
+        return [{'fileName': 'a.tif'}, {'fileName': 'b.tif'}], self.temp_dir
+
+    async def download_input_file(self, file_info, temp_dir, index):
+        file_dir = os.path.join(temp_dir, f"{index+1}")
+        os.makedirs(file_dir)
+        with open(os.path.join(file_dir, f"{file_info['fileName']}.part"), 'wb') as f:
+            f.write(b'II*\x00partial')
+        self.started.set()
+        if self.hang:
+            await asyncio.Event().wait()
+        return None
+
+
+def _pipeline(file_manager):
+    return JobPipeline(file_manager, SimpleNamespace(cpu_cores=1, config={}), None, None,
+                       {'id': 'job-1', 'taskType': 'geotiff_processing'}, 'test')
+
+
+@pytest.mark.asyncio
+async def test_failed_downloads_remove_the_input_temp_dir(tmp_path):
+    file_manager = StubFileManager()
+
+    with pytest.raises(Exception, match="No input files downloaded"):
+        await _pipeline(file_manager).run(str(tmp_path))
+
+    assert not os.path.exists(file_manager.temp_dir)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_download_stage_removes_the_input_temp_dir(tmp_path):
+    file_manager = StubFileManager(hang=True)
+    task = asyncio.create_task(_pipeline(file_manager).run(str(tmp_path)))
+    await file_manager.started.wait()
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert not os.path.exists(file_manager.temp_dir)
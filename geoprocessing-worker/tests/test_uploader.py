@@ -0,0 +1,217 @@
+"""
+اختبارات UploadEngine مقابل خادم API + object storage محلي وهمي
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional
+
+import httpx
+import pytest
+
+from uploader import UploadEngine, UploadError
+
+MB = 1024 * 1024
+
+
+class FakeStorage:
+    """
+    خادم محلي يحاكي endpoints الرفع في Node API و signed PUT URLs
+
+    fail_puts: {object key: عدد طلبات PUT الأولى لهذا الـ key التي تُرد بـ 503}
+    """
+
+    def __init__(self, fail_puts: Optional[Dict[str, int]] = None, fail_complete: bool = False):
+        self.fail_puts = dict(fail_puts or {})
+        self.fail_complete = fail_complete
+        self.objects: Dict[str, bytes] = {}
+        self.puts = 0
+        self.failures = 0
+        self.aborted = []
+        self.put_authorizations = set()
+        self.api_authorizations = set()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        storage = self
+
+        class FakeStorageHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: Optional[Dict[str, Any]] = None):
+                data = json.dumps(body or {}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with storage.lock:
+                    storage.api_authorizations.add(self.headers.get('Authorization'))
+                base = f"{storage.base_url}/objects/"
+                if re.match(r'/api/internal/geo-jobs/[^/]+/upload-url$', self.path):
+                    key = payload['fileKey']
+                    if payload['parts'] == 1:
+                        return self._reply(200, {'data': {'uploadUrl': base + key, 'fileKey': key}})
+                    parts = [
+                        {'partNumber': number, 'fileKey': f"{key}.parts/{number:05d}",
+                         'uploadUrl': f"{base}{key}.parts/{number:05d}"}
+                        for number in range(1, payload['parts'] + 1)
+                    ]
+                    return self._reply(200, {'data': {'fileKey': key, 'parts': parts}})
+                if re.match(r'/api/internal/geo-jobs/[^/]+/upload-complete$', self.path):
+                    if storage.fail_complete:
+                        return self._reply(400)
+                    with storage.lock:
+                        storage.objects[payload['fileKey']] = b''.join(
+                            storage.objects.pop(part) for part in payload['parts']
+                        )
+                    return self._reply(200, {'data': {'fileKey': payload['fileKey']}})
+                if re.match(r'/api/internal/geo-jobs/[^/]+/upload-abort$', self.path):
+                    with storage.lock:
+                        storage.aborted.append(payload['fileKey'])
+                        for part in payload['parts']:
+                            storage.objects.pop(part, None)
+                    return self._reply(200, {'data': {'fileKey': payload['fileKey']}})
+                self._reply(404)
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                key = self.path[len('/objects/'):]
+                with storage.lock:
+                    storage.put_authorizations.add(self.headers.get('Authorization'))
+                    storage.puts += 1
+                    fail = storage.fail_puts.get(key, 0) > 0
+                    if fail:
+                        storage.fail_puts[key] -= 1
+                        storage.failures += 1
+                    else:
+                        storage.objects[key] = body
+                time.sleep(0.01)  # Simulated network latency
+                self._reply(503 if fail else 200)
+
+        return FakeStorageHandler
+
+
+def _write_file(tmp_path, name: str, size: int) -> str:
+    path = os.path.join(tmp_path, name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return _sha256(f.read())
+
+
+@pytest.fixture
+def make_storage():
+    servers = []
+
+    def make(**kwargs) -> FakeStorage:
+        servers.append(FakeStorage(**kwargs))
+        return servers[-1]
+
+    yield make
+    for server in servers:
+        server.close()
+
+
+async def _upload(storage: FakeStorage, path: str, **engine_kwargs) -> Dict[str, Any]:
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0), headers={'Authorization': 'Worker secret'}) as client, \
+            httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as storage_client:
+        engine = UploadEngine(client, storage.base_url, concurrency=4, part_size=MB,
+                              multipart_threshold=2 * MB, chunk_size=256 * 1024,
+                              backoff_seconds=0.01, storage_client=storage_client, **engine_kwargs)
+        return await engine.upload('job-1', path, f"geo-jobs/job-1/output/{os.path.basename(path)}",
+                                   'application/octet-stream')
+
+
+@pytest.mark.asyncio
+async def test_single_part_upload_retries_failed_put(tmp_path, make_storage):
+    storage = make_storage(fail_puts={'geo-jobs/job-1/output/preview.png': 1})
+    path = _write_file(tmp_path, 'preview.png', MB + 17)
+
+    result = await _upload(storage, path)
+
+    assert result['parts'] == 1
+    assert result['bytes'] == MB + 17
+    assert storage.puts == 2 and storage.failures == 1
+    assert _sha256(storage.objects[result['file_key']]) == _file_sha256(path)
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_composes_parts_in_order(tmp_path, make_storage):
+    storage = make_storage(fail_puts={
+        'geo-jobs/job-1/output/output.tif.parts/00002': 1,
+        'geo-jobs/job-1/output/output.tif.parts/00005': 2,
+    })
+    path = _write_file(tmp_path, 'output.tif', 5 * MB + 123)
+
+    result = await _upload(storage, path)
+
+    assert result['parts'] == 6
+    assert storage.puts == 9 and storage.failures == 3
+    assert list(storage.objects) == [result['file_key']]
+    assert _sha256(storage.objects[result['file_key']]) == _file_sha256(path)
+
+
+@pytest.mark.asyncio
+async def test_signed_url_puts_do_not_send_the_worker_token(tmp_path, make_storage):
+    storage = make_storage()
+    path = _write_file(tmp_path, 'output.tif', 3 * MB)
+
+    await _upload(storage, path)
+
+    assert storage.api_authorizations == {'Worker secret'}
+    assert storage.put_authorizations == {None}
+
+
+@pytest.mark.asyncio
+async def test_failed_multipart_upload_deletes_uploaded_parts(tmp_path, make_storage):
+    # Part 1 keeps failing past max_retries; the other parts succeed and must be removed
+    storage = make_storage(fail_puts={'geo-jobs/job-1/output/output.tif.parts/00001': 3})
+    path = _write_file(tmp_path, 'output.tif', 5 * MB)
+
+    with pytest.raises(UploadError):
+        await _upload(storage, path, max_retries=2)
+
+    assert storage.aborted == ['geo-jobs/job-1/output/output.tif']
+    assert storage.objects == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_compose_deletes_uploaded_parts(tmp_path, make_storage):
+    storage = make_storage(fail_complete=True)
+    path = _write_file(tmp_path, 'output.tif', 3 * MB)
+
+    with pytest.raises(UploadError):
+        await _upload(storage, path)
+
+    assert storage.aborted == ['geo-jobs/job-1/output/output.tif']
+    assert storage.objects == {}
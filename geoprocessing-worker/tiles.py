@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+XYZ Tile Pyramid Generator
+==========================
+
+إنشاء هرم tiles بنظام Web Mercator (z/x/y) من ملف GeoTIFF
+لعرضه في Leaflet بحيث تُحمّل الخريطة الأجزاء الظاهرة فقط.
+
+يتم توزيع الـ tiles على threads الـ BlockEngine (dataset handle لكل thread؛ GDAL warp
+وترميز PIL يحرران الـ GIL)، وتُتجاهل الـ tiles الفارغة كليًا.
+"""
+
+import os
+import math
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.warp import reproject, transform_bounds, calculate_default_transform
+
+from block_engine import BlockEngine
+from raster_context import RasterContext
+from stretch import Stretch, compute_histograms, stretch_from_histograms, is_lut_dtype
+from encoders import save_options, DEFAULT_PROFILE
+
+import logging
+logger = logging.getLogger('tile-generator')
+
+WEB_MERCATOR = CRS.from_epsg(3857)
+WGS84 = CRS.from_epsg(4326)
+ORIGIN_SHIFT = 20037508.342789244  # Half of the Web Mercator world width (meters)
+MAX_LATITUDE = 85.0511287798
+MAX_ZOOM = 22
+
+TILE_FORMATS = {
+    'png': ('PNG', 'png'),
+    'webp': ('WEBP', 'webp'),
+}
+
+
+def tile_bounds(x: int, y: int, zoom: int) -> Tuple[float, float, float, float]:
+    """حدود tile بإحداثيات Web Mercator: (left, bottom, right, top)"""
+    tile_span = 2 * ORIGIN_SHIFT / (2 ** zoom)
+    left = -ORIGIN_SHIFT + x * tile_span
+    top = ORIGIN_SHIFT - y * tile_span
+    return left, top - tile_span, left + tile_span, top
+
+
+def lnglat_to_tile(lng: float, lat: float, zoom: int) -> Tuple[int, int]:
+    """تحويل longitude/latitude إلى رقم tile في مستوى zoom"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    n = 2 ** zoom
+    x = int((lng + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bounds(bounds_wgs84: List[float], zoom: int) -> List[Tuple[int, int, int]]:
+    """جميع الـ tiles التي تغطي bounds بصيغة [west, south, east, north]"""
+    west, south, east, north = bounds_wgs84
+    x_min, y_min = lnglat_to_tile(west, north, zoom)
+    x_max, y_max = lnglat_to_tile(east, south, zoom)
+    return [(zoom, x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+
+def zoom_resolution(zoom: int, tile_size: int = 256) -> float:
+    """حجم بكسل الـ tile بالمتر (Web Mercator) في مستوى zoom"""
+    return 2 * ORIGIN_SHIFT / (tile_size * 2 ** zoom)
+
+
+def mercator_resolution(dataset) -> float:
+    """حجم بكسل الملف بعد إعادة إسقاطه إلى Web Mercator (بالمتر)"""
+    transform, _, _ = calculate_default_transform(
+        dataset.crs, WEB_MERCATOR, dataset.width, dataset.height, *dataset.bounds
+    )
+    return abs(transform.a)
+
+
+def native_max_zoom(dataset, tile_size: int = 256) -> int:
+    """
+    أعلى مستوى zoom لا تتجاوز فيه دقة الـ tiles دقة الملف الأصلية
+    (حجم بكسل الـ tile >= حجم بكسل الملف، فلا تُكبّر البيانات)
+    """
+    resolution = mercator_resolution(dataset)
+    if resolution <= 0:
+        return MAX_ZOOM
+    # Tolerance keeps an exact power-of-two match from dropping a level to float error
+    zoom = math.floor(math.log2(zoom_resolution(0, tile_size) / resolution) + 1e-9)
+    return max(0, min(MAX_ZOOM, zoom))
+
+
+def _render_tile(dataset, zoom: int, x: int, y: int, options: Dict[str, Any]) -> Optional[Image.Image]:
+    """إعادة إسقاط tile واحد وتحويله إلى صورة، أو None إذا كان فارغًا"""
+    tile_size = options['tile_size']
+    bands = options['bands']
+    left, bottom, right, top = tile_bounds(x, y, zoom)
+
+    # Selected bands + alpha band written by the warper (0 = no source data).
+    # 8/16-bit data stays in its native type so the stretch LUT applies directly.
+    dtype = dataset.dtypes[bands[0] - 1] if is_lut_dtype(dataset.dtypes[bands[0] - 1]) else np.float32
+    destination = np.zeros((len(bands) + 1, tile_size, tile_size), dtype=dtype)
+    reproject(
+        source=rasterio.band(dataset, bands),
+        destination=destination,
+        src_nodata=dataset.nodata,
+        dst_transform=from_bounds(left, bottom, right, top, tile_size, tile_size),
+        dst_crs=WEB_MERCATOR,
+        dst_alpha=len(bands) + 1,
+        resampling=Resampling[options['resampling']],
+    )
+
+    alpha = destination[-1]
+    if not alpha.any():
+        return None
+
+    alpha = np.minimum(alpha, 255).astype(np.uint8)
+    pixels = options['stretch'].apply(destination[:-1], alpha=alpha)
+    image = Image.fromarray(pixels, 'RGBA' if len(bands) == 3 else 'LA')
+    if options['format'] == 'webp' and image.mode == 'LA':
+        image = image.convert('RGBA')
+    return image
+
+
+def _render_tile_batch(dataset, tiles: List[Tuple[int, int, int]], options: Dict[str, Any]) -> Dict[str, Any]:
+    """معالجة مجموعة tiles داخل thread واحد (dataset هو handle الخاص بالـ thread)"""
+    pil_format, extension = TILE_FORMATS[options['format']]
+    encode_options = save_options(options['format'], options['encoding_profile'])
+    stats = {'written': 0, 'skipped_empty': 0, 'bytes': 0, 'encode_seconds': 0.0, 'per_zoom': {}}
+
+    for zoom, x, y in tiles:
+        zoom_stats = stats['per_zoom'].setdefault(str(zoom), {'written': 0, 'skipped_empty': 0})
+        image = _render_tile(dataset, zoom, x, y, options)
+        if image is None:
+            stats['skipped_empty'] += 1
+            zoom_stats['skipped_empty'] += 1
+            continue
+
+        tile_dir = os.path.join(options['output_dir'], str(zoom), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        tile_path = os.path.join(tile_dir, f"{y}.{extension}")
+        encode_start = time.perf_counter()
+        image.save(tile_path, pil_format, **encode_options)
+        stats['encode_seconds'] += time.perf_counter() - encode_start
+
+        stats['written'] += 1
+        stats['bytes'] += os.path.getsize(tile_path)
+        zoom_stats['written'] += 1
+
+    return stats
+
+
+def generate_tile_pyramid(input_path: str, output_dir: str, min_zoom: Optional[int] = None,
+                          max_zoom: Optional[int] = None, tile_format: str = 'png',
+                          tile_size: int = 256, workers: int = 1, max_tiles: int = 50000,
+                          resampling: str = 'bilinear', batch_size: int = 64,
+                          bands: Optional[List[int]] = None, stretch: Optional[Stretch] = None,
+                          encoding_profile: str = DEFAULT_PROFILE,
+                          engine: Optional[BlockEngine] = None,
+                          context: Optional[RasterContext] = None) -> Dict[str, Any]:
+    """
+    إنشاء هرم tiles (z/x/y) من ملف GeoTIFF
+
+    bands: النطاقات المستخدمة ([band] لـ grayscale أو [r, g, b])؛ افتراضيًا 1-3 للملفات متعددة النطاقات
+    stretch: حدود تمديد التباين المشتركة بين جميع الـ tiles؛ إذا لم تُحدد تُحسب
+    من histogram الملف (2% / 98%)
+    engine: BlockEngine مشترك للملف (مثل RasterContext.engine())؛ وإلا يُنشأ محرك بعدد workers
+    context: RasterContext للملف؛ كل مستوى zoom يُعاد إسقاطه من أصغر overview كافٍ لدقته
+    (عبر context.reader_for) بدلًا من الدقة الكاملة، ومحركه من context.engine
+
+    Returns:
+        ملخص يحتوي على نطاق الـ zoom وعدد الـ tiles المكتوبة والمتجاهلة وحدود WGS84
+    """
+    tile_format = tile_format.lower()
+    if tile_format not in TILE_FORMATS:
+        raise ValueError(f"Unsupported tile format: {tile_format}")
+
+    start_time = datetime.now()
+    owns_engine = engine is None and context is None
+    if context is not None:
+        engine = context.engine()
+    elif owns_engine:
+        engine = BlockEngine(input_path, workers)
+
+    try:
+        dataset = engine.dataset
+        if not dataset.crs:
+            raise Exception("Tile generation requires a coordinate reference system (CRS)")
+
+        bounds_wgs84 = list(transform_bounds(dataset.crs, WGS84, *dataset.bounds))
+        if max_zoom is None:
+            max_zoom = native_max_zoom(dataset, tile_size)
+        if min_zoom is None:
+            min_zoom = max(0, max_zoom - 6)
+        if bands is None:
+            bands = [1, 2, 3] if dataset.count >= 3 else [1]
+        bands = [int(band) for band in bands]
+        if len(bands) not in (1, 3) or not all(1 <= band <= dataset.count for band in bands):
+            raise ValueError(f"Invalid tile bands {bands} for a {dataset.count}-band file")
+        if stretch is None:
+            histograms = compute_histograms(dataset, bands, dataset.nodata, engine=engine)
+            stretch = stretch_from_histograms([histograms[band] for band in bands], dataset.dtypes[bands[0] - 1])
+
+        if not 0 <= min_zoom <= max_zoom <= MAX_ZOOM:
+            raise ValueError(f"Invalid zoom range: {min_zoom}-{max_zoom}")
+
+        tiles = []
+        for zoom in range(min_zoom, max_zoom + 1):
+            tiles.extend(tiles_for_bounds(bounds_wgs84, zoom))
+
+        if len(tiles) > max_tiles:
+            raise Exception(f"Tile pyramid too large: {len(tiles)} tiles > {max_tiles} (reduce maxZoom)")
+
+        # Source for each zoom: the smallest overview that still has the zoom's resolution,
+        # so low zooms do not resample the full-resolution raster for every tile
+        zoom_engines = {zoom: engine for zoom in range(min_zoom, max_zoom + 1)}
+        overview_factors = {zoom: 1 for zoom in zoom_engines}
+        if context is not None and context.overview_factors:
+            source_resolution = mercator_resolution(dataset)
+            for zoom in zoom_engines:
+                scale = source_resolution / zoom_resolution(zoom, tile_size)
+                reader = context.reader_for(math.ceil(context.width * scale), math.ceil(context.height * scale))
+                zoom_engines[zoom] = context.engine(reader)
+                overview_factors[zoom] = context.reader_factor(reader)
+
+        os.makedirs(output_dir, exist_ok=True)
+        options = {
+            'output_dir': output_dir,
+            'format': tile_format,
+            'tile_size': tile_size,
+            'resampling': resampling,
+            'bands': bands,
+            'stretch': stretch,
+            'encoding_profile': encoding_profile,
+        }
+
+        # Several batches per thread keep all workers busy until the end
+        workers = engine.workers
+        batch_size = max(1, min(batch_size, math.ceil(len(tiles) / (workers * 4))))
+        logger.info(
+            f"Generating {len(tiles)} candidate tiles (z{min_zoom}-z{max_zoom}) with {min(workers, len(tiles))} "
+            f"threads, overview factors {overview_factors}"
+        )
+
+        # One map per source (full resolution or overview level), each over its zooms' tiles
+        batch_results = []
+        for source_engine in dict.fromkeys(zoom_engines.values()):
+            source_tiles = [tile for tile in tiles if zoom_engines[tile[0]] is source_engine]
+            batches = [source_tiles[i:i + batch_size] for i in range(0, len(source_tiles), batch_size)]
+            batch_results.extend(source_engine.map(
+                lambda handle, batch: _render_tile_batch(handle, batch, options), batches
+            ))
+        workers = min(workers, math.ceil(len(tiles) / batch_size)) or 1
+    finally:
+        if owns_engine:
+            engine.close()
+
+    summary = {'written': 0, 'skipped_empty': 0, 'bytes': 0, 'encode_seconds': 0.0, 'per_zoom': {}}
+    for batch_stats in batch_results:
+        summary['written'] += batch_stats['written']
+        summary['skipped_empty'] += batch_stats['skipped_empty']
+        summary['bytes'] += batch_stats['bytes']
+        summary['encode_seconds'] += batch_stats['encode_seconds']
+        for zoom, counts in batch_stats['per_zoom'].items():
+            zoom_summary = summary['per_zoom'].setdefault(zoom, {'written': 0, 'skipped_empty': 0})
+            zoom_summary['written'] += counts['written']
+            zoom_summary['skipped_empty'] += counts['skipped_empty']
+    for zoom, factor in overview_factors.items():
+        summary['per_zoom'].setdefault(str(zoom), {'written': 0, 'skipped_empty': 0})['overview_factor'] = factor
+
+    extension = TILE_FORMATS[tile_format][1]
+    result = {
+        'tile_dir': output_dir,
+        'tile_url_template': f"{{z}}/{{x}}/{{y}}.{extension}",
+        'format': tile_format,
+        'tile_size': tile_size,
+        'min_zoom': min_zoom,
+        'max_zoom': max_zoom,
+        'bounds_wgs84': [float(v) for v in bounds_wgs84],
+        'bands': bands,
+        'stretch_percentiles': list(stretch.percentiles),
+        'stretch_cutoffs': stretch.cutoffs,
+        'tiles_candidate': len(tiles),
+        'tiles_written': summary['written'],
+        'tiles_skipped_empty': summary['skipped_empty'],
+        'total_bytes': summary['bytes'],
+        'encoding_profile': encoding_profile,
+        'encode_seconds': round(summary['encode_seconds'], 4),
+        'per_zoom': dict(sorted(summary['per_zoom'].items(), key=lambda item: int(item[0]))),
+        'workers': workers,
+        'processing_time_seconds': (datetime.now() - start_time).total_seconds()
+    }
+
+    logger.info(
+        f"Tiles generated: {result['tiles_written']} written, "
+        f"{result['tiles_skipped_empty']} empty skipped in {result['processing_time_seconds']:.2f}s"
+    )
+    return result
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Upload Engine
+=============
+
+رفع مخرجات الـ job إلى Object Storage عبر signed URLs:
+
+- البث من القرص مباشرة (chunks) دون تحميل الملف كاملًا في الذاكرة
+- رفع عدة ملفات بالتوازي بحد أقصى لعدد الطلبات المتزامنة
+- الملفات الكبيرة تُرفع كأجزاء (part objects) متوازية ثم يدمجها الخادم (compose)
+- إعادة المحاولة مع backoff عند أخطاء الشبكة أو 5xx / 429
+
+Endpoints (Node API):
+    POST /api/internal/geo-jobs/:id/upload-url       -> uploadUrl أو parts[]
+    POST /api/internal/geo-jobs/:id/upload-complete  -> دمج الأجزاء في fileKey
+    POST /api/internal/geo-jobs/:id/upload-abort     -> حذف الأجزاء بعد فشل الرفع
+
+الاختبارات في tests/test_uploader.py ترفع الملفات إلى خادم object storage محلي وهمي.
+"""
+
+import asyncio
+import math
+import os
+import time
+from typing import Dict, Any, AsyncIterator, List, Optional
+
+import httpx
+
+import logging
+logger = logging.getLogger('upload-engine')
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_MULTIPART_THRESHOLD = 32 * 1024 * 1024
+MAX_PARTS = 32  # GCS compose limit (MAX_COMPOSE_SOURCES on the server)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UploadError(Exception):
+    """فشل الرفع (retryable = يمكن إعادة المحاولة)"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+async def _file_chunks(file_path: str, offset: int, length: int, chunk_size: int) -> AsyncIterator[bytes]:
+    """قراءة [offset, offset + length) من الملف على شكل chunks (القراءة في thread خارج event loop)"""
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+            if not chunk:
+                raise UploadError(f"{file_path} shrank during upload")
+            remaining -= len(chunk)
+            yield chunk
+
+
+class UploadEngine:
+    """
+    محرك الرفع فوق httpx.AsyncClient مشترك
+
+    http_client للـ API (مع توكن الـ worker)؛ طلبات PUT إلى الـ signed URLs تمر عبر storage_client
+    بدون Authorization حتى لا يصل التوكن إلى خادم التخزين ولا يتعارض مع التوقيع.
+
+    مثال:
+        engine = UploadEngine(http_client, 'http://localhost:5000', concurrency=4, storage_client=storage_client)
+        result = await engine.upload(job_id, 'preview.png', 'geo-jobs/<id>/output/preview.png', 'image/png')
+    """
+
+    def __init__(self, http_client: httpx.AsyncClient, api_base_url: str, concurrency: int = 4,
+                 part_size: int = DEFAULT_PART_SIZE, multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, max_retries: int = 4, backoff_seconds: float = 0.5,
+                 storage_client: Optional[httpx.AsyncClient] = None):
+        """
+        Args:
+            concurrency: أقصى عدد لطلبات PUT المتزامنة (ملفات وأجزاء معًا)
+            part_size: حجم الجزء في الرفع متعدد الأجزاء (يُكبَّر إذا تجاوز عدد الأجزاء MAX_PARTS)
+            multipart_threshold: أصغر حجم ملف يُرفع كأجزاء
+            max_retries: عدد إعادة المحاولات لكل طلب
+            backoff_seconds: الانتظار قبل أول إعادة محاولة (يتضاعف مع كل محاولة)
+            storage_client: client بدون auth headers لطلبات PUT إلى الـ signed URLs
+                (افتراضيًا http_client، فقط عندما لا يحمل headers خاصة بالـ API)
+        """
+        self.http_client = http_client
+        self.storage_client = storage_client or http_client
+        self.api_base_url = api_base_url
+        self.concurrency = max(1, concurrency)
+        self.part_size = part_size
+        self.multipart_threshold = multipart_threshold
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._slots
+
+    def plan_parts(self, file_size: int) -> int:
+        """عدد الأجزاء للملف (1 = رفع مباشر)"""
+        if file_size < self.multipart_threshold:
+            return 1
+        parts = max(1, min(MAX_PARTS, math.ceil(file_size / self.part_size)))
+        # Equal parts of ceil(size / parts) bytes; recount so the last part is never empty
+        return math.ceil(file_size / math.ceil(file_size / parts))
+
+    async def _with_retries(self, description: str, request) -> httpx.Response:
+        """تنفيذ request() مع إعادة المحاولة و backoff أسّي"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await request()
+                if response.status_code < 300:
+                    return response
+                raise UploadError(
+                    f"{description} failed with status {response.status_code}",
+                    retryable=response.status_code in RETRYABLE_STATUS
+                )
+            except (httpx.TransportError, UploadError) as e:
+                retryable = isinstance(e, httpx.TransportError) or e.retryable
+                if not retryable or attempt == self.max_retries:
+                    raise UploadError(f"{description} failed after {attempt + 1} attempts: {e}") from e
+                delay = self.backoff_seconds * (2 ** attempt)
+                logger.warning(f"{e}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _api_post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self._with_retries(
+            f"POST {path}",
+            lambda: self.http_client.post(f"{self.api_base_url}{path}", json=payload)
+        )
+        return response.json().get('data', {})
+
+    async def _put_range(self, url: str, file_path: str, offset: int, length: int, content_type: str):
+        """PUT لجزء من الملف مع بث المحتوى من القرص (يُعاد فتح الملف في كل محاولة)"""
+        async with self.slots:
+            await self._with_retries(
+                f"PUT {os.path.basename(file_path)} [{offset}:{offset + length}]",
+                lambda: self.storage_client.put(
+                    url,
+                    content=_file_chunks(file_path, offset, length, self.chunk_size),
+                    headers={'Content-Type': content_type, 'Content-Length': str(length)}
+                )
+            )
+
+    async def _abort(self, job_id: str, file_key: str, part_keys: List[str]):
+        """حذف الأجزاء المرفوعة بعد فشل رفع متعدد الأجزاء (best effort: لا يخفي الخطأ الأصلي)"""
+        try:
+            await asyncio.shield(self._api_post(f"/api/internal/geo-jobs/{job_id}/upload-abort", {
+                'fileKey': file_key,
+                'parts': part_keys
+            }))
+        except Exception as e:
+            logger.warning(f"Could not delete the uploaded parts of {file_key}: {e}")
+
+    async def upload(self, job_id: str, file_path: str, file_key: str, content_type: str) -> Dict[str, Any]:
+        """
+        رفع ملف واحد إلى file_key
+
+        Returns:
+            {'file_key', 'bytes', 'parts', 'seconds'}
+        """
+        start = time.perf_counter()
+        file_size = os.path.getsize(file_path)
+        parts = self.plan_parts(file_size)
+
+        upload_info = await self._api_post(f"/api/internal/geo-jobs/{job_id}/upload-url", {
+            'fileKey': file_key,
+            'fileName': os.path.basename(file_path),
+            'fileSize': file_size,
+            'contentType': content_type,
+            'parts': parts
+        })
+
+        if parts == 1:
+            await self._put_range(upload_info['uploadUrl'], file_path, 0, file_size, content_type)
+        else:
+            part_size = math.ceil(file_size / parts)
+            part_infos = sorted(upload_info['parts'], key=lambda part: part['partNumber'])
+            part_keys = [part['fileKey'] for part in part_infos]
+            try:
+                # Let every PUT settle before aborting, so no part lands after the cleanup
+                results = await asyncio.gather(*(
+                    self._put_range(
+                        part['uploadUrl'], file_path, index * part_size,
+                        min(part_size, file_size - index * part_size), content_type
+                    )
+                    for index, part in enumerate(part_infos)
+                ), return_exceptions=True)
+                errors = [result for result in results if isinstance(result, BaseException)]
+                if errors:
+                    raise errors[0]
+                await self._api_post(f"/api/internal/geo-jobs/{job_id}/upload-complete", {
+                    'fileKey': file_key,
+                    'parts': part_keys,
+                    'contentType': content_type
+                })
+            except BaseException:
+                await self._abort(job_id, file_key, part_keys)
+                raise
+
+        return {
+            'file_key': file_key,
+            'bytes': file_size,
+            'parts': parts,
+            'seconds': round(time.perf_counter() - start, 4)
+        }
@@ -20,11 +20,14 @@ import json
 import uuid
 import logging
 import asyncio
+import shutil
+import signal
 import tempfile
 import traceback
+from collections import deque
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Deque, Dict, Any, Optional, List, Tuple
 
 import httpx
 import psycopg2
@@ -34,6 +37,14 @@ from psycopg2 import sql
 # Import processing modules
 from processor import create_processor
 from file_manager import FileManager
+from result_cache import ResultCache
+from pipeline import JobPipeline
+from processing_executor import ProcessingExecutor
+from loop_monitor import LoopLagMonitor
+from job_notifier import JobNotificationListener, ClaimLatencyTracker, time_to_claim_ms
+from poll_scheduler import PollScheduler
+from processor import generate_tiles_file
+from config import WorkerConfig
 
 # Configure logging
 logging.basicConfig(
@@ -58,7 +69,20 @@ class GeoprocessingWorker:
     def __init__(self):
         self.worker_id = f"worker-{uuid.uuid4().hex[:8]}"
         self.running = False
-        self.current_job_id = None
+        self.cancelled_jobs = set()
+        
+        # Jobs in flight (job id -> task), at most concurrent_jobs
+        self.concurrent_jobs = max(1, int(os.getenv('CONCURRENT_JOBS', 1)))
+        self.active_jobs: Dict[str, asyncio.Task] = {}
+        
+        # Jobs claimed ahead of a free slot: (job, claimed at), started in claim order
+        self.claim_batch_size = max(1, int(os.getenv('CLAIM_BATCH_SIZE', 4)))
+        self.prefetch_size = max(0, int(os.getenv('PREFETCH_SIZE', 2)))
+        self.prefetched: Deque[Tuple[Dict[str, Any], float]] = deque()
+        self.batch_claim_supported = True
+        # Claim request in flight (run() loop); shutdown() collects and releases its jobs
+        self.claim_task: Optional[asyncio.Task] = None
+        self._stop_requested: Optional[asyncio.Event] = None
         
         # Database configuration
         self.db_config = {
@@ -74,7 +98,25 @@ class GeoprocessingWorker:
         self.worker_auth_token = os.getenv('WORKER_AUTH_TOKEN', 'worker-secret-token')
         
         # Polling configuration
-        self.poll_interval = int(os.getenv('POLL_INTERVAL', 5))  # seconds
+        # Adaptive polling: fast right after finding work, exponential backoff with jitter when idle
+        self.poll_scheduler = PollScheduler(
+            min_interval=WorkerConfig.POLL_MIN_INTERVAL,
+            max_interval=WorkerConfig.POLL_MAX_INTERVAL,
+            jitter=float(os.getenv('POLL_JITTER', 0.5))
+        )
+        if WorkerConfig.POLL_INTERVAL is not None:
+            logger.warning(
+                f"POLL_INTERVAL is deprecated: idle polling backs off between {WorkerConfig.POLL_MIN_INTERVAL}s and "
+                f"{WorkerConfig.POLL_MAX_INTERVAL}s (POLL_INTERVAL is the cap unless POLL_MAX_INTERVAL is set)"
+            )
+        # Long-poll claim: the server holds an empty claim until a job arrives (0 = disabled)
+        self.claim_wait_seconds = min(30.0, max(0.0, float(os.getenv('CLAIM_WAIT_SECONDS', 0))))
+        
+        # Push wake-ups via Postgres LISTEN/NOTIFY; polling drops to a slow fallback while listening
+        self.job_notify = os.getenv('JOB_NOTIFY', 'true').lower() == 'true'
+        self.notify_poll_interval = int(os.getenv('NOTIFY_POLL_INTERVAL', 60))  # seconds
+        self.job_listener = JobNotificationListener(self.get_database_connection) if self.job_notify else None
+        self.claim_latency = ClaimLatencyTracker()
         self.heartbeat_interval = int(os.getenv('HEARTBEAT_INTERVAL', 30))  # seconds
         self.max_processing_time = int(os.getenv('MAX_PROCESSING_TIME', 3600))  # 1 hour
         
@@ -85,27 +127,84 @@ class GeoprocessingWorker:
         )
         
         # Initialize specialized components
-        self.file_manager = FileManager(self.api_base_url, self.worker_auth_token)
+        self.file_manager = FileManager(
+            self.api_base_url,
+            self.worker_auth_token,
+            download_concurrency=int(os.getenv('DOWNLOAD_CONCURRENCY', 4)),
+            download_segments=int(os.getenv('DOWNLOAD_SEGMENTS', 4)),
+            segment_threshold=int(os.getenv('DOWNLOAD_SEGMENT_THRESHOLD', 32 * 1024 * 1024)),
+            download_retries=int(os.getenv('DOWNLOAD_RETRIES', 4)),
+            upload_concurrency=int(os.getenv('UPLOAD_CONCURRENCY', 4)),
+            multipart_threshold=int(os.getenv('UPLOAD_MULTIPART_THRESHOLD', 32 * 1024 * 1024)),
+            part_size=int(os.getenv('UPLOAD_PART_SIZE', 16 * 1024 * 1024)),
+            concurrent_jobs=self.concurrent_jobs
+        )
         
         # Processor configuration
         processing_config = {
             'max_image_size': int(os.getenv('MAX_IMAGE_SIZE', 4096)),
             'compression_quality': int(os.getenv('COMPRESSION_QUALITY', 85)),
+            'encoding_profile': os.getenv('ENCODING_PROFILE', 'balanced'),
+            'output_format': os.getenv('OUTPUT_FORMAT', 'png'),
             'generate_thumbnails': os.getenv('GENERATE_THUMBNAILS', 'true').lower() == 'true',
             'thumbnail_size': int(os.getenv('THUMBNAIL_SIZE', 256)),
-            'include_statistics': os.getenv('INCLUDE_STATISTICS', 'true').lower() == 'true'
+            'include_statistics': os.getenv('INCLUDE_STATISTICS', 'true').lower() == 'true',
+            'decimated_rendering': os.getenv('DECIMATED_RENDERING', 'true').lower() == 'true',
+            'cpu_cores': int(os.getenv('CPU_CORES', 1)),
+            'tile_format': os.getenv('TILE_FORMAT', 'png'),
+            'tile_size': int(os.getenv('TILE_SIZE', 256)),
+            'tile_max_count': int(os.getenv('TILE_MAX_COUNT', 50000)),
+            'cog_mode': os.getenv('COG_MODE', 'off'),
+            'cog_block_size': int(os.getenv('COG_BLOCK_SIZE', 512)),
+            'build_overviews': os.getenv('BUILD_OVERVIEWS', 'false').lower() == 'true',
+            'preserve_transparency': os.getenv('PRESERVE_TRANSPARENCY', 'true').lower() == 'true',
+            'stretch_percentiles': os.getenv('STRETCH_PERCENTILES', '2,98'),
+            'distinct_count_error': float(os.getenv('DISTINCT_COUNT_ERROR', 0.01)),
+            'coordinate_system': os.getenv('OUTPUT_CRS', 'EPSG:4326'),
+            'warp_chunk_size': int(os.getenv('WARP_CHUNK_SIZE', 1024)),
+            'trace_memory': os.getenv('TRACE_MEMORY', 'false').lower() == 'true'
         }
         self.processor = create_processor(processing_config)
         
+        # Content-addressed cache of processing results (input hash + config + version)
+        self.result_cache = ResultCache(
+            WorkerConfig.RESULT_CACHE_DIR,
+            WorkerConfig.RESULT_CACHE_MAX_SIZE,
+            WorkerConfig.RESULT_CACHE_ENABLED
+        )
+        
+        # Files waiting between pipeline stages (download -> process -> upload)
+        self.pipeline_queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', 2))
+        
+        # CPU-bound processing runs off the event loop so heartbeats keep flowing
+        self.processing_executor = ProcessingExecutor(
+            self.processor,
+            mode=os.getenv('PROCESSING_EXECUTOR', 'process'),
+            # Each job processes up to CPU_CORES files at once
+            slots=self.concurrent_jobs * max(1, self.processor.cpu_cores)
+        )
+        self.loop_monitor = LoopLagMonitor(
+            interval=float(os.getenv('LOOP_LAG_INTERVAL', 0.1)),
+            warn_ms=float(os.getenv('LOOP_LAG_WARN_MS', 500))
+        )
+        
         logger.info(f"Worker initialized: {self.worker_id}")
         logger.info(f"Database: {self.db_config['host']}:{self.db_config['port']}")
         logger.info(f"API Base URL: {self.api_base_url}")
         logger.info(f"Processing config: {processing_config}")
+        logger.info(f"Concurrent jobs: {self.concurrent_jobs}")
+        logger.info(f"Claim batch size: {self.claim_batch_size}, prefetch size: {self.prefetch_size}")
+        logger.info(f"Job notifications: {'LISTEN/NOTIFY' if self.job_notify else 'disabled (polling only)'}")
+        logger.info(
+            f"Polling: {self.poll_scheduler.min_interval}s-{self.poll_scheduler.max_interval}s backoff, "
+            f"long-poll {self.claim_wait_seconds or 'disabled'}"
+        )
     
     async def get_database_connection(self):
         """إنشاء اتصال بقاعدة البيانات"""
         try:
-            conn = psycopg2.connect(**self.db_config)
+            # psycopg2 connects synchronously; keep the event loop free meanwhile
+            conn = await asyncio.to_thread(psycopg2.connect, **self.db_config)
             conn.autocommit = True
             return conn
         except Exception as e:
@@ -139,6 +238,69 @@ class GeoprocessingWorker:
             logger.error(f"Error claiming job: {e}")
             return None
     
+    async def claim_jobs(self, limit: int, wait_seconds: float = 0) -> Optional[List[Dict[str, Any]]]:
+        """
+        طلب حتى limit jobs في طلب واحد (POST /api/internal/geo-jobs/claim/batch)
+        
+        يعود إلى claim_next_job إذا كان الخادم لا يدعم الـ batch claim.
+        
+        Args:
+            wait_seconds: long-poll: يبقي الخادم الطلب مفتوحًا حتى وصول job أو انتهاء المدة
+        
+        Returns:
+            الـ jobs المطلوبة (قد تكون فارغة)، أو None إذا فشل الطلب
+        """
+        if not self.batch_claim_supported:
+            job = await self.claim_next_job()
+            return [job] if job else []
+        
+        try:
+            response = await self.http_client.post(
+                f"{self.api_base_url}/api/internal/geo-jobs/claim/batch",
+                json={'workerId': self.worker_id, 'limit': limit, 'waitSeconds': wait_seconds},
+                timeout=httpx.Timeout(30.0 + wait_seconds)
+            )
+            
+            if response.status_code == 404:
+                logger.warning("Batch claim endpoint not available, claiming one job per request")
+                self.batch_claim_supported = False
+                return await self.claim_jobs(1)
+            
+            if response.status_code == 200:
+                jobs = response.json().get('data', {}).get('jobs') or []
+                for job in jobs:
+                    logger.info(f"Claimed job: {job['id']} - {job['taskType']}")
+                return jobs
+            
+            logger.error(f"Failed to claim jobs: {response.status_code} - {response.text}")
+            return None
+            
+        except Exception as e:
+            logger.error(f"Error claiming jobs: {e}")
+            return None
+    
+    async def release_jobs(self, job_ids: List[str]) -> List[str]:
+        """إعادة jobs مطلوبة لم تبدأ إلى الطابور (POST /api/internal/geo-jobs/release)"""
+        if not job_ids:
+            return []
+        
+        try:
+            response = await self.http_client.post(
+                f"{self.api_base_url}/api/internal/geo-jobs/release",
+                json={'workerId': self.worker_id, 'jobIds': job_ids}
+            )
+            
+            if response.status_code == 200:
+                released = response.json().get('data', {}).get('jobIds') or []
+                logger.info(f"Released {len(released)}/{len(job_ids)} unstarted jobs back to the queue")
+                return released
+            else:
+                logger.error(f"Failed to release jobs: {response.status_code}")
+                
+        except Exception as e:
+            logger.error(f"Error releasing jobs: {e}")
+        return []
+    
     async def update_job_progress(self, job_id: str, progress: int, message: str = ""):
         """تحديث progress الخاص بـ job"""
         try:
@@ -157,8 +319,13 @@ class GeoprocessingWorker:
         except Exception as e:
             logger.error(f"Error updating job progress: {e}")
     
-    async def send_heartbeat(self, job_id: str):
-        """إرسال heartbeat للـ job"""
+    async def send_heartbeat(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        إرسال heartbeat للـ job
+        
+        Returns:
+            حالة الـ job كما يعيدها الخادم (لاكتشاف الإلغاء، انظر job_lost)، أو None عند الفشل
+        """
         try:
             response = await self.http_client.patch(
                 f"{self.api_base_url}/api/internal/geo-jobs/{job_id}/heartbeat",
@@ -167,11 +334,24 @@ class GeoprocessingWorker:
             
             if response.status_code == 200:
                 logger.debug(f"Heartbeat sent for job {job_id}")
+                return response.json().get('data', {}).get('job')
+            elif response.status_code == 409:
+                # No longer locked by this worker: the body carries the job's current status
+                return response.json().get('data', {}).get('job')
             else:
                 logger.error(f"Failed to send heartbeat: {response.status_code}")
                 
         except Exception as e:
             logger.error(f"Error sending heartbeat: {e}")
+        return None
+    
+    def job_lost(self, job_state: Optional[Dict[str, Any]]) -> bool:
+        """هل ألغي الـ job أو لم يعد مقفلًا لهذا الـ worker؟ (حسب رد الـ heartbeat)"""
+        if not job_state:
+            return False
+        if job_state.get('status') == 'cancelled':
+            return True
+        return 'lockedBy' in job_state and job_state['lockedBy'] != self.worker_id
     
     async def complete_job(self, job_id: str, output_payload: Dict[str, Any], output_keys: List[str]):
         """تمييز job كمكتمل"""
@@ -214,18 +394,25 @@ class GeoprocessingWorker:
             logger.error(f"Error failing job: {e}")
             return False
     
-    async def download_input_files(self, job: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """تحميل input files من Object Storage باستخدام FileManager"""
+    async def download_input_files(self, job: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        تحميل input files من Object Storage باستخدام FileManager
+        
+        Returns:
+            (file infos, ملخص التحميل: البايتات والزمن والإنتاجية MB/s)
+        """
         try:
-            return await self.file_manager.download_job_input_files(job['id'])
+            download_start = time.perf_counter()
+            file_infos = await self.file_manager.download_job_input_files(job['id'])
+            return file_infos, self.file_manager.download_summary(file_infos, time.perf_counter() - download_start)
         except Exception as e:
             logger.error(f"Error downloading input files: {e}")
             raise
     
-    async def upload_output_files(self, job_id: str, output_files: List[str]) -> List[str]:
+    async def upload_output_files(self, job_id: str, output_files: List[str], base_dir: Optional[str] = None) -> List[str]:
         """رفع output files إلى Object Storage باستخدام FileManager"""
         try:
-            return await self.file_manager.upload_job_output_files(job_id, output_files)
+            return await self.file_manager.upload_job_output_files(job_id, output_files, base_dir)
         except Exception as e:
             logger.error(f"Error uploading output files: {e}")
             return []
@@ -233,88 +420,162 @@ class GeoprocessingWorker:
     async def process_geotiff_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
         """
         معالجة GeoTIFF job باستخدام Processor المحدث
+        
+        التحميل والمعالجة والرفع تعمل كـ pipeline: الملف التالي يُحمّل أثناء معالجة
+        الملف الحالي، ومخرجات كل ملف تُرفع فور انتهاء معالجته
         """
         job_id = job['id']
+        output_base_dir = tempfile.mkdtemp(prefix=f"output_{job_id}_")
+        pipeline = JobPipeline(
+            self.file_manager,
+            self.processor,
+            self.processing_executor,
+            self.result_cache,
+            job,
+            WorkerConfig.WORKER_VERSION,
+            queue_size=self.pipeline_queue_size,
+            on_progress=lambda progress, message: self.update_job_progress(job_id, progress, message)
+        )
         
         try:
             logger.info(f"Starting GeoTIFF processing for job {job_id}")
-            await self.update_job_progress(job_id, 10, "Downloading input files...")
+            await self.update_job_progress(job_id, 10, "Downloading and processing input files...")
             
-            # Download input files using FileManager
-            input_file_infos = await self.download_input_files(job)
+            result = await pipeline.run(output_base_dir)
+            batch_result = result['batch_result']
+            input_file_infos = result['input_file_infos']
+            output_keys = result['output_keys']
             
-            if not input_file_infos:
-                raise Exception("No input files downloaded")
+            await self.update_job_progress(job_id, 90, "Finalizing results...")
             
-            await self.update_job_progress(job_id, 30, "Processing GeoTIFF files...")
+            # Prepare enhanced output payload
+            output_payload = {
+                'taskType': job['taskType'],
+                'processedAt': datetime.now().isoformat(),
+                'workerId': self.worker_id,
+                'processingResults': batch_result,
+                'summary': {
+                    'totalInputFiles': len(input_file_infos),
+                    'geotiffFiles': result['geotiff_files'],
+                    'successfullyProcessed': batch_result['summary']['successful'],
+                    'failed': batch_result['summary']['failed'],
+                    'totalOutputFiles': batch_result['summary']['total_output_files'],
+                    'uploadedFiles': len(output_keys)
+                },
+                'inputValidation': [file_info.get('validation', {}) for file_info in input_file_infos],
+                'download': self.file_manager.download_summary(
+                    input_file_infos, result['pipeline']['stages']['download']['busy_seconds']
+                ),
+                'pipeline': result['pipeline'],
+                'resultCache': dict(self.result_cache.stats(), jobHits=result['pipeline']['cache_hits'])
+            }
             
-            # Extract file paths for GeoTIFF files
-            geotiff_files = []
-            for file_info in input_file_infos:
-                file_path = file_info['local_path']
-                if file_path.lower().endswith(('.tif', '.tiff', '.geotiff')):
-                    geotiff_files.append(file_path)
-                else:
-                    logger.warning(f"Skipping non-GeoTIFF file: {file_info['file_name']}")
+            return {
+                'output_payload': output_payload,
+                'output_keys': output_keys
+            }
             
+        except Exception as e:
+            logger.error(f"Error processing GeoTIFF job: {e}")
+            logger.error(traceback.format_exc())
+            raise
+            
+        finally:
+            # Inputs are removed by the pipeline; cached outputs were already moved out
+            shutil.rmtree(output_base_dir, ignore_errors=True)
+    
+    async def process_tiles_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        معالجة job لإنشاء هرم tiles (z/x/y) من ملفات GeoTIFF
+        """
+        job_id = job['id']
+        output_base_dir = tempfile.mkdtemp(prefix=f"output_{job_id}_")
+        input_file_infos: List[Dict[str, Any]] = []
+        
+        try:
+            logger.info(f"Starting tile pyramid generation for job {job_id}")
+            await self.update_job_progress(job_id, 10, "Downloading input files...")
+            
+            input_file_infos, download_stats = await self.download_input_files(job)
+            if not input_file_infos:
+                raise Exception("No input files downloaded")
+            
+            geotiff_files = [
+                file_info['local_path'] for file_info in input_file_infos
+                if file_info['local_path'].lower().endswith(('.tif', '.tiff', '.geotiff'))
+            ]
             if not geotiff_files:
                 raise Exception("No GeoTIFF files found in input")
             
-            # Create output directory
-            output_base_dir = tempfile.mkdtemp(prefix=f"output_{job_id}_")
+            await self.update_job_progress(job_id, 30, "Generating tiles...")
             
-            # Process using enhanced processor
             job_config = job.get('inputPayload', {})
-            batch_result = self.processor.batch_process_files(
-                geotiff_files, 
-                output_base_dir, 
-                job_config
-            )
             
-            await self.update_job_progress(job_id, 70, "Uploading output files...")
+            tile_sets = []
+            errors = []
+            for i, input_file in enumerate(geotiff_files):
+                tile_root = f"tiles/file_{i+1}_{Path(input_file).stem}"
+                try:
+                    tile_result = await self.processing_executor.run(
+                        generate_tiles_file,
+                        input_file,
+                        os.path.join(output_base_dir, tile_root),
+                        job_config
+                    )
+                    tile_result['tile_key_template'] = f"geo-jobs/{job_id}/output/{tile_root}/{tile_result['tile_url_template']}"
+                    tile_sets.append(tile_result)
+                except Exception as e:
+                    error_msg = f"Tile generation failed for {os.path.basename(input_file)}: {str(e)}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
             
-            # Collect all output files
-            all_output_files = []
-            for file_name, file_result in batch_result['files'].items():
-                if 'output_files' in file_result:
-                    for output_type, output_path in file_result['output_files'].items():
-                        all_output_files.append(output_path)
+            if not tile_sets:
+                raise Exception("; ".join(errors) or "Tile generation produced no output")
             
-            # Upload output files using FileManager
-            output_keys = await self.upload_output_files(job_id, all_output_files)
+            await self.update_job_progress(job_id, 70, "Uploading tiles...")
+            
+            # Tiles keep their z/x/y layout as object keys so they can be addressed by template
+            all_output_files = [
+                os.path.join(root, file_name)
+                for root, _, file_names in os.walk(output_base_dir)
+                for file_name in file_names
+            ]
+            output_keys = await self.upload_output_files(job_id, all_output_files, output_base_dir)
             
             await self.update_job_progress(job_id, 90, "Finalizing results...")
             
-            # Prepare enhanced output payload
             output_payload = {
                 'taskType': job['taskType'],
                 'processedAt': datetime.now().isoformat(),
                 'workerId': self.worker_id,
-                'processingResults': batch_result,
+                'tileSets': tile_sets,
+                'errors': errors,
                 'summary': {
                     'totalInputFiles': len(input_file_infos),
                     'geotiffFiles': len(geotiff_files),
-                    'successfullyProcessed': batch_result['summary']['successful'],
-                    'failed': batch_result['summary']['failed'],
-                    'totalOutputFiles': batch_result['summary']['total_output_files'],
+                    'tileSets': len(tile_sets),
+                    'tilesWritten': sum(tile_set['tiles_written'] for tile_set in tile_sets),
+                    'tilesSkippedEmpty': sum(tile_set['tiles_skipped_empty'] for tile_set in tile_sets),
                     'uploadedFiles': len(output_keys)
                 },
-                'inputValidation': [file_info.get('validation', {}) for file_info in input_file_infos]
+                'inputValidation': [file_info.get('validation', {}) for file_info in input_file_infos],
+                'download': download_stats
             }
             
-            # Cleanup temp files using FileManager
-            self.file_manager.cleanup_temp_files(input_file_infos)
-            self.cleanup_temp_files(all_output_files)
-            
             return {
                 'output_payload': output_payload,
                 'output_keys': output_keys
             }
             
         except Exception as e:
-            logger.error(f"Error processing GeoTIFF job: {e}")
+            logger.error(f"Error processing tiles job: {e}")
             logger.error(traceback.format_exc())
             raise
+            
+        finally:
+            # Failed and cancelled jobs too: downloaded inputs and partial tile trees
+            self.file_manager.cleanup_temp_files(input_file_infos)
+            shutil.rmtree(output_base_dir, ignore_errors=True)
     
     def cleanup_temp_files(self, file_paths: List[str]):
         """تنظيف الملفات المؤقتة"""
@@ -336,28 +597,61 @@ class GeoprocessingWorker:
             except Exception as e:
                 logger.warning(f"Failed to cleanup directory {temp_dir}: {e}")
     
-    async def process_job(self, job: Dict[str, Any]) -> bool:
+    async def process_job(self, job: Dict[str, Any], prefetch_wait: float = 0.0) -> bool:
         """
         معالجة job واحد
+        
+        Args:
+            prefetch_wait: الزمن الذي انتظره الـ job في الـ prefetch queue (ثانية)
         """
         job_id = job['id']
         task_type = job['taskType']
         
-        self.current_job_id = job_id
         start_time = datetime.now()
         
-        # Start heartbeat task
-        heartbeat_task = asyncio.create_task(self.heartbeat_loop(job_id))
+        # Route to appropriate processor
+        if task_type == 'geotiff_to_png':
+            handler = self.process_geotiff_job
+        elif task_type in ('geotiff_to_tiles', 'TILE_GENERATION'):
+            handler = self.process_tiles_job
+        else:
+            handler = None
+        
+        loop_lag = self.loop_monitor.open_window()
+        job_task = asyncio.create_task(handler(job)) if handler else None
+        
+        # Start heartbeat task (it also cancels the job when the server reports it cancelled)
+        heartbeat_task = asyncio.create_task(self.heartbeat_loop(job_id, job_task))
         
         try:
             logger.info(f"Processing job {job_id} - {task_type}")
             
-            # Route to appropriate processor
-            if task_type == 'geotiff_to_png':
-                result = await self.process_geotiff_job(job)
-            else:
+            if job_task is None:
                 raise Exception(f"Unsupported task type: {task_type}")
             
+            try:
+                result = await asyncio.wait_for(job_task, timeout=self.max_processing_time)
+            except asyncio.TimeoutError:
+                raise Exception(f"Job exceeded MAX_PROCESSING_TIME ({self.max_processing_time}s)")
+            except asyncio.CancelledError:
+                if job_id in self.cancelled_jobs:
+                    logger.info(f"Job {job_id} was cancelled or taken over on the server, processing stopped")
+                    return False
+                raise
+            
+            result['output_payload']['eventLoop'] = dict(
+                loop_lag.stats(),
+                executor=self.processing_executor.stats()
+            )
+            result['output_payload']['claim'] = {
+                'prefetchWaitSeconds': round(prefetch_wait, 4),
+                'batchSize': self.claim_batch_size,
+                'prefetchSize': self.prefetch_size,
+                'timeToClaimMs': time_to_claim_ms(job),
+                'timeToClaim': self.claim_latency.stats(),
+                'notifications': self.job_listener.stats() if self.job_listener else None
+            }
+            
             # Complete the job
             success = await self.complete_job(
                 job_id,
@@ -396,52 +690,249 @@ class GeoprocessingWorker:
             except asyncio.CancelledError:
                 pass
             
-            self.current_job_id = None
+            self.loop_monitor.close_window(loop_lag)
+            lag = loop_lag.stats()
+            logger.info(f"Job {job_id} event loop lag: p99 {lag['p99_ms']} ms, max {lag['max_ms']} ms")
+            
+            self.cancelled_jobs.discard(job_id)
     
-    async def heartbeat_loop(self, job_id: str):
+    async def heartbeat_loop(self, job_id: str, job_task: Optional[asyncio.Task] = None):
         """
         إرسال heartbeat بشكل دوري
+        
+        إذا أعاد الخادم أن الـ job ملغى أو لم يعد لهذا الـ worker يُلغى job_task
+        (وتُنهى المعالجة الجارية في الـ executor)
         """
         try:
             while True:
                 await asyncio.sleep(self.heartbeat_interval)
-                await self.send_heartbeat(job_id)
+                job_state = await self.send_heartbeat(job_id)
+                if job_task is not None and self.job_lost(job_state):
+                    logger.warning(
+                        f"Job {job_id} is {job_state.get('status')} on the server and no longer locked by "
+                        f"this worker, stopping it"
+                    )
+                    self.cancelled_jobs.add(job_id)
+                    job_task.cancel()
+                    return
         except asyncio.CancelledError:
             logger.debug(f"Heartbeat loop cancelled for job {job_id}")
     
+    async def prefetch_heartbeat_loop(self):
+        """
+        heartbeat دوري للـ jobs في الـ prefetch queue (حتى لا يعتبرها الخادم متوقفة قبل أن تبدأ)
+        
+        الـ jobs التي ألغيت على الخادم أو لم تعد لهذا الـ worker تُحذف من الـ queue.
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.heartbeat_interval)
+                waiting = [job['id'] for job, _ in list(self.prefetched)]
+                if not waiting:
+                    continue
+                states = await asyncio.gather(*(self.send_heartbeat(job_id) for job_id in waiting))
+                lost = {job_id for job_id, state in zip(waiting, states) if self.job_lost(state)}
+                if lost:
+                    logger.warning(f"Dropping {len(lost)} prefetched jobs cancelled or taken over on the server")
+                    self.prefetched = deque(entry for entry in self.prefetched if entry[0]['id'] not in lost)
+        except asyncio.CancelledError:
+            logger.debug("Prefetch heartbeat loop cancelled")
+    
+    async def release_prefetched_jobs(self):
+        """إعادة الـ jobs التي لم تبدأ إلى الخادم عند الإيقاف"""
+        if not self.prefetched:
+            return
+        job_ids = [job['id'] for job, _ in self.prefetched]
+        self.prefetched.clear()
+        await self.release_jobs(job_ids)
+    
+    async def collect_claim(self):
+        """
+        انتظار الـ claim الجاري وإضافة jobs التي أعادها إلى prefetched (لتبدأ أو تُعاد إلى الخادم)
+        
+        الـ long-poll يُلغى بدل انتظاره حتى CLAIM_WAIT_SECONDS؛ الخادم يتوقف عن الطلب عند انقطاع الاتصال.
+        """
+        claim_task, self.claim_task = self.claim_task, None
+        if claim_task is None:
+            return
+        if claim_task.get_name() == 'claim-long-poll' and not claim_task.done():
+            claim_task.cancel()
+        jobs = (await asyncio.gather(claim_task, return_exceptions=True))[0]
+        if isinstance(jobs, list):
+            claimed_at = time.monotonic()
+            self.prefetched.extend((job, claimed_at) for job in jobs)
+    
+    def request_stop(self, signal_name: Optional[str] = None):
+        """إيقاف الـ loop الرئيسي (SIGINT / SIGTERM): لا jobs جديدة، والجارية تكتمل"""
+        if self.running:
+            logger.info(f"Received {signal_name or 'stop request'}, shutting down after jobs in flight...")
+        self.running = False
+        if self._stop_requested is not None:
+            self._stop_requested.set()
+    
+    def _install_signal_handlers(self) -> List[int]:
+        loop = asyncio.get_running_loop()
+        installed = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_stop, sig.name)
+                installed.append(sig)
+            except (NotImplementedError, RuntimeError):
+                # Not supported on this platform / not the main thread
+                pass
+        return installed
+    
+    def listening_for_jobs(self) -> bool:
+        return self.job_listener is not None and self.job_listener.connected
+    
+    def max_poll_interval(self) -> float:
+        """أقصى انتظار بين الطلبات: بطيء كاحتياط فقط أثناء الاستماع للإشعارات"""
+        return self.notify_poll_interval if self.listening_for_jobs() else self.poll_scheduler.max_interval
+    
     async def run(self):
         """
         تشغيل Worker الرئيسي
+        
+        SIGINT / SIGTERM يوقفان طلب jobs جديدة؛ run() يعود بعد إعادة الـ jobs غير المبدوءة
+        وانتهاء الـ jobs الجارية، ثم يُستدعى shutdown().
         """
         self.running = True
+        self._stop_requested = asyncio.Event()
+        signals = self._install_signal_handlers()
         logger.info(f"Worker {self.worker_id} starting...")
+        self.loop_monitor.start()
+        prefetch_heartbeat_task = asyncio.create_task(self.prefetch_heartbeat_loop())
+        if self.job_listener is not None:
+            self.job_listener.start()
+        wake_task: Optional[asyncio.Task] = None
+        stop_task = asyncio.create_task(self._stop_requested.wait())
         
-        while self.running:
-            try:
-                # Try to claim a job
-                job = await self.claim_next_job()
-                
-                if job:
-                    # Process the job
-                    await self.process_job(job)
-                else:
-                    # No jobs available, wait before polling again
-                    await asyncio.sleep(self.poll_interval)
-                
-            except KeyboardInterrupt:
-                logger.info("Received interrupt signal, shutting down...")
-                self.running = False
-                break
-            except Exception as e:
-                logger.error(f"Unexpected error in main loop: {e}")
-                logger.error(traceback.format_exc())
-                await asyncio.sleep(self.poll_interval * 2)  # Back off on errors
+        # Claims run in the background so freed slots never wait on a claim round trip
+        claim_started = 0.0
+        next_claim_at = 0.0
         
-        logger.info("Worker shutdown complete")
+        try:
+            while self.running:
+                try:
+                    # Start prefetched jobs in claim order as slots free up
+                    while self.prefetched and len(self.active_jobs) < self.concurrent_jobs:
+                        job, claimed_at = self.prefetched.popleft()
+                        self.start_job(job, time.monotonic() - claimed_at)
+                    
+                    # Keep free slots plus the prefetch queue filled, claiming up to claim_batch_size per request
+                    wanted = self.concurrent_jobs - len(self.active_jobs) + self.prefetch_size - len(self.prefetched)
+                    # A job notification claims right away instead of waiting for the next poll
+                    if self.claim_task is None and wanted > 0 and (
+                        time.monotonic() >= next_claim_at or (self.job_listener is not None and self.job_listener.pending())
+                    ):
+                        # Notifications already push new jobs, so only long-poll without them
+                        wait_seconds = 0 if self.listening_for_jobs() else self.claim_wait_seconds
+                        claim_started = time.monotonic()
+                        self.claim_task = asyncio.create_task(
+                            self.claim_jobs(min(wanted, self.claim_batch_size), wait_seconds),
+                            name='claim-long-poll' if wait_seconds else 'claim'
+                        )
+                    
+                    # Wake up when a slot frees, a claim returns, a job notification arrives,
+                    # the next poll is due or a stop is requested
+                    pending = list(self.active_jobs.values()) + [stop_task]
+                    if self.claim_task is not None:
+                        pending.append(self.claim_task)
+                    timeout = None if self.claim_task or wanted <= 0 else max(0.0, next_claim_at - time.monotonic())
+                    if self.job_listener is not None and self.claim_task is None and wanted > 0:
+                        if wake_task is None or wake_task.done():
+                            wake_task = asyncio.create_task(self.job_listener.event.wait())
+                        pending.append(wake_task)
+                    await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    
+                    if self.claim_task is not None and self.claim_task.done():
+                        jobs = self.claim_task.result()
+                        self.claim_task = None
+                        if jobs is None:
+                            next_claim_at = time.monotonic() + self.poll_scheduler.failure_delay()
+                        elif jobs:
+                            # Claim again right away while there is room
+                            self.poll_scheduler.found_work()
+                            next_claim_at = 0.0
+                            claimed_at = time.monotonic()
+                            self.prefetched.extend((job, claimed_at) for job in jobs)
+                            for job in jobs:
+                                self.claim_latency.record(job)
+                        else:
+                            # No jobs available: back off (time held by a long-poll counts towards the wait)
+                            next_claim_at = claim_started + self.poll_scheduler.idle_delay(self.max_poll_interval())
+                    
+                except Exception as e:
+                    logger.error(f"Unexpected error in main loop: {e}")
+                    logger.error(traceback.format_exc())
+                    # Only drop a claim that failed; one in flight (or with unhandled jobs) is picked up
+                    # on the next pass so its jobs get started or released
+                    if self.claim_task is not None and self.claim_task.done() and (
+                        self.claim_task.cancelled() or self.claim_task.exception() is not None
+                    ):
+                        self.claim_task = None
+                    # Back off on errors (a stop request ends the wait early)
+                    await asyncio.wait([stop_task], timeout=self.poll_scheduler.failure_delay())
+            
+            # A claim still in flight may return jobs: keep them so they are released below
+            await self.collect_claim()
+            
+            for task in (prefetch_heartbeat_task, wake_task):
+                if task is not None:
+                    task.cancel()
+            await asyncio.gather(*(task for task in (prefetch_heartbeat_task, wake_task) if task), return_exceptions=True)
+            await self.release_prefetched_jobs()
+            
+            claim_stats = self.claim_latency.stats()
+            if claim_stats['samples']:
+                logger.info(
+                    f"Time to claim: p50 {claim_stats['p50_ms']} ms, p95 {claim_stats['p95_ms']} ms, "
+                    f"p99 {claim_stats['p99_ms']} ms over {claim_stats['samples']} jobs"
+                )
+            
+            # Let jobs in flight finish (they hold server-side locks)
+            await self.drain_active_jobs()
+            
+            logger.info("Worker shutdown complete")
+        finally:
+            stop_task.cancel()
+            for task in (prefetch_heartbeat_task, wake_task):
+                if task is not None:
+                    task.cancel()
+            loop = asyncio.get_running_loop()
+            for sig in signals:
+                loop.remove_signal_handler(sig)
+    
+    async def drain_active_jobs(self):
+        """انتظار انتهاء الـ jobs الجارية (تحمل locks على الخادم)"""
+        if self.active_jobs:
+            logger.info(f"Waiting for {len(self.active_jobs)} jobs in flight...")
+            await asyncio.gather(*self.active_jobs.values(), return_exceptions=True)
+    
+    def start_job(self, job: Dict[str, Any], prefetch_wait: float = 0.0) -> asyncio.Task:
+        """تشغيل process_job في task مستقل (مع heartbeat ومجلدات مؤقتة خاصة به)"""
+        job_id = job['id']
+        task = asyncio.create_task(self.process_job(job, prefetch_wait), name=f"job-{job_id}")
+        self.active_jobs[job_id] = task
+        task.add_done_callback(lambda _: self.active_jobs.pop(job_id, None))
+        logger.info(f"Job {job_id} started ({len(self.active_jobs)}/{self.concurrent_jobs} slots busy)")
+        return task
     
     async def shutdown(self):
-        """إيقاف Worker بأمان"""
+        """
+        إيقاف Worker بأمان (بعد انتهاء run())
+        
+        إذا لم يُكمل run() الإيقاف (مثلًا أُلغي) تُعاد jobs الـ claim الجاري والـ prefetched إلى الخادم،
+        وتُنتظر الـ jobs الجارية قبل إغلاق الـ executor و HTTP client.
+        """
         self.running = False
+        await self.collect_claim()
+        await self.release_prefetched_jobs()
+        await self.drain_active_jobs()
+        if self.job_listener is not None:
+            await self.job_listener.stop()
+        await self.loop_monitor.stop()
+        self.processing_executor.shutdown()
         await self.http_client.aclose()
         await self.file_manager.close()
 
@@ -451,9 +942,8 @@ async def main():
     worker = GeoprocessingWorker()
     
     try:
+        # Returns once a SIGINT / SIGTERM stop has drained jobs in flight
         await worker.run()
-    except KeyboardInterrupt:
-        logger.info("Shutdown requested")
     finally:
         await worker.shutdown()
 
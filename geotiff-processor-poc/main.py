@@ -11,14 +11,24 @@ import numpy as np
 from PIL import Image
 from pathlib import Path
 import click
+from contextlib import contextmanager
 
 def create_output_dir(output_dir):
     """إنشاء مجلد المخرجات إذا لم يكن موجودًا"""
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
+@contextmanager
+def open_dataset(source):
+    """فتح ملف GeoTIFF من مسار، أو إعادة استخدام dataset مفتوح مسبقًا دون إغلاقه"""
+    if isinstance(source, (str, os.PathLike)):
+        with rasterio.open(source) as dataset:
+            yield dataset
+    else:
+        yield source
+
 def extract_metadata(geotiff_path):
     """استخراج البيانات الوصفية من ملف GeoTIFF"""
-    with rasterio.open(geotiff_path) as dataset:
+    with open_dataset(geotiff_path) as dataset:
         metadata = {
             "driver": dataset.driver,
             "width": dataset.width,
@@ -36,9 +46,16 @@ def extract_metadata(geotiff_path):
         }
         return metadata
 
+def target_shape(width, height, max_size=None):
+    """حساب أبعاد المخرجات (height, width) ضمن الحد الأقصى مع الحفاظ على النسبة"""
+    if not max_size or max(width, height) <= max_size:
+        return height, width
+    ratio = max_size / max(width, height)
+    return max(1, int(height * ratio)), max(1, int(width * ratio))
+
 def convert_to_png(geotiff_path, output_path, max_size=None):
     """تحويل ملف GeoTIFF إلى صيغة PNG"""
-    with rasterio.open(geotiff_path) as dataset:
+    with open_dataset(geotiff_path) as dataset:
         # قراءة البيانات
         data = dataset.read(1)
         
@@ -66,7 +83,7 @@ def convert_to_png(geotiff_path, output_path, max_size=None):
 
 def create_world_file(geotiff_path, output_path):
     """إنشاء ملف الإسناد الجغرافي (World File)"""
-    with rasterio.open(geotiff_path) as dataset:
+    with open_dataset(geotiff_path) as dataset:
         # استخراج معاملات التحويل
         transform = dataset.transform
         
@@ -11,6 +11,9 @@ import {
 
 const REPLIT_SIDECAR_ENDPOINT = "http://127.0.0.1:1106";
 
+// Maximum number of source objects in a single GCS compose request
+export const MAX_COMPOSE_SOURCES = 32;
+
 // The object storage client is used to interact with the object storage service.
 export const objectStorageClient = new Storage({
   credentials: {
@@ -343,6 +346,53 @@ export class ObjectStorageService {
     }
   }
 
+  // Compose uploaded part objects into a single object, then delete the parts.
+  // GCS compose accepts at most 32 source objects per request.
+  async composeObjects(sourceKeys: string[], destinationKey: string, contentType?: string): Promise<void> {
+    if (sourceKeys.length === 0 || sourceKeys.length > MAX_COMPOSE_SOURCES) {
+      throw new Error(`Compose requires between 1 and ${MAX_COMPOSE_SOURCES} source objects`);
+    }
+
+    try {
+      const { bucketName, objectName } = parseObjectPath(destinationKey);
+      const bucket = objectStorageClient.bucket(bucketName);
+      const sources = sourceKeys.map((key) => {
+        const parsed = parseObjectPath(key);
+        if (parsed.bucketName !== bucketName) {
+          throw new Error(`Part ${key} is not in bucket ${bucketName}`);
+        }
+        return bucket.file(parsed.objectName);
+      });
+
+      const destination = bucket.file(objectName);
+      await bucket.combine(sources, destination);
+      if (contentType) {
+        await destination.setMetadata({ contentType });
+      }
+
+      await Promise.all(sources.map((source) => source.delete({ ignoreNotFound: true })));
+      console.log(`✅ Composed ${sourceKeys.length} parts into ${destinationKey}`);
+    } catch (error) {
+      console.error(`❌ Error composing object ${destinationKey}:`, error);
+      throw new Error(`Failed to compose object: ${destinationKey}`);
+    }
+  }
+
+  // Delete part objects left behind by an aborted multipart upload.
+  // Missing parts are ignored, so this is safe to call for any subset of issued keys.
+  async deleteObjects(objectKeys: string[]): Promise<void> {
+    try {
+      await Promise.all(objectKeys.map((key) => {
+        const { bucketName, objectName } = parseObjectPath(key);
+        return objectStorageClient.bucket(bucketName).file(objectName).delete({ ignoreNotFound: true });
+      }));
+      console.log(`✅ Deleted ${objectKeys.length} objects`);
+    } catch (error) {
+      console.error(`❌ Error deleting objects:`, error);
+      throw new Error(`Failed to delete ${objectKeys.length} objects`);
+    }
+  }
+
   // Check if an object exists (optional utility method)
   async exists(objectKey: string): Promise<boolean> {
     try {
@@ -1,6 +1,6 @@
 import type { Express, Request, Response, NextFunction } from "express";
 import { createServer, type Server } from "http";
-import { storage } from "./storage";
+import { storage, geoJobQueueEvents } from "./storage";
 import { db } from "./db";
 import { z } from "zod";
 import { sql, eq, desc, and, or, isNull, lte, gte, gt, inArray, asc } from "drizzle-orm";
@@ -42,7 +42,7 @@ import bcrypt from "bcrypt";
 import jwt from "jsonwebtoken";
 import crypto from "crypto";
 // Object Storage imports for secure file management
-import { ObjectStorageService, ObjectNotFoundError } from './objectStorage';
+import { ObjectStorageService, ObjectNotFoundError, MAX_COMPOSE_SOURCES } from './objectStorage';
 import { ObjectPermission, ObjectAccessGroupType } from './objectAcl';
 import { randomUUID } from "crypto";
 
@@ -311,6 +311,26 @@ const MAX_REQUESTS_PER_WINDOW = 100;
 const rateLimitTracker = new Map<string, { count: number; resetTime: number }>();
 const MAX_RATE_LIMIT_ENTRIES = 10000; // Prevent unbounded growth
 
+// Upper bound for jobs claimed by a worker in one batch claim
+const MAX_CLAIM_BATCH = 50;
+
+// Long-poll claims: longest hold, and how often a held claim re-checks the queue
+// (jobs queued by other processes or reaching scheduled_at emit no local event)
+const MAX_CLAIM_WAIT_SECONDS = 30;
+const CLAIM_RECHECK_MS = 1000;
+
+function waitForQueuedGeoJob(timeoutMs: number): Promise<void> {
+  return new Promise((resolve) => {
+    const done = () => {
+      clearTimeout(timer);
+      geoJobQueueEvents.off('queued', done);
+      resolve();
+    };
+    const timer = setTimeout(done, timeoutMs);
+    geoJobQueueEvents.on('queued', done);
+  });
+}
+
 // Audit log interface
 interface LBACAccessLog {
   userId: string;
@@ -8766,6 +8786,97 @@ export async function registerRoutes(app: Express): Promise<Server> {
     }
   });
 
+  // Claim several jobs in one round trip - POST /api/internal/geo-jobs/claim/batch
+  // Workers keep the extra jobs in a local prefetch queue and release them if unstarted
+  // With waitSeconds > 0 an empty claim is held until a job is queued (long-poll)
+  app.post('/api/internal/geo-jobs/claim/batch', globalSecurityMonitor, authenticateToken, async (req: Request, res: Response) => {
+    try {
+      const { workerId, limit, waitSeconds } = req.body;
+
+      if (!workerId) {
+        return res.status(400).json({ error: 'workerId is required' });
+      }
+
+      if (!req.user || !req.user.id) {
+        return res.status(401).json({ error: 'JWT authentication required' });
+      }
+
+      const requestedLimit = Number(limit ?? 1);
+      if (!Number.isInteger(requestedLimit) || requestedLimit < 1) {
+        return res.status(400).json({ error: 'limit must be a positive integer' });
+      }
+
+      const requestedWait = Number(waitSeconds ?? 0);
+      if (!Number.isFinite(requestedWait) || requestedWait < 0) {
+        return res.status(400).json({ error: 'waitSeconds must be a non-negative number' });
+      }
+
+      // Oversized requests are clamped rather than rejected, so a worker configured
+      // with a larger prefetch or wait still gets jobs
+      const requested = Math.min(requestedLimit, MAX_CLAIM_BATCH);
+      const wait = Math.min(requestedWait, MAX_CLAIM_WAIT_SECONDS);
+
+      // A worker that hung up must not get jobs locked in its name
+      let disconnected = false;
+      res.on('close', () => {
+        disconnected = !res.writableEnded;
+      });
+
+      // Long-poll: hold an empty claim until a job is queued or waitSeconds pass
+      const deadline = Date.now() + wait * 1000;
+      let claimedJobs = await storage.claimGeoJobs(workerId, requested);
+      while (claimedJobs.length === 0 && !disconnected && Date.now() < deadline) {
+        await waitForQueuedGeoJob(Math.min(CLAIM_RECHECK_MS, deadline - Date.now()));
+        if (disconnected) {
+          return;
+        }
+        claimedJobs = await storage.claimGeoJobs(workerId, requested);
+      }
+
+      if (disconnected) {
+        await storage.releaseGeoJobs(claimedJobs.map((job) => job.id), workerId);
+        return;
+      }
+
+      res.json({
+        success: true,
+        data: { jobs: claimedJobs },
+        message: claimedJobs.length ? `Claimed ${claimedJobs.length} jobs` : 'No jobs available'
+      });
+
+    } catch (error) {
+      console.error('Error claiming geo jobs:', error);
+      res.status(500).json({ error: 'Internal server error' });
+    }
+  });
+
+  // Return unstarted claimed jobs to the queue - POST /api/internal/geo-jobs/release
+  app.post('/api/internal/geo-jobs/release', authenticateToken, globalSecurityMonitor, async (req: Request, res: Response) => {
+    try {
+      const { workerId, jobIds } = req.body;
+
+      if (!workerId) {
+        return res.status(400).json({ error: 'workerId is required' });
+      }
+
+      if (!Array.isArray(jobIds) || jobIds.some((jobId) => typeof jobId !== 'string')) {
+        return res.status(400).json({ error: 'jobIds must be an array of job ids' });
+      }
+
+      const releasedJobs = await storage.releaseGeoJobs(jobIds, workerId);
+
+      res.json({
+        success: true,
+        data: { jobIds: releasedJobs.map((job) => job.id) },
+        message: `Released ${releasedJobs.length} jobs`
+      });
+
+    } catch (error) {
+      console.error('Error releasing geo jobs:', error);
+      res.status(500).json({ error: 'Internal server error' });
+    }
+  });
+
   // Update job progress - PATCH /api/internal/geo-jobs/:id/progress
   app.patch('/api/internal/geo-jobs/:id/progress', authenticateToken, globalSecurityMonitor, async (req: Request, res: Response) => {
     try {
@@ -8802,6 +8913,18 @@ export async function registerRoutes(app: Express): Promise<Server> {
 
       const updatedJob = await storage.updateGeoJobHeartbeat(jobId, workerId);
 
+      if (!updatedJob) {
+        // The worker lost the job (cancelled, released or reclaimed): tell it the current status so it stops
+        const job = await storage.getGeoJob(jobId);
+        if (!job) {
+          return res.status(404).json({ error: 'Geo job not found' });
+        }
+        return res.status(409).json({
+          error: 'Geo job is not locked by this worker',
+          data: { job: { id: job.id, status: job.status, lockedBy: job.lockedBy } }
+        });
+      }
+
       res.json({
         success: true,
         data: { job: updatedJob },
@@ -8854,6 +8977,122 @@ export async function registerRoutes(app: Express): Promise<Server> {
     }
   });
 
+  // Signed upload URLs for worker outputs - POST /api/internal/geo-jobs/:id/upload-url
+  // Large artifacts are uploaded as part objects (one signed PUT each) and
+  // composed server-side by /upload-complete
+  app.post('/api/internal/geo-jobs/:id/upload-url', authenticateToken, globalSecurityMonitor, async (req: Request, res: Response) => {
+    try {
+      const jobId = req.params.id;
+      const { fileKey, fileName, fileSize, contentType, parts } = req.body;
+
+      if (typeof fileKey !== 'string' || !fileKey.startsWith(`geo-jobs/${jobId}/output/`) || fileKey.includes('..')) {
+        return res.status(400).json({ error: 'fileKey must be under this job\'s output directory' });
+      }
+
+      const partCount = parts === undefined ? 1 : Number(parts);
+      if (!Number.isInteger(partCount) || partCount < 1 || partCount > MAX_COMPOSE_SOURCES) {
+        return res.status(400).json({ error: `parts must be an integer between 1 and ${MAX_COMPOSE_SOURCES}` });
+      }
+
+      const job = await storage.getGeoJob(jobId);
+      if (!job) {
+        return res.status(404).json({ error: 'Geo job not found' });
+      }
+
+      const objectStorage = new ObjectStorageService();
+      const expiresIn = 900;
+
+      if (partCount === 1) {
+        const uploadUrl = await objectStorage.generateUploadUrl(fileKey, expiresIn);
+        return res.json({
+          success: true,
+          data: { uploadUrl, fileKey, expiresIn, fileName, fileSize, contentType }
+        });
+      }
+
+      const partUrls = await Promise.all(
+        Array.from({ length: partCount }, async (_, index) => {
+          const partKey = `${fileKey}.parts/${String(index + 1).padStart(5, '0')}`;
+          return {
+            partNumber: index + 1,
+            fileKey: partKey,
+            uploadUrl: await objectStorage.generateUploadUrl(partKey, expiresIn)
+          };
+        })
+      );
+
+      res.json({
+        success: true,
+        data: { fileKey, expiresIn, fileName, fileSize, contentType, parts: partUrls }
+      });
+
+    } catch (error) {
+      console.error('Error generating worker upload URL:', error);
+      res.status(500).json({ error: 'Internal server error' });
+    }
+  });
+
+  // Complete a multipart upload - POST /api/internal/geo-jobs/:id/upload-complete
+  app.post('/api/internal/geo-jobs/:id/upload-complete', authenticateToken, globalSecurityMonitor, async (req: Request, res: Response) => {
+    try {
+      const jobId = req.params.id;
+      const { fileKey, parts, contentType } = req.body;
+
+      if (typeof fileKey !== 'string' || !fileKey.startsWith(`geo-jobs/${jobId}/output/`) || fileKey.includes('..')) {
+        return res.status(400).json({ error: 'fileKey must be under this job\'s output directory' });
+      }
+
+      if (!Array.isArray(parts) || parts.length === 0 || parts.length > MAX_COMPOSE_SOURCES ||
+          !parts.every((partKey: unknown) => typeof partKey === 'string' && partKey.startsWith(`${fileKey}.parts/`))) {
+        return res.status(400).json({ error: 'parts must list the part keys issued for this fileKey' });
+      }
+
+      const objectStorage = new ObjectStorageService();
+      await objectStorage.composeObjects(parts, fileKey, contentType);
+
+      res.json({
+        success: true,
+        data: { fileKey, parts: parts.length },
+        message: 'Upload completed successfully'
+      });
+
+    } catch (error) {
+      console.error('Error completing worker upload:', error);
+      res.status(500).json({ error: 'Internal server error' });
+    }
+  });
+
+  // Abort a multipart upload - POST /api/internal/geo-jobs/:id/upload-abort
+  // Deletes the part objects already uploaded for fileKey
+  app.post('/api/internal/geo-jobs/:id/upload-abort', authenticateToken, globalSecurityMonitor, async (req: Request, res: Response) => {
+    try {
+      const jobId = req.params.id;
+      const { fileKey, parts } = req.body;
+
+      if (typeof fileKey !== 'string' || !fileKey.startsWith(`geo-jobs/${jobId}/output/`) || fileKey.includes('..')) {
+        return res.status(400).json({ error: 'fileKey must be under this job\'s output directory' });
+      }
+
+      if (!Array.isArray(parts) || parts.length === 0 || parts.length > MAX_COMPOSE_SOURCES ||
+          !parts.every((partKey: unknown) => typeof partKey === 'string' && partKey.startsWith(`${fileKey}.parts/`))) {
+        return res.status(400).json({ error: 'parts must list the part keys issued for this fileKey' });
+      }
+
+      const objectStorage = new ObjectStorageService();
+      await objectStorage.deleteObjects(parts);
+
+      res.json({
+        success: true,
+        data: { fileKey, parts: parts.length },
+        message: 'Upload aborted successfully'
+      });
+
+    } catch (error) {
+      console.error('Error aborting worker upload:', error);
+      res.status(500).json({ error: 'Internal server error' });
+    }
+  });
+
   // =============================================
   // GEOPROCESSING FILE MANAGEMENT
   // =============================================
@@ -80,8 +80,13 @@ import {
 import { db } from "./db";
 import { eq, like, ilike, and, or, desc, asc, sql, count, inArray, isNotNull } from "drizzle-orm";
 import { randomUUID } from "crypto";
+import { EventEmitter } from "events";
 import { PaginationParams, PaginatedResponse, executePaginatedQuery } from "./pagination";
 
+// Emits 'queued' when geo jobs become claimable through this process (wakes long-poll claims)
+export const geoJobQueueEvents = new EventEmitter();
+geoJobQueueEvents.setMaxListeners(0);
+
 export interface IStorage {
   // User management
   getUser(id: string): Promise<User | undefined>;
@@ -1187,8 +1192,10 @@ export interface IStorage {
 
   // Queue operations for Python Worker
   claimNextGeoJob(workerId: string): Promise<GeoJob | undefined>;
+  claimGeoJobs(workerId: string, limit: number): Promise<GeoJob[]>;
+  releaseGeoJobs(ids: string[], workerId: string): Promise<GeoJob[]>;
   updateGeoJobProgress(id: string, progress: number, message?: string): Promise<GeoJob>;
-  updateGeoJobHeartbeat(id: string, workerId: string): Promise<GeoJob>;
+  updateGeoJobHeartbeat(id: string, workerId: string): Promise<GeoJob | undefined>;
   completeGeoJob(id: string, outputPayload: any, outputKeys: string[]): Promise<GeoJob>;
   failGeoJob(id: string, error: any): Promise<GeoJob>;
   cancelGeoJob(id: string, reason?: string): Promise<GeoJob>;
@@ -8027,6 +8034,10 @@ export class DatabaseStorage implements IStorage {
         message: 'Job created successfully'
       });
 
+      if (newJob.status === 'queued') {
+        geoJobQueueEvents.emit('queued', newJob.id);
+      }
+
       return newJob;
     } catch (error) {
       console.error('Failed to create geo job:', error);
@@ -8107,6 +8118,92 @@ export class DatabaseStorage implements IStorage {
     }
   }
 
+  async claimGeoJobs(workerId: string, limit: number): Promise<GeoJob[]> {
+    try {
+      // Same SKIP LOCKED claim as claimNextGeoJob, for up to `limit` jobs in one statement
+      const result = await db.execute(sql`
+        UPDATE geo_jobs 
+        SET 
+          status = 'running',
+          locked_by = ${workerId},
+          locked_at = NOW(),
+          heartbeat_at = NOW(),
+          started_at = NOW()
+        WHERE id IN (
+          SELECT id FROM geo_jobs 
+          WHERE status = 'queued' 
+          AND (scheduled_at IS NULL OR scheduled_at <= NOW())
+          ORDER BY priority ASC, created_at ASC
+          FOR UPDATE SKIP LOCKED
+          LIMIT ${limit}
+        )
+        RETURNING *;
+      `);
+
+      const claimedJobs = result.rows as any[];
+      // RETURNING does not preserve the queue order
+      claimedJobs.sort((a, b) =>
+        (a.priority - b.priority) || (new Date(a.created_at).getTime() - new Date(b.created_at).getTime())
+      );
+
+      await Promise.all(claimedJobs.map((claimedJob) => this.createGeoJobEvent({
+        jobId: claimedJob.id,
+        eventType: 'worker_assigned',
+        fromStatus: 'queued',
+        toStatus: 'running',
+        message: `Job claimed by worker ${workerId} (batch of ${claimedJobs.length})`,
+        workerId
+      })));
+
+      return claimedJobs;
+    } catch (error) {
+      console.error('Failed to claim geo jobs:', error);
+      return [];
+    }
+  }
+
+  async releaseGeoJobs(ids: string[], workerId: string): Promise<GeoJob[]> {
+    try {
+      if (ids.length === 0) {
+        return [];
+      }
+
+      // Only jobs still locked by this worker go back to the queue
+      const releasedJobs = await db.update(geoJobs)
+        .set({
+          status: 'queued',
+          lockedBy: null,
+          lockedAt: null,
+          heartbeatAt: null,
+          startedAt: null
+        })
+        .where(and(
+          inArray(geoJobs.id, ids),
+          eq(geoJobs.lockedBy, workerId),
+          eq(geoJobs.status, 'running')
+        ))
+        .returning();
+
+      await Promise.all(releasedJobs.map((releasedJob) => this.createGeoJobEvent({
+        jobId: releasedJob.id,
+        eventType: 'status_change',
+        fromStatus: 'running',
+        toStatus: 'queued',
+        message: `Job released unstarted by worker ${workerId}`,
+        workerId
+      })));
+
+      if (releasedJobs.length > 0) {
+        geoJobQueueEvents.emit('queued', ...releasedJobs.map((job) => job.id));
+      }
+
+      return releasedJobs;
+    } catch (error) {
+      console.error('Failed to release geo jobs:', error);
+      throw error;
+    }
+  }
+
   async updateGeoJobProgress(id: string, progress: number, message?: string): Promise<GeoJob> {
     try {
       const [updatedJob] = await db.update(geoJobs)
@@ -8138,17 +8235,14 @@ export class DatabaseStorage implements IStorage {
     }
   }
 
-  async updateGeoJobHeartbeat(id: string, workerId: string): Promise<GeoJob> {
+  async updateGeoJobHeartbeat(id: string, workerId: string): Promise<GeoJob | undefined> {
     try {
+      // undefined when the job is no longer locked by this worker (cancelled, released or reclaimed)
       const [updatedJob] = await db.update(geoJobs)
         .set({ heartbeatAt: new Date() })
         .where(and(eq(geoJobs.id, id), eq(geoJobs.lockedBy, workerId)))
         .returning();
 
-      if (!updatedJob) {
-        throw new Error('Geo job not found or not owned by worker');
-      }
-
       return updatedJob;
     } catch (error) {
       console.error('Failed to update geo job heartbeat:', error);
@@ -0,0 +1,195 @@
+/**
+ * Geo Jobs Batch Claim / Release Contract Tests
+ * Yemen Digital Construction Platform - Geoprocessing Queue
+ *
+ * يتحقق من عقد الـ batch claim والـ long-poll والـ release الذي يعتمد عليه الـ Python worker:
+ * قصّ limit وwaitSeconds، ورد 404 من الخوادم القديمة للعودة إلى claim واحد،
+ * وإرجاع الـ jobs التي ما زالت مقفلة باسم الـ worker فقط عند الـ release
+ */
+
+import { describe, it, expect, beforeAll, afterEach, vi } from 'vitest';
+import request from 'supertest';
+import express from 'express';
+import jwt from 'jsonwebtoken';
+import { registerRoutes } from '../server/routes';
+import { storage } from '../server/storage';
+
+let app: express.Express;
+let token: string;
+
+const WORKER_ID = 'worker-test1234';
+const JOB_ID = '00000000-0000-4000-8000-000000000001';
+const OTHER_JOB_ID = '00000000-0000-4000-8000-000000000002';
+
+describe('🧪 POST /api/internal/geo-jobs/claim/batch', () => {
+  beforeAll(async () => {
+    app = express();
+    app.use(express.json());
+    registerRoutes(app);
+    token = jwt.sign({ userId: 'geo-worker', role: 'worker' }, process.env.JWT_SECRET!, { expiresIn: '1h' });
+  });
+
+  afterEach(() => {
+    vi.useRealTimers();
+    vi.restoreAllMocks();
+  });
+
+  it('✅ returns the claimed jobs', async () => {
+    const claimGeoJobs = vi.spyOn(storage, 'claimGeoJobs').mockResolvedValue([
+      { id: JOB_ID, status: 'running', lockedBy: WORKER_ID },
+      { id: OTHER_JOB_ID, status: 'running', lockedBy: WORKER_ID }
+    ] as any);
+
+    const response = await request(app)
+      .post('/api/internal/geo-jobs/claim/batch')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ workerId: WORKER_ID, limit: 2 });
+
+    expect(response.status).toBe(200);
+    expect(response.body.data.jobs.map((job: any) => job.id)).toEqual([JOB_ID, OTHER_JOB_ID]);
+    expect(claimGeoJobs).toHaveBeenCalledWith(WORKER_ID, 2);
+  });
+
+  it('📏 clamps limit to 50', async () => {
+    const claimGeoJobs = vi.spyOn(storage, 'claimGeoJobs').mockResolvedValue([
+      { id: JOB_ID, status: 'running', lockedBy: WORKER_ID }
+    ] as any);
+
+    const response = await request(app)
+      .post('/api/internal/geo-jobs/claim/batch')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ workerId: WORKER_ID, limit: 500 });
+
+    expect(response.status).toBe(200);
+    expect(claimGeoJobs).toHaveBeenCalledWith(WORKER_ID, 50);
+  });
+
+  it('⏱️ clamps waitSeconds to 30', async () => {
+    // Only Date is faked: each claim moves the clock 10s, so a 30s hold claims
+    // three times (t=0, 10, 20) while an unclamped 120s hold would claim twelve
+    vi.useFakeTimers({ toFake: ['Date'] });
+    const claimGeoJobs = vi.spyOn(storage, 'claimGeoJobs').mockImplementation(async () => {
+      vi.setSystemTime(Date.now() + 10_000);
+      return [];
+    });
+
+    const response = await request(app)
+      .post('/api/internal/geo-jobs/claim/batch')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ workerId: WORKER_ID, limit: 1, waitSeconds: 120 });
+
+    expect(response.status).toBe(200);
+    expect(response.body.data.jobs).toEqual([]);
+    expect(claimGeoJobs).toHaveBeenCalledTimes(3);
+  });
+
+  it('📭 answers an empty claim with 200 and no jobs, never 404', async () => {
+    // The worker reads 404 as "batch claim not supported" and stops using it for good
+    vi.spyOn(storage, 'claimGeoJobs').mockResolvedValue([]);
+
+    const response = await request(app)
+      .post('/api/internal/geo-jobs/claim/batch')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ workerId: WORKER_ID, limit: 5 });
+
+    expect(response.status).toBe(200);
+    expect(response.body.data.jobs).toEqual([]);
+  });
+
+  it('❌ rejects a limit or waitSeconds that is not a number', async () => {
+    const claimGeoJobs = vi.spyOn(storage, 'claimGeoJobs').mockResolvedValue([]);
+
+    const badLimit = await request(app)
+      .post('/api/internal/geo-jobs/claim/batch')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ workerId: WORKER_ID, limit: 'many' });
+    const badWait = await request(app)
+      .post('/api/internal/geo-jobs/claim/batch')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ workerId: WORKER_ID, waitSeconds: -1 });
+
+    expect(badLimit.status).toBe(400);
+    expect(badWait.status).toBe(400);
+    expect(claimGeoJobs).not.toHaveBeenCalled();
+  });
+
+  it('❌ requires workerId', async () => {
+    const response = await request(app)
+      .post('/api/internal/geo-jobs/claim/batch')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ limit: 2 });
+
+    expect(response.status).toBe(400);
+  });
+});
+
+describe('🧪 Batch claim fallback for servers without /claim/batch', () => {
+  it('↩️ an older server answers 404 and still serves the single-job claim', async () => {
+    // An older server: only the single-job claim, then the JSON 404 handler from server/index.ts
+    const legacyApp = express();
+    legacyApp.use(express.json());
+    legacyApp.post('/api/internal/geo-jobs/claim', (_req, res) => {
+      res.json({ success: true, data: { job: { id: JOB_ID, status: 'running' } } });
+    });
+    legacyApp.use('/api', (_req, res) => {
+      res.status(404).json({ message: 'API endpoint not found' });
+    });
+
+    const batch = await request(legacyApp)
+      .post('/api/internal/geo-jobs/claim/batch')
+      .send({ workerId: WORKER_ID, limit: 5, waitSeconds: 20 });
+    const single = await request(legacyApp)
+      .post('/api/internal/geo-jobs/claim')
+      .send({ workerId: WORKER_ID });
+
+    expect(batch.status).toBe(404);
+    expect(single.status).toBe(200);
+    expect(single.body.data.job.id).toBe(JOB_ID);
+  });
+});
+
+describe('🧪 POST /api/internal/geo-jobs/release', () => {
+  beforeAll(async () => {
+    app = express();
+    app.use(express.json());
+    registerRoutes(app);
+    token = jwt.sign({ userId: 'geo-worker', role: 'worker' }, process.env.JWT_SECRET!, { expiresIn: '1h' });
+  });
+
+  afterEach(() => {
+    vi.restoreAllMocks();
+  });
+
+  it('🔒 returns only the jobs still locked by the calling worker', async () => {
+    // OTHER_JOB_ID was reclaimed by another worker, so storage does not release it
+    const releaseGeoJobs = vi.spyOn(storage, 'releaseGeoJobs').mockResolvedValue([
+      { id: JOB_ID, status: 'queued', lockedBy: null }
+    ] as any);
+
+    const response = await request(app)
+      .post('/api/internal/geo-jobs/release')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ workerId: WORKER_ID, jobIds: [JOB_ID, OTHER_JOB_ID] });
+
+    expect(response.status).toBe(200);
+    expect(response.body.data.jobIds).toEqual([JOB_ID]);
+    expect(releaseGeoJobs).toHaveBeenCalledWith([JOB_ID, OTHER_JOB_ID], WORKER_ID);
+  });
+
+  it('❌ requires workerId and an array of job ids', async () => {
+    const releaseGeoJobs = vi.spyOn(storage, 'releaseGeoJobs').mockResolvedValue([]);
+
+    const noWorker = await request(app)
+      .post('/api/internal/geo-jobs/release')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ jobIds: [JOB_ID] });
+    const badIds = await request(app)
+      .post('/api/internal/geo-jobs/release')
+      .set('Authorization', `Bearer ${token}`)
+      .send({ workerId: WORKER_ID, jobIds: JOB_ID });
+
+    expect(noWorker.status).toBe(400);
+    expect(badIds.status).toBe(400);
+    expect(releaseGeoJobs).not.toHaveBeenCalled();
+  });
+});
@@ -0,0 +1,92 @@
+/**
+ * Geo Jobs Heartbeat Contract Tests
+ * Yemen Digital Construction Platform - Geoprocessing Queue
+ *
+ * يتحقق من أن الـ worker يعرف من رد الـ heartbeat أن الـ job أُلغي أو لم يعد له،
+ * وهو ما يعتمد عليه الـ Python worker (job_lost) لإيقاف المعالجة وحذف الـ jobs المطلوبة مسبقًا
+ */
+
+import { describe, it, expect, beforeAll, afterEach, vi } from 'vitest';
+import request from 'supertest';
+import express from 'express';
+import { registerRoutes } from '../server/routes';
+import { storage } from '../server/storage';
+
+let app: express.Express;
+
+const WORKER_ID = 'worker-test1234';
+const JOB_ID = '00000000-0000-4000-8000-000000000001';
+
+describe('🧪 PATCH /api/internal/geo-jobs/:id/heartbeat', () => {
+  beforeAll(async () => {
+    app = express();
+    app.use(express.json());
+    registerRoutes(app);
+  });
+
+  afterEach(() => {
+    vi.restoreAllMocks();
+  });
+
+  it('✅ returns the job while it is locked by the worker', async () => {
+    vi.spyOn(storage, 'updateGeoJobHeartbeat').mockResolvedValue({
+      id: JOB_ID, status: 'running', lockedBy: WORKER_ID
+    } as any);
+
+    const response = await request(app)
+      .patch(`/api/internal/geo-jobs/${JOB_ID}/heartbeat`)
+      .send({ workerId: WORKER_ID });
+
+    expect(response.status).toBe(200);
+    expect(response.body.data.job.status).toBe('running');
+    expect(response.body.data.job.lockedBy).toBe(WORKER_ID);
+  });
+
+  it('🛑 returns 409 with the cancelled status after the job is cancelled', async () => {
+    // cancelGeoJob clears lockedBy, so the heartbeat update matches no row
+    vi.spyOn(storage, 'updateGeoJobHeartbeat').mockResolvedValue(undefined);
+    vi.spyOn(storage, 'getGeoJob').mockResolvedValue({
+      id: JOB_ID, status: 'cancelled', lockedBy: null
+    } as any);
+
+    const response = await request(app)
+      .patch(`/api/internal/geo-jobs/${JOB_ID}/heartbeat`)
+      .send({ workerId: WORKER_ID });
+
+    expect(response.status).toBe(409);
+    expect(response.body.data.job).toEqual({ id: JOB_ID, status: 'cancelled', lockedBy: null });
+  });
+
+  it('🔁 returns 409 with the new owner when another worker took the job over', async () => {
+    vi.spyOn(storage, 'updateGeoJobHeartbeat').mockResolvedValue(undefined);
+    vi.spyOn(storage, 'getGeoJob').mockResolvedValue({
+      id: JOB_ID, status: 'running', lockedBy: 'worker-other'
+    } as any);
+
+    const response = await request(app)
+      .patch(`/api/internal/geo-jobs/${JOB_ID}/heartbeat`)
+      .send({ workerId: WORKER_ID });
+
+    expect(response.status).toBe(409);
+    expect(response.body.data.job.lockedBy).toBe('worker-other');
+  });
+
+  it('❓ returns 404 for an unknown job', async () => {
+    vi.spyOn(storage, 'updateGeoJobHeartbeat').mockResolvedValue(undefined);
+    vi.spyOn(storage, 'getGeoJob').mockResolvedValue(undefined);
+
+    const response = await request(app)
+      .patch(`/api/internal/geo-jobs/${JOB_ID}/heartbeat`)
+      .send({ workerId: WORKER_ID });
+
+    expect(response.status).toBe(404);
+  });
+
+  it('❌ requires workerId', async () => {
+    const response = await request(app)
+      .patch(`/api/internal/geo-jobs/${JOB_ID}/heartbeat`)
+      .send({});
+
+    expect(response.status).toBe(400);
+  });
+});